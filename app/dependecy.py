@@ -3,12 +3,11 @@ from typing import Annotated
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from tortoise.query_utils import Prefetch
 from tortoise.expressions import Q
 
 from jose import jwt, JWTError
 
-from app.lib import environment
+from app.lib import auth, environment, organization, pagination
 from app.model import (
     User,
     Organization,
@@ -42,11 +41,11 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         if username is None:
             raise credentials_exception
 
-        token_data = specs.TokenDataSpec(username=username)
+        token_data = specs.TokenDataSpec(username=username, user_id=payload.get("uid"))
     except JWTError as e:
         raise credentials_exception
 
-    user = await User.filter(stake_address=token_data.username).first()
+    user = await auth.get_token_user(token_data.user_id, token_data.username)
     if user is None:
         raise credentials_exception
 
@@ -66,22 +65,23 @@ async def get_current_user_membership(
     current_user: Annotated[User, Depends(get_current_active_user)],
     organization_identifier: str,
 ):
-    organization = await Organization.filter(identifier=organization_identifier).first()
-    if organization is None:
-        raise HTTPException(status_code=400, detail="Organization does not exist")
-
-    organization_membership = await OrganizationMembership.filter(
-        Q(user=current_user) & Q(organization=organization)
-    ).first()
+    # FastAPI resolves this once per request, even when used by other dependencies
+    organization_membership = (
+        await OrganizationMembership.filter(
+            user_id=current_user.id, organization__identifier=organization_identifier
+        )
+        .select_related("user", "organization")
+        .first()
+    )
 
     if organization_membership is None:
+        if await organization.get_organization(organization_identifier) is None:
+            raise HTTPException(status_code=400, detail="Organization does not exist")
+
         raise HTTPException(
             status_code=400, detail="User is not member of this organization"
         )
 
-    await organization_membership.fetch_related("user")
-    await organization_membership.fetch_related("organization")
-
     return organization_membership
 
 
@@ -136,13 +136,10 @@ async def get_current_active_group_membership(
 async def get_task(organization_identifier: str, task_identifier: str):
     task = (
         await Task.filter(
-            Q(identifier=task_identifier)
-            & Q(
-                Q(owner_membership__organization__identifier=organization_identifier)
-                | Q(group__organization__identifier=organization_identifier)
-            )
+            organization__identifier=organization_identifier,
+            identifier=task_identifier,
         )
-        .prefetch_related("owner_membership", "group")
+        .select_related("owner_membership", "group")
         .first()
     )
     if task is None:
@@ -154,11 +151,11 @@ async def get_task(organization_identifier: str, task_identifier: str):
 async def get_individual_task(organization_identifier: str, task_identifier: str):
     task = (
         await Task.filter(
-            Q(identifier=task_identifier)
-            & Q(owner_membership__organization__identifier=organization_identifier)
-            & Q(is_individual=True)
+            organization__identifier=organization_identifier,
+            identifier=task_identifier,
+            is_individual=True,
         )
-        .prefetch_related("owner_membership")
+        .select_related("owner_membership")
         .first()
     )
     if task is None:
@@ -170,14 +167,24 @@ async def get_individual_task(organization_identifier: str, task_identifier: str
 async def get_group_task(organization_identifier: str, task_identifier: str):
     task = (
         await Task.filter(
-            Q(identifier=task_identifier)
-            & Q(group__organization__identifier=organization_identifier)
-            & Q(is_individual=False)
+            organization__identifier=organization_identifier,
+            identifier=task_identifier,
+            is_individual=False,
         )
-        .prefetch_related("group")
+        .select_related("group")
         .first()
     )
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
     return task
+
+
+async def get_page_cursor(cursor: str | None = None):
+    if cursor is None:
+        return None
+
+    try:
+        return pagination.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
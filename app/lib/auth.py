@@ -1,7 +1,8 @@
 from app.model import User, UserType, OrganizationMembership, Task
-from app.lib import cardano, environment, group
+from app.lib import cache, cardano, environment, group
 
 from jose import jwt
+import copy
 import datetime
 
 
@@ -9,15 +10,23 @@ ALGORITHM = environment.get("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = environment.get("ACCESS_TOKEN_EXPIRE_MINUTES", int)
 SECRET_KEY = environment.get("SECRET_KEY")
 
+# Seconds authenticated users are kept in memory, 0 disables it
+USER_CACHE_TTL = environment.get("USER_CACHE_TTL", int, 30)
+
+user_cache = cache.TTLCache(USER_CACHE_TTL, max_size=10_000)
+
 
 async def authenticate_user(stake_address: str, signature: str) -> User | None:
-    if not cardano.verify_signature(signature, stake_address):
+    if not await cardano.verify_signature_async(signature, stake_address):
         return None
 
     user = await User.filter(stake_address=stake_address).first()
     if not user:
         return None
 
+    if not cardano.use_signature(signature, stake_address):
+        return None
+
     return user
 
 
@@ -31,6 +40,44 @@ def create_access_token(data: dict, expires_delta: datetime.timedelta):
     return encoded_jwt
 
 
+def create_user_access_token(user: User, expires_delta: datetime.timedelta):
+    # Only what identifies the user, the rest is read from the user cache so it
+    # can not go stale in a token
+    return create_access_token(
+        {"sub": user.stake_address, "uid": user.id}, expires_delta
+    )
+
+
+async def get_token_user(user_id: int | None, stake_address: str) -> User | None:
+    """Get the user a token was issued to, reading it from the user cache when
+    possible. Tokens issued before they carried the user id are looked up by
+    stake address."""
+    user = user_cache.get(user_id) if user_id is not None else None
+
+    if user is None:
+        if user_id is not None:
+            user = await User.filter(id=user_id).first()
+        else:
+            user = await User.filter(stake_address=stake_address).first()
+
+        if user is None:
+            return None
+
+        user_cache.set(user.id, user)
+
+    if user.stake_address != stake_address:
+        return None
+
+    # Callers may change their copy, the cached one only changes on invalidation
+    return copy.copy(user)
+
+
+def invalidate_user(user: User):
+    """Must be called whenever a user is changed, so other requests do not
+    authorize with the outdated one."""
+    user_cache.delete(user.id)
+
+
 def has_review_privileges(user: User):
     return user.type in [
         UserType.TEACHER.value,
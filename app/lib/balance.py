@@ -1,170 +1,720 @@
-from app.model import User, UserBalance, Organization, OrganizationMembership, TaskFund
+from app.model import (
+    User,
+    UserBalance,
+    Organization,
+    OrganizationMembership,
+    MembershipBalanceSnapshot,
+    Task,
+    TaskFund,
+    TaskReward,
+)
 
 from tortoise.expressions import Q
-from typing import Tuple, List
+from tortoise.functions import Sum, Max, Count
+from tortoise.transactions import in_transaction
+from typing import AsyncIterator, Tuple, List, Dict, Optional
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 
 import datetime
+import asyncio
+import logging
+
+
+@dataclass(frozen=True)
+class BalanceSummary:
+    owed: int = 0
+    escrowed: int = 0
+    claimed: int = 0
+    last_claim_date: Optional[datetime.datetime] = None
+
+    @property
+    def available(self) -> int:
+        return self.owed - self.escrowed
+
+    def __add__(self, other: "BalanceSummary") -> "BalanceSummary":
+        claim_dates = [
+            date for date in (self.last_claim_date, other.last_claim_date) if date
+        ]
+
+        return BalanceSummary(
+            owed=self.owed + other.owed,
+            escrowed=self.escrowed + other.escrowed,
+            claimed=self.claimed + other.claimed,
+            last_claim_date=max(claim_dates) if claim_dates else None,
+        )
 
 
-async def get_user_owed_balance(
+# Pending snapshot changes, keyed by organization membership id
+SnapshotDeltas = Dict[int, BalanceSummary]
+
+
+class InsufficientBalanceError(ValueError):
+    def __init__(self, available: int):
+        super().__init__(f"Not enough balance, only {available} available")
+
+        self.available = available
+
+
+async def summarize_balances(
+    membership_ids: List[int],
+) -> Dict[int, BalanceSummary]:
+    # One grouped aggregate over the ledger, each total being a filtered SUM
+    rows = (
+        await UserBalance.filter(user_member_id__in=membership_ids)
+        .annotate(
+            owed=Sum("amount", _filter=Q(is_claimed=False)),
+            escrowed=Sum("amount", _filter=Q(is_claimed=False) & Q(is_escrowed=True)),
+            claimed=Sum(
+                "amount",
+                _filter=Q(is_claimed=True)
+                & Q(is_escrowed=False)
+                & Q(compacted_into_id__isnull=True),
+            ),
+            last_claim_date=Max(
+                "claim_date",
+                _filter=Q(is_claimed=True) & Q(compacted_into_id__isnull=True),
+            ),
+        )
+        .group_by("user_member_id")
+        .values("user_member_id", "owed", "escrowed", "claimed", "last_claim_date")
+    )
+
+    summaries = {membership_id: BalanceSummary() for membership_id in membership_ids}
+    for row in rows:
+        summaries[row["user_member_id"]] = BalanceSummary(
+            owed=int(row["owed"] or 0),
+            escrowed=int(row["escrowed"] or 0),
+            claimed=int(row["claimed"] or 0),
+            last_claim_date=row["last_claim_date"],
+        )
+
+    return summaries
+
+
+def snapshot_summary(snapshot: MembershipBalanceSnapshot) -> BalanceSummary:
+    return BalanceSummary(
+        owed=snapshot.owed,
+        escrowed=snapshot.escrowed,
+        claimed=snapshot.claimed,
+        last_claim_date=snapshot.last_claim_date,
+    )
+
+
+async def get_user_balance_summary(
     user_membership: OrganizationMembership,
-) -> int:
-    owed_balances = await UserBalance.filter(
-        Q(user_member=user_membership) & Q(is_claimed=False)
-    ).all()
+) -> BalanceSummary:
+    snapshot = await MembershipBalanceSnapshot.filter(
+        user_member_id=user_membership.id
+    ).first()
+    if snapshot is not None:
+        return snapshot_summary(snapshot)
 
-    owed_balance = 0
-    for balance in owed_balances:
-        owed_balance += balance.amount
+    # Membership was never written through this module, read the ledger instead
+    summaries = await summarize_balances([user_membership.id])
 
-    return owed_balance
+    return summaries[user_membership.id]
 
 
-async def get_user_available_balance(
+async def get_user_owed_balance(
     user_membership: OrganizationMembership,
 ) -> int:
-    available_balances = await UserBalance.filter(
-        Q(user_member=user_membership) & Q(is_escrowed=False) & Q(is_claimed=False)
-    ).all()
+    return (await get_user_balance_summary(user_membership)).owed
 
-    available_balance = 0
-    for balance in available_balances:
-        available_balance += balance.amount
 
-    return available_balance
+async def get_user_available_balance(
+    user_membership: OrganizationMembership,
+) -> int:
+    return (await get_user_balance_summary(user_membership)).available
 
 
 async def get_user_escrowed_balance(
     user_membership: OrganizationMembership,
 ) -> int:
-    escrowed_balances = await UserBalance.filter(
-        Q(user_member=user_membership) & Q(is_escrowed=True) & Q(is_claimed=False)
-    ).all()
-
-    escrowed_balance = 0
-    for balance in escrowed_balances:
-        escrowed_balance += balance.amount
-
-    return escrowed_balance
+    return (await get_user_balance_summary(user_membership)).escrowed
 
 
 async def get_user_claimed_balance(
     user_membership: OrganizationMembership,
 ) -> int:
-    claimed_balances = await UserBalance.filter(
-        Q(user_member=user_membership) & Q(is_claimed=True) & Q(is_escrowed=False)
-    ).all()
+    return (await get_user_balance_summary(user_membership)).claimed
 
-    claimed_balance = 0
-    for balance in claimed_balances:
-        claimed_balance += balance.amount
 
-    return claimed_balance
+def balance_contribution(balance: UserBalance, sign: int = 1) -> BalanceSummary:
+    amount = sign * balance.amount
 
+    if balance.is_claimed:
+        return BalanceSummary(
+            claimed=0 if balance.is_escrowed else amount,
+            last_claim_date=balance.claim_date if sign > 0 else None,
+        )
 
-async def collect_amount(
-    user_membership: OrganizationMembership, amount: int
-) -> Tuple[List["UserBalance"], int]:
-    owed_balances = (
-        await UserBalance.filter(
-            Q(user_member=user_membership) & Q(is_claimed=False) & Q(is_escrowed=False)
+    return BalanceSummary(owed=amount, escrowed=amount if balance.is_escrowed else 0)
+
+
+def track_delta(deltas: SnapshotDeltas, membership_id: int, delta: BalanceSummary):
+    deltas[membership_id] = deltas.get(membership_id, BalanceSummary()) + delta
+
+
+async def apply_snapshot_deltas(deltas: SnapshotDeltas):
+    if len(deltas) == 0:
+        return
+
+    now = datetime.datetime.utcnow()
+
+    existing_ids = set(
+        await MembershipBalanceSnapshot.filter(
+            user_member_id__in=list(deltas.keys())
+        ).values_list("user_member_id", flat=True)
+    )
+    missing_ids = [
+        membership_id for membership_id in deltas if membership_id not in existing_ids
+    ]
+    if len(missing_ids) > 0:
+        # Memberships without a snapshot yet get one computed from the ledger
+        # without the changes being applied, which are added below as for any
+        # other snapshot. Another transaction may be creating it at the same
+        # time, its row being the one updated then
+        summaries = await summarize_balances(missing_ids)
+        await MembershipBalanceSnapshot.bulk_create(
+            [
+                MembershipBalanceSnapshot(
+                    user_member_id=membership_id,
+                    owed=summary.owed - deltas[membership_id].owed,
+                    escrowed=summary.escrowed - deltas[membership_id].escrowed,
+                    claimed=summary.claimed - deltas[membership_id].claimed,
+                    last_claim_date=summary.last_claim_date,
+                    update_date=now,
+                )
+                for membership_id, summary in summaries.items()
+            ],
+            ignore_conflicts=True,
         )
-        .order_by("amount")
-        .all()
+
+    # Locks the snapshot rows until the surrounding transaction ends, always
+    # in the same order so transactions sharing members can not deadlock
+    snapshots = (
+        await MembershipBalanceSnapshot.filter(user_member_id__in=list(deltas.keys()))
+        .order_by("user_member_id")
+        .select_for_update()
     )
 
-    collected: List["UserBalance"] = []
-    total_balance = 0
-    for balance in owed_balances:
-        collected.append(balance)
-        total_balance += balance.amount
+    for snapshot in snapshots:
+        updated = snapshot_summary(snapshot) + deltas[snapshot.user_member_id]
 
-        if total_balance >= amount:
-            break
+        snapshot.owed = updated.owed
+        snapshot.escrowed = updated.escrowed
+        snapshot.claimed = updated.claimed
+        snapshot.last_claim_date = updated.last_claim_date
+        snapshot.update_date = now
 
-    return (collected, total_balance - amount)
+    if len(snapshots) > 0:
+        await MembershipBalanceSnapshot.bulk_update(
+            snapshots,
+            fields=["owed", "escrowed", "claimed", "last_claim_date", "update_date"],
+        )
 
 
-async def claim_balance(balance: UserBalance):
-    balance.is_claimed = True
-    balance.claim_date = datetime.datetime.utcnow()
-    await balance.save()
+@asynccontextmanager
+async def ledger_write(
+    deltas: Optional[SnapshotDeltas] = None,
+) -> AsyncIterator[SnapshotDeltas]:
+    # Nested writes share the outermost deltas, which are applied once on exit
+    if deltas is not None:
+        yield deltas
+        return
+
+    async with in_transaction():
+        deltas = {}
+        yield deltas
 
+        await apply_snapshot_deltas(deltas)
 
-async def escrow_balance(balance: UserBalance, task_fund: TaskFund):
-    balance.is_escrowed = True
-    balance.escrow_task_fund = task_fund
-    
-    await balance.save()
 
+async def lock_balance(user_membership_id: int) -> BalanceSummary:
+    """Lock the balance of a membership until the surrounding transaction ends.
 
-async def release_balance(balance: UserBalance):
-    await balance.fetch_related("user_member")
-    await balance.fetch_related("escrow_task_fund")
-    await balance.escrow_task_fund.fetch_related("task")
-    await balance.escrow_task_fund.task.fetch_related("owner_membership")
+    The snapshot row works as the lock, so concurrent writes to the same
+    balance are serialized and the returned summary stays valid meanwhile.
+    """
+    locked = (
+        MembershipBalanceSnapshot.filter(user_member_id=user_membership_id)
+        .order_by("user_member_id")
+        .select_for_update()
+    )
+
+    snapshot = await locked.first()
+    if snapshot is None:
+        summary = (await summarize_balances([user_membership_id]))[user_membership_id]
+
+        # Another transaction may be creating it at the same time
+        await MembershipBalanceSnapshot.bulk_create(
+            [
+                MembershipBalanceSnapshot(
+                    user_member_id=user_membership_id,
+                    owed=summary.owed,
+                    escrowed=summary.escrowed,
+                    claimed=summary.claimed,
+                    last_claim_date=summary.last_claim_date,
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        snapshot = await locked.first()
 
-    balance.user_member = balance.escrow_task_fund.task.owner_membership
-    balance.is_escrowed = False
-    balance.escrow_task_fund = None
+    return snapshot_summary(snapshot)
 
-    await balance.save()
 
+async def create_balance(
+    deltas: Optional[SnapshotDeltas] = None, **kwargs
+) -> UserBalance:
+    async with ledger_write(deltas) as tracked:
+        balance = await UserBalance.create(**kwargs)
+        track_delta(tracked, balance.user_member_id, balance_contribution(balance))
+
+    return balance
+
+
+async def create_balances(
+    balances: List[UserBalance], deltas: Optional[SnapshotDeltas] = None
+):
+    """Insert many balances at once, keeping their snapshots up to date."""
+    async with ledger_write(deltas) as tracked:
+        await UserBalance.bulk_create(balances)
 
-async def retreat_balance(balance: UserBalance):
-    await balance.fetch_related("escrow_task_fund")
-    await balance.escrow_task_fund.fetch_related("user_member")
+        for balance in balances:
+            track_delta(tracked, balance.user_member_id, balance_contribution(balance))
 
-    balance.user_member = balance.escrow_task_fund.user_member
-    balance.is_escrowed = False
-    balance.escrow_task_fund = None
 
-    await balance.save()
+async def rebuild_snapshots(
+    chunk_size: int = 500,
+) -> List[Tuple[int, BalanceSummary, BalanceSummary]]:
+    """Recompute every snapshot from the ledger.
 
+    Returns (membership id, stored summary, ledger summary) for each snapshot
+    that had drifted, a missing snapshot being stored as None.
+    """
+    drifts = []
 
-async def fund_escrow(task_fund: TaskFund):
-    consumed_balances, change_amount = await collect_amount(
-        task_fund.user_member, task_fund.amount
+    membership_ids = (
+        await OrganizationMembership.all().order_by("id").values_list("id", flat=True)
     )
+    for start in range(0, len(membership_ids), chunk_size):
+        chunk = membership_ids[start : start + chunk_size]
+
+        async with in_transaction():
+            now = datetime.datetime.utcnow()
+
+            existing_ids = set(
+                await MembershipBalanceSnapshot.filter(
+                    user_member_id__in=chunk
+                ).values_list("user_member_id", flat=True)
+            )
+            missing_ids = set(chunk) - existing_ids
+
+            # Every snapshot of the chunk must exist to be locked, so no ledger
+            # write commits between the aggregate and the update
+            await MembershipBalanceSnapshot.bulk_create(
+                [
+                    MembershipBalanceSnapshot(
+                        user_member_id=membership_id, update_date=now
+                    )
+                    for membership_id in missing_ids
+                ],
+                ignore_conflicts=True,
+            )
+            locked = (
+                await MembershipBalanceSnapshot.filter(user_member_id__in=chunk)
+                .order_by("user_member_id")
+                .select_for_update()
+            )
+            snapshots = {snapshot.user_member_id: snapshot for snapshot in locked}
+
+            summaries = await summarize_balances(chunk)
+
+            changed = []
+            for membership_id, summary in summaries.items():
+                snapshot = snapshots[membership_id]
+                if membership_id in missing_ids:
+                    drifts.append((membership_id, None, summary))
+                elif snapshot_summary(snapshot) != summary:
+                    drifts.append((membership_id, snapshot_summary(snapshot), summary))
+                else:
+                    continue
+
+                changed.append(snapshot)
+
+                snapshot.owed = summary.owed
+                snapshot.escrowed = summary.escrowed
+                snapshot.claimed = summary.claimed
+                snapshot.last_claim_date = summary.last_claim_date
+                snapshot.update_date = now
+
+            if len(changed) > 0:
+                await MembershipBalanceSnapshot.bulk_update(
+                    changed,
+                    fields=[
+                        "owed",
+                        "escrowed",
+                        "claimed",
+                        "last_claim_date",
+                        "update_date",
+                    ],
+                )
+
+    return drifts
+
+
+async def compact_balances(
+    user_membership_id: int, min_fragments: int = 2
+) -> Optional[UserBalance]:
+    """Merge the unclaimed, unescrowed fragments of a membership into one row.
+
+    Fragments are kept as claimed rows pointing to the merged row, so the
+    totals of the membership stay the same. Returns the merged row, or None if
+    there were less than `min_fragments` to merge.
+    """
+    async with in_transaction():
+        # Ledger writes of the membership wait on the same lock, so they can
+        # not spend the fragments while they are merged
+        await lock_balance(user_membership_id)
+
+        fragments = (
+            await UserBalance.filter(
+                Q(user_member_id=user_membership_id)
+                & Q(is_claimed=False)
+                & Q(is_escrowed=False)
+            )
+            .order_by("id")
+            .select_for_update()
+        )
+        if len(fragments) < min_fragments:
+            return None
 
-    if change_amount == 0:
-        for balance in consumed_balances:
-            await escrow_balance(balance, task_fund)
+        compacted = await UserBalance.create(
+            amount=sum(fragment.amount for fragment in fragments),
+            user_member_id=user_membership_id,
+        )
 
-        return
+        # Only merge fragments nobody spent since they were read
+        merged_count = await UserBalance.filter(
+            Q(id__in=[fragment.id for fragment in fragments])
+            & Q(is_claimed=False)
+            & Q(is_escrowed=False)
+        ).update(
+            is_claimed=True,
+            claim_date=datetime.datetime.utcnow(),
+            compacted_into_id=compacted.id,
+        )
+        if merged_count != len(fragments):
+            raise ValueError(
+                f"Balances of membership {user_membership_id} changed while compacting"
+            )
+
+    return compacted
+
+
+async def compact_all_balances(min_fragments: int = 10) -> int:
+    membership_ids = (
+        await UserBalance.filter(Q(is_claimed=False) & Q(is_escrowed=False))
+        .annotate(fragments=Count("id"))
+        .group_by("user_member_id")
+        .filter(fragments__gte=min_fragments)
+        .values_list("user_member_id", flat=True)
+    )
 
-    for balance in consumed_balances:
-        await claim_balance(balance)
+    compacted_count = 0
+    for membership_id in membership_ids:
+        try:
+            compacted = await compact_balances(membership_id, min_fragments)
+        except ValueError as e:
+            # Concurrent ledger write, will be picked up on the next run
+            logging.info(e)
+            continue
 
-    await UserBalance.create(amount=change_amount, user_member=task_fund.user_member)
-    await UserBalance.create(
-        amount=task_fund.amount,
-        user_member=task_fund.user_member,
-        is_escrowed=True,
-        escrow_task_fund=task_fund,
+        if compacted is not None:
+            compacted_count += 1
+
+    return compacted_count
+
+
+async def compact_balances_periodically(interval: int, min_fragments: int = 10):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            compacted_count = await compact_all_balances(min_fragments)
+            logging.info(f"Compacted balances of {compacted_count} memberships")
+        except Exception as e:
+            logging.error(f"Error while compacting balances {e}")
+
+
+async def collect_amount(
+    user_membership: OrganizationMembership, amount: int
+) -> Tuple[List["UserBalance"], int]:
+    # Smallest balances first, keeping only the ones needed to reach the amount.
+    # Every value is an int, so it is safe to format them into the query
+    owed_balances = await UserBalance.raw(
+        f"""
+        SELECT * FROM (
+            SELECT *, SUM("amount") OVER (ORDER BY "amount", "id") AS "running_total"
+            FROM "{UserBalance._meta.db_table}"
+            WHERE "user_member_id" = {int(user_membership.id)}
+                AND NOT "is_claimed" AND NOT "is_escrowed"
+        ) AS "owed_balance"
+        WHERE "running_total" - "amount" < {int(amount)}
+        ORDER BY "amount", "id"
+        """
     )
 
+    collected: List["UserBalance"] = list(owed_balances)
+    total_balance = sum(balance.amount for balance in collected)
 
-async def fund_release(task_fund: TaskFund):
-    balances: List["UserBalance"] = await UserBalance.filter(
-        Q(escrow_task_fund=task_fund) & Q(is_claimed=False) & Q(is_escrowed=True)
-    ).all()
+    return (collected, total_balance - amount)
+
+
+async def claim_balances(
+    balances: List["UserBalance"], deltas: Optional[SnapshotDeltas] = None
+):
     if len(balances) == 0:
-        raise ValueError(f"User fund has no balance escrowed")
+        return
+
+    claim_date = datetime.datetime.utcnow()
+
+    async with ledger_write(deltas) as tracked:
+        # Only balances still available, so one can not be spent twice
+        claimed_count = await UserBalance.filter(
+            Q(id__in=[balance.id for balance in balances])
+            & Q(is_claimed=False)
+            & Q(is_escrowed=False)
+        ).update(is_claimed=True, claim_date=claim_date)
+        if claimed_count != len(balances):
+            raise ValueError("Balances were spent while claiming them")
 
-    for balance in balances:
-        await release_balance(balance)
+        for balance in balances:
+            before = balance_contribution(balance, -1)
 
+            balance.is_claimed = True
+            balance.claim_date = claim_date
 
-async def fund_retreat(task_fund: TaskFund):
-    balances: List["UserBalance"] = await UserBalance.filter(
-        Q(escrow_task_fund=task_fund) & Q(is_claimed=False) & Q(is_escrowed=True)
-    ).all()
+            track_delta(tracked, balance.user_member_id, before)
+            track_delta(tracked, balance.user_member_id, balance_contribution(balance))
+
+
+async def claim_balance(balance: UserBalance, deltas: Optional[SnapshotDeltas] = None):
+    await claim_balances([balance], deltas)
+
+
+async def escrow_balances(
+    balances: List["UserBalance"],
+    task_fund: TaskFund,
+    deltas: Optional[SnapshotDeltas] = None,
+):
     if len(balances) == 0:
+        return
+
+    async with ledger_write(deltas) as tracked:
+        escrowed_count = await UserBalance.filter(
+            Q(id__in=[balance.id for balance in balances])
+            & Q(is_claimed=False)
+            & Q(is_escrowed=False)
+        ).update(is_escrowed=True, escrow_task_fund_id=task_fund.id)
+        if escrowed_count != len(balances):
+            raise ValueError("Balances were spent while escrowing them")
+
+        for balance in balances:
+            before = balance_contribution(balance, -1)
+
+            balance.is_escrowed = True
+            balance.escrow_task_fund = task_fund
+
+            track_delta(tracked, balance.user_member_id, before)
+            track_delta(tracked, balance.user_member_id, balance_contribution(balance))
+
+
+async def escrow_balance(
+    balance: UserBalance,
+    task_fund: TaskFund,
+    deltas: Optional[SnapshotDeltas] = None,
+):
+    await escrow_balances([balance], task_fund, deltas)
+
+
+async def unescrow_balances(
+    task_fund_ids: List[int],
+    receiver_membership_id: Optional[int],
+    deltas: Optional[SnapshotDeltas] = None,
+) -> int:
+    """Take every balance escrowed by the given funds out of escrow.
+
+    Balances move to `receiver_membership_id` when it is given, otherwise they
+    stay with the funder, which is who escrowed them in `fund_escrow`. Returns
+    the amount that left escrow.
+    """
+    escrowed = (
+        Q(escrow_task_fund_id__in=task_fund_ids)
+        & Q(is_claimed=False)
+        & Q(is_escrowed=True)
+    )
+
+    async with ledger_write(deltas) as tracked:
+        funders = (
+            await UserBalance.filter(escrowed)
+            .annotate(escrowed_amount=Sum("amount"))
+            .group_by("user_member_id")
+            .values("user_member_id", "escrowed_amount")
+        )
+        if len(funders) == 0:
+            return 0
+
+        update = {"is_escrowed": False, "escrow_task_fund_id": None}
+        if receiver_membership_id is not None:
+            update["user_member_id"] = receiver_membership_id
+
+        await UserBalance.filter(escrowed).update(**update)
+
+        total_amount = 0
+        for funder in funders:
+            amount = int(funder["escrowed_amount"])
+            total_amount += amount
+
+            if receiver_membership_id is None:
+                delta = BalanceSummary(escrowed=-amount)
+            else:
+                delta = BalanceSummary(owed=-amount, escrowed=-amount)
+
+            track_delta(tracked, funder["user_member_id"], delta)
+
+        if receiver_membership_id is not None:
+            track_delta(
+                tracked, receiver_membership_id, BalanceSummary(owed=total_amount)
+            )
+
+    return total_amount
+
+
+async def fund_escrow(task_fund: TaskFund, deltas: Optional[SnapshotDeltas] = None):
+    async with ledger_write(deltas) as tracked:
+        await lock_balance(task_fund.user_member_id)
+
+        consumed_balances, change_amount = await collect_amount(
+            task_fund.user_member, task_fund.amount
+        )
+        if change_amount < 0:
+            raise InsufficientBalanceError(task_fund.amount + change_amount)
+
+        if change_amount == 0:
+            await escrow_balances(consumed_balances, task_fund, tracked)
+
+            return
+
+        await claim_balances(consumed_balances, tracked)
+
+        created = [
+            UserBalance(amount=change_amount, user_member=task_fund.user_member),
+            UserBalance(
+                amount=task_fund.amount,
+                user_member=task_fund.user_member,
+                is_escrowed=True,
+                escrow_task_fund=task_fund,
+            ),
+        ]
+        await UserBalance.bulk_create(created)
+
+        for balance in created:
+            track_delta(tracked, balance.user_member_id, balance_contribution(balance))
+
+
+async def fund_task(
+    user_membership: OrganizationMembership,
+    task: Task,
+    amount: int,
+    deltas: Optional[SnapshotDeltas] = None,
+) -> TaskFund:
+    """Create a fund of `amount` for the task, escrowing it from the membership.
+
+    Raises InsufficientBalanceError when the available balance is not enough.
+    The balance stays locked from that check until the escrow is written, so
+    concurrent funds can not spend the same tokens twice.
+    """
+    async with ledger_write(deltas) as tracked:
+        summary = await lock_balance(user_membership.id)
+        if summary.available < amount:
+            raise InsufficientBalanceError(summary.available)
+
+        task_fund = await TaskFund.create(
+            amount=amount, user_member=user_membership, task=task
+        )
+        await fund_escrow(task_fund, tracked)
+
+    return task_fund
+
+
+async def fund_release(task_fund: TaskFund, deltas: Optional[SnapshotDeltas] = None):
+    await task_fund.fetch_related("task")
+
+    released = await unescrow_balances(
+        [task_fund.id], task_fund.task.owner_membership_id, deltas
+    )
+    if released == 0:
+        raise ValueError(f"User fund has no balance escrowed")
+
+
+async def fund_retreat(task_fund: TaskFund, deltas: Optional[SnapshotDeltas] = None):
+    retreated = await unescrow_balances([task_fund.id], None, deltas)
+    if retreated == 0:
         raise ValueError(f"User fund has no balance escrowed")
 
-    for balance in balances:
-        await retreat_balance(balance)
+
+async def settle_task_funds(
+    task: Task, release: bool, deltas: Optional[SnapshotDeltas] = None
+):
+    """Release every fund of an individual task to its owner, or give them back
+    to their funders, and mark the funds as completed."""
+    async with ledger_write(deltas) as tracked:
+        task_fund_ids = await TaskFund.filter(task=task).values_list("id", flat=True)
+        if len(task_fund_ids) == 0:
+            return
+
+        await unescrow_balances(
+            task_fund_ids, task.owner_membership_id if release else None, tracked
+        )
+
+        await TaskFund.filter(id__in=task_fund_ids).update(
+            is_completed=True, complete_date=datetime.datetime.utcnow()
+        )
+
+
+async def pay_task_rewards(
+    task: Task, organization_id: int, deltas: Optional[SnapshotDeltas] = None
+):
+    """Pay every pending reward of a group task to the organization membership
+    of its group member, and mark the rewards as completed."""
+    async with ledger_write(deltas) as tracked:
+        payouts = await TaskReward.filter(
+            task_id=task.id,
+            is_completed=False,
+            group_member__user__membership_organizations__organization_id=organization_id,
+        ).values(
+            "reward", membership_id="group_member__user__membership_organizations__id"
+        )
+
+        completed_count = await TaskReward.filter(
+            task_id=task.id, is_completed=False
+        ).update(is_completed=True, complete_date=datetime.datetime.utcnow())
+        if completed_count != len(payouts):
+            raise ValueError(
+                f"Could not find user membership for every reward of task {task.identifier}"
+            )
+
+        created = [
+            UserBalance(amount=payout["reward"], user_member_id=payout["membership_id"])
+            for payout in payouts
+        ]
+        await UserBalance.bulk_create(created)
+
+        for balance in created:
+            track_delta(tracked, balance.user_member_id, balance_contribution(balance))
 
 
 async def send_amount(
@@ -172,34 +722,45 @@ async def send_amount(
     receiver: OrganizationMembership,
     balances: List["UserBalance"],
     amount: int,
+    deltas: Optional[SnapshotDeltas] = None,
 ):
-    sum_balance = 0
-    for balance in balances:
-        balance.is_claimed = True
-        balance.claim_date = datetime.datetime.utcnow()
-
-        sum_balance += balance.amount
+    async with ledger_write(deltas) as tracked:
+        sum_balance = sum(balance.amount for balance in balances)
 
-        await balance.save()
+        await claim_balances(balances, tracked)
 
-    if (sum_balance - amount) < 0:
-        raise ValueError("Tried to send amount with less balance than it could")
+        if (sum_balance - amount) < 0:
+            raise ValueError("Tried to send amount with less balance than it could")
 
-    await UserBalance.create(amount=amount, is_claimed=False, user_member=sender)
-
-    if (sum_balance - amount) > 0:
-        await UserBalance.create(
-            amount=sum_balance - amount, is_claimed=False, user_member=receiver
+        await create_balance(
+            tracked, amount=amount, is_claimed=False, user_member=sender
         )
 
+        if (sum_balance - amount) > 0:
+            await create_balance(
+                tracked,
+                amount=sum_balance - amount,
+                is_claimed=False,
+                user_member=receiver,
+            )
+
 
 async def make_payment(
     sender_membership: OrganizationMembership,
     receiver_membership: OrganizationMembership,
     amount: int,
 ):
-    consumed_balances, change_amount = await collect_amount(sender_membership, amount)
+    async with ledger_write() as deltas:
+        await lock_balance(sender_membership.id)
 
-    await send_amount(
-        sender_membership, receiver_membership, consumed_balances, change_amount
-    )
+        consumed_balances, change_amount = await collect_amount(
+            sender_membership, amount
+        )
+
+        await send_amount(
+            sender_membership,
+            receiver_membership,
+            consumed_balances,
+            change_amount,
+            deltas,
+        )
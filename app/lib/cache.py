@@ -0,0 +1,119 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+import pickle
+import threading
+import time
+
+
+class TTLCache:
+    """In-process LRU whose entries expire `ttl` seconds after being set.
+    Without a `max_size`, entries are only dropped once they expire."""
+
+    def __init__(self, ttl: float, max_size: Optional[int] = 4096):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def add(self, key: Hashable, value: Any, ttl: float | None = None) -> bool:
+        """Set the key only if it is not cached yet, returns False otherwise."""
+        ttl = self.ttl if ttl is None else ttl
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+
+            if ttl > 0:
+                self._entries[key] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+                self._evict()
+
+            return True
+
+    def _evict(self):
+        # Expired entries first, from the least recently used end
+        now = time.monotonic()
+        while len(self._entries) > 0:
+            expiration, _ = next(iter(self._entries.values()))
+            if expiration >= now:
+                break
+
+            self._entries.popitem(last=False)
+
+        while self.max_size is not None and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class CacheBackend(ABC):
+    """Cache that may be shared between processes, such as one backed by Redis.
+    Values are plain picklable data, never model instances."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Any:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float):
+        pass
+
+    @abstractmethod
+    async def delete(self, key: str):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """Backend local to this process, used when no shared one is configured.
+    Values are pickled like a shared backend would, so callers never share them."""
+
+    def __init__(self, max_size: int = 4096):
+        self.cache = TTLCache(0, max_size=max_size)
+
+    async def get(self, key: str) -> Any:
+        value = self.cache.get(key)
+
+        return None if value is None else pickle.loads(value)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self.cache.set(key, pickle.dumps(value), ttl)
+
+    async def delete(self, key: str):
+        self.cache.delete(key)
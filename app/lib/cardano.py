@@ -1,9 +1,15 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
 import pycardano as pyc
+import asyncio
 import datetime
+import hashlib
 import logging
+import os
 
 
-from app.lib import environment
+from app.lib import cache, environment
 
 
 def current_network():
@@ -17,11 +23,141 @@ def current_network():
         raise ValueError(f"NETOWORK not recognised: {network}")
 
 
-def verify_signature(signature: str, expected_address: str):
+# Signed messages are valid for this long around their timestamp
+SIGNATURE_WINDOW = datetime.timedelta(hours=1)
+# Signatures with invalid content are remembered for this long
+INVALID_SIGNATURE_TTL = datetime.timedelta(minutes=10)
+
+SIGNATURE_CACHE_SIZE = environment.get("SIGNATURE_CACHE_SIZE", int, 4096)
+# If 1, a signature can only be used once while it is valid
+SIGNATURE_REPLAY_PROTECTION = environment.get("SIGNATURE_REPLAY_PROTECTION", int, 0)
+
+
+class SignatureCache:
+    """Bounded cache of signature verification results, each kept until its
+    signature can no longer be valid.
+
+    Used signatures are kept apart and never evicted before they expire, so
+    filling the cache can not make a used signature valid again."""
+
+    def __init__(self, max_size: int):
+        # key -> signed timestamp, or None if invalid
+        self.results = cache.TTLCache(0, max_size=max_size)
+        self.used = cache.TTLCache(0, max_size=None)
+
+    @property
+    def hits(self) -> int:
+        return self.results.hits
+
+    @property
+    def misses(self) -> int:
+        return self.results.misses
+
+    @staticmethod
+    def key(signature: str, expected_address: str) -> str:
+        return hashlib.sha256(f"{signature}:{expected_address}".encode()).hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, Optional[datetime.datetime]]:
+        missing = object()
+
+        date = self.results.get(key, missing)
+        if date is missing:
+            return False, None
+
+        return True, date
+
+    def set(self, key: str, date: Optional[datetime.datetime]):
+        if date is None:
+            expiration = datetime.datetime.utcnow() + INVALID_SIGNATURE_TTL
+        else:
+            expiration = date + SIGNATURE_WINDOW
+
+        ttl = (expiration - datetime.datetime.utcnow()).total_seconds()
+        self.results.set(key, date, ttl)
+
+    def use(self, key: str) -> bool:
+        """Mark a signature as used, returns False if it already was."""
+        # A signature valid now stops being valid within two windows
+        return self.used.add(key, True, (2 * SIGNATURE_WINDOW).total_seconds())
+
+    def clear(self):
+        self.results.clear()
+        self.used.clear()
+
+
+signature_cache = SignatureCache(SIGNATURE_CACHE_SIZE)
+
+# Either "thread" or "process"
+SIGNATURE_EXECUTOR = environment.get("SIGNATURE_EXECUTOR", str, "thread")
+SIGNATURE_WORKERS = environment.get("SIGNATURE_WORKERS", int, os.cpu_count() or 1)
+# Verifications allowed to wait for a worker before rejecting new ones
+SIGNATURE_QUEUE_SIZE = environment.get("SIGNATURE_QUEUE_SIZE", int, 64)
+
+
+class VerifierBusyError(Exception):
+    pass
+
+
+class SignatureVerifier:
+    """Runs signature verification on a worker pool so it does not block the
+    event loop, rejecting new verifications when too many are waiting."""
+
+    def __init__(self, executor: str, workers: int, queue_size: int):
+        if executor not in ["thread", "process"]:
+            raise ValueError(f"SIGNATURE_EXECUTOR not recognised: {executor}")
+
+        self.executor_type = executor
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0
+
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="signature"
+                )
+
+        return self._executor
+
+    async def read_signature(
+        self, signature: str, expected_address: str
+    ) -> Optional[datetime.datetime]:
+        if self.pending >= self.workers + self.queue_size:
+            raise VerifierBusyError("Too many signatures waiting to be verified")
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, read_signature, signature, expected_address
+            )
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+signature_verifier = SignatureVerifier(
+    SIGNATURE_EXECUTOR, SIGNATURE_WORKERS, SIGNATURE_QUEUE_SIZE
+)
+
+
+def read_signature(
+    signature: str, expected_address: str
+) -> Optional[datetime.datetime]:
+    """Verify the signature cryptographically, returning the date it signed."""
     parsed = signature.split("H1+DFJCghAmokzYG")
     if len(parsed) != 2:
         logging.info("Signature formatted incorrectly, wrong split!")
-        return False
+        return None
 
     parsed_signature = {
         "key": parsed[0],
@@ -33,46 +169,91 @@ def verify_signature(signature: str, expected_address: str):
     except Exception as e:
         logging.info(e)
         logging.info("Invalid signature, got exception while verifying it!")
-        return False
+        return None
 
     if validation["verified"] is False:
         logging.info("Invalid signature, not verified!")
-        return False
+        return None
 
     if (
         not pyc.Address.from_primitive(expected_address).staking_part
         == validation["signing_address"].staking_part
     ):
         logging.info("Invalid signature, wrong stake address!")
-        return False
+        return None
 
     if (not isinstance(validation["message"], str)) or len(validation["message"]) != 64:
         logging.info(
             "Signature formatted incorrectly, not found message with 64 characters!"
         )
-        return False
+        return None
 
     if (
         validation["message"][:54]
         != "======ONLY SIGN IF YOU ARE IN app.athenalabo.com======"
     ):
         logging.info("Invalid signature, wrong message!")
-        return False
+        return None
 
     try:
         timestamp = int(validation["message"][54:])
     except ValueError:
         logging.info("Signature formatted incorrectly, no timestamp given!")
-        return False
+        return None
+
+    return datetime.datetime.utcfromtimestamp(timestamp)
 
-    current_datetime = datetime.datetime.utcnow()
-    start_range = current_datetime - datetime.timedelta(hours=1)
-    end_range = current_datetime + datetime.timedelta(hours=1)
 
-    date = datetime.datetime.utcfromtimestamp(timestamp)
+def is_signature_date_valid(date: datetime.datetime) -> bool:
+    current_datetime = datetime.datetime.utcnow()
+    start_range = current_datetime - SIGNATURE_WINDOW
+    end_range = current_datetime + SIGNATURE_WINDOW
 
     if not (start_range <= date <= end_range):
         logging.info("Signature expired!")
         return False
 
     return True
+
+
+def verify_signature(signature: str, expected_address: str):
+    key = signature_cache.key(signature, expected_address)
+
+    cached, date = signature_cache.get(key)
+    if not cached:
+        date = read_signature(signature, expected_address)
+        signature_cache.set(key, date)
+
+    if date is None:
+        return False
+
+    return is_signature_date_valid(date)
+
+
+async def verify_signature_async(signature: str, expected_address: str) -> bool:
+    """Same as verify_signature, but verifies on the worker pool. Raises
+    VerifierBusyError if the pool is saturated."""
+    key = signature_cache.key(signature, expected_address)
+
+    cached, date = signature_cache.get(key)
+    if not cached:
+        date = await signature_verifier.read_signature(signature, expected_address)
+        signature_cache.set(key, date)
+
+    if date is None:
+        return False
+
+    return is_signature_date_valid(date)
+
+
+def use_signature(signature: str, expected_address: str) -> bool:
+    """Returns False if replay protection is enabled and the signature was
+    already used for a successful login."""
+    if not SIGNATURE_REPLAY_PROTECTION:
+        return True
+
+    if not signature_cache.use(signature_cache.key(signature, expected_address)):
+        logging.info("Signature already used!")
+        return False
+
+    return True
@@ -0,0 +1,62 @@
+from tortoise.queryset import QuerySet
+from tortoise.signals import post_delete, post_save
+
+from app.lib import cache, environment
+from app.model import OrganizationMembership, GroupMembership, Task, TaskAction
+
+
+# Seconds list totals are cached, 0 disables it
+COUNT_CACHE_TTL = environment.get("COUNT_CACHE_TTL", int, 30)
+
+# (kind, parent id) -> {variant: count}
+count_cache = cache.TTLCache(COUNT_CACHE_TTL, max_size=10_000)
+
+
+async def get_count(
+    queryset: QuerySet, kind: str, parent_id: int, variant: str = ""
+) -> int:
+    """Count the queryset, reusing the count cached for the same listing.
+    Saving or deleting rows of a listing invalidates all of its variants."""
+    counts = count_cache.get((kind, parent_id))
+    if counts is None:
+        counts = {}
+        count_cache.set((kind, parent_id), counts)
+
+    if variant not in counts:
+        counts[variant] = await queryset.count()
+
+    return counts[variant]
+
+
+def invalidate(kind: str, parent_id: int | None):
+    if parent_id is not None:
+        count_cache.delete((kind, parent_id))
+
+
+# Bulk creates and updates do not send signals, callers must invalidate
+
+
+@post_save(Task)
+@post_delete(Task)
+async def invalidate_task_counts(sender, instance: Task, *args):
+    invalidate("organization_tasks", instance.organization_id)
+    invalidate("group_tasks", instance.group_id)
+
+
+@post_save(TaskAction)
+@post_delete(TaskAction)
+async def invalidate_task_action_counts(sender, instance: TaskAction, *args):
+    invalidate("task_actions", instance.task_id)
+
+
+@post_save(OrganizationMembership)
+@post_delete(OrganizationMembership)
+async def invalidate_membership_counts(sender, instance: OrganizationMembership, *args):
+    invalidate("organization_users", instance.organization_id)
+    invalidate("user_organizations", instance.user_id)
+
+
+@post_save(GroupMembership)
+@post_delete(GroupMembership)
+async def invalidate_group_membership_counts(sender, instance: GroupMembership, *args):
+    invalidate("user_groups", instance.user_id)
@@ -0,0 +1,192 @@
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from app.lib import balance, counts, upload
+from app.model import User, UserType, UserBalance, Organization, OrganizationMembership
+
+
+FIELDS = ("email", "type", "area")
+
+CONTENT_TYPES = (upload.CSV_CONTENT_TYPE, upload.NDJSON_CONTENT_TYPE)
+
+
+def read_rows(
+    chunks: AsyncIterator[bytes], content_type: str
+) -> AsyncIterator[Optional[Dict]]:
+    """Parse a CSV or NDJSON upload into dicts with the enrollment fields.
+    Rows without an email are given as None."""
+    records = upload.read_records(chunks, content_type, CONTENT_TYPES)
+
+    async def normalize():
+        async for record in records:
+            if not isinstance(record, dict) or not isinstance(record.get("email"), str):
+                yield None
+                continue
+
+            yield {
+                field: None
+                if record.get(field) in (None, "")
+                else str(record[field]).strip()
+                for field in FIELDS
+            }
+
+    return normalize()
+
+
+def validate_row(
+    organization: Organization, row: Dict, user: Optional[User]
+) -> Optional[str]:
+    """Same checks as joining the organization, without the passwords. Returns
+    the reason the row cannot be enrolled, if any."""
+    if user is None:
+        return "User account not found"
+
+    if row["type"] is not None and row["type"].lower() != user.type:
+        return "User type does not match"
+
+    if user.type == UserType.ORGANIZER.value:
+        return "Organizer cannot join any organizations"
+
+    if (
+        user.type == UserType.STUDENT.value
+        and len(organization.areas) > 0
+        and row["area"] is None
+    ):
+        return "No area selected"
+
+    if user.type != UserType.STUDENT.value and row["area"] is not None:
+        return "Only student can select area"
+
+    if row["area"] is not None and row["area"].lower() not in [
+        area.lower() for area in organization.areas
+    ]:
+        return "Area selected does not exist in this organization"
+
+    return None
+
+
+async def enroll_chunk(
+    organization: Organization, rows: List[tuple[int, Optional[Dict]]]
+) -> List[Dict]:
+    emails = [row["email"] for _, row in rows if row is not None]
+    users = {user.email: user for user in await User.filter(email__in=emails)}
+    enrolled_ids = set(
+        await OrganizationMembership.filter(
+            organization=organization,
+            user_id__in=[user.id for user in users.values()],
+        ).values_list("user_id", flat=True)
+    )
+
+    results = []
+    memberships = []
+    for number, row in rows:
+        if row is None:
+            results.append({"row": number, "status": "error", "detail": "Invalid row"})
+            continue
+
+        user = users.get(row["email"])
+        detail = validate_row(organization, row, user)
+        if detail is None and user.id in enrolled_ids:
+            detail = "User is already part of this organization"
+
+        if detail is not None:
+            results.append(
+                {
+                    "row": number,
+                    "email": row["email"],
+                    "status": "error",
+                    "detail": detail,
+                }
+            )
+            continue
+
+        enrolled_ids.add(user.id)
+        memberships.append(
+            OrganizationMembership(
+                user=user,
+                organization=organization,
+                area=None if row["area"] is None else row["area"].lower(),
+            )
+        )
+        results.append({"row": number, "email": row["email"], "status": "enrolled"})
+
+    if len(memberships) == 0:
+        return results
+
+    conflicted_ids = await insert_memberships(organization, memberships)
+    for result in results:
+        if (
+            result["status"] == "enrolled"
+            and users[result["email"]].id in conflicted_ids
+        ):
+            result["status"] = "error"
+            result["detail"] = "User is already part of this organization"
+
+    counts.invalidate("organization_users", organization.id)
+    for membership in memberships:
+        counts.invalidate("user_organizations", membership.user_id)
+
+    return results
+
+
+async def credit_memberships(organization: Organization, membership_ids: List[int]):
+    if organization.default_credits > 0:
+        await balance.create_balances(
+            [
+                UserBalance(
+                    amount=organization.default_credits, user_member_id=membership_id
+                )
+                for membership_id in membership_ids
+            ]
+        )
+
+
+async def insert_memberships(
+    organization: Organization, memberships: List[OrganizationMembership]
+) -> Set[int]:
+    """Insert the memberships with their default credits, returning the ids
+    of the users that joined the organization meanwhile and were left out."""
+    user_ids = [membership.user_id for membership in memberships]
+
+    try:
+        async with in_transaction():
+            await OrganizationMembership.bulk_create(memberships)
+
+            # Bulk inserts do not give back the ids, but only one membership
+            # per user can exist, so these are the ones just inserted
+            membership_ids = await OrganizationMembership.filter(
+                organization=organization, user_id__in=user_ids
+            ).values_list("id", flat=True)
+            await credit_memberships(organization, membership_ids)
+
+        return set()
+    except IntegrityError:
+        pass
+
+    # Someone joined concurrently, so insert one by one to find who
+    conflicted_ids = set()
+    for membership in memberships:
+        try:
+            async with in_transaction():
+                created = await OrganizationMembership.create(
+                    user_id=membership.user_id,
+                    organization=organization,
+                    area=membership.area,
+                )
+                await credit_memberships(organization, [created.id])
+        except IntegrityError:
+            conflicted_ids.add(membership.user_id)
+
+    return conflicted_ids
+
+
+async def enroll(
+    organization: Organization, rows: AsyncIterator[Optional[Dict]]
+) -> List[Dict]:
+    """Enroll the users of the rows in chunks, each chunk being validated with
+    a few queries and inserted in one transaction. Returns a result per row,
+    numbered from 1."""
+    return await upload.process_chunks(
+        rows, lambda chunk: enroll_chunk(organization, chunk)
+    )
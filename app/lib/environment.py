@@ -13,9 +13,15 @@ sys.path.append("app")
 dotenv.load_dotenv()
 
 
-def get(env: str, type: type = str) -> str:
+_MISSING = object()
+
+
+def get(env: str, type: type = str, default=_MISSING) -> str:
     value = os.environ.get(env)
     if value is None:
+        if default is not _MISSING:
+            return default
+
         raise EnvNotFoundError(f"Env variable {env} not found!")
 
     try:
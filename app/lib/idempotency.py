@@ -0,0 +1,256 @@
+from starlette.requests import ClientDisconnect
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.responses import JSONResponse, Response
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+
+from app.model import IdempotencyRecord
+from app.lib import environment
+
+import anyio
+import asyncio
+import datetime
+import hashlib
+import logging
+import re
+
+
+# Hours a key is remembered for
+IDEMPOTENCY_KEY_TTL = environment.get("IDEMPOTENCY_KEY_TTL", int, 24)
+# Seconds a request holds its key before a retry can take it over, in case
+# the worker running it died
+IDEMPOTENCY_LEASE = environment.get("IDEMPOTENCY_LEASE", int, 60)
+
+# Largest request body buffered to fingerprint it, in bytes
+IDEMPOTENCY_MAX_BODY_SIZE = environment.get(
+    "IDEMPOTENCY_MAX_BODY_SIZE", int, 1024 * 1024
+)
+
+HEADER = b"idempotency-key"
+
+# Routes moving tokens or changing the state of tasks, which are the ones
+# worth protecting from retries. Logins and registrations are never stored,
+# as their responses hold credentials. Bulk uploads are streamed, so they are
+# left out instead of being buffered whole
+IDEMPOTENT_PATHS = (r"/organization/[^/]+/task/(?!create/bulk$).+",)
+
+
+def hash_bytes(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """Replays the stored response of authenticated POST requests to `paths`
+    retried with the same Idempotency-Key header, instead of running them
+    again."""
+
+    def __init__(self, app: ASGIApp, paths: tuple[str, ...] = IDEMPOTENT_PATHS):
+        self.app = app
+        self.paths = [re.compile(path) for path in paths]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if HEADER not in headers:
+            return await self.app(scope, receive, send)
+
+        # Anonymous requests would all share the same owner
+        if len(headers.get(b"authorization", b"")) == 0:
+            return await self.app(scope, receive, send)
+
+        if not any(path.fullmatch(scope["path"]) for path in self.paths):
+            return await self.app(scope, receive, send)
+
+        key = headers[HEADER].decode("latin-1")
+        if len(key) == 0 or len(key) > 255:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key must have 1 to 255 characters"},
+                status_code=400,
+            )
+            return await response(scope, receive, send)
+
+        try:
+            body = await read_body(receive)
+        except ClientDisconnect:
+            # Nobody is left to answer, and a truncated body must not run
+            return
+
+        if body is None:
+            response = JSONResponse(
+                {"detail": "Request body is too large to use an Idempotency-Key"},
+                status_code=413,
+            )
+            return await response(scope, receive, send)
+
+        owner = hash_bytes(headers[b"authorization"])
+        fingerprint = hash_bytes(
+            scope["method"].encode(),
+            scope["path"].encode(),
+            scope["query_string"],
+            body,
+        )
+
+        record, response = await self.claim_key(key, owner, fingerprint)
+        if response is not None:
+            return await response(scope, receive, send)
+
+        await self.run_and_store(scope, body, receive, send, record)
+
+    async def claim_key(
+        self, key: str, owner: str, fingerprint: str
+    ) -> tuple[IdempotencyRecord | None, Response | None]:
+        expired = datetime.datetime.utcnow() - datetime.timedelta(
+            hours=IDEMPOTENCY_KEY_TTL
+        )
+        await IdempotencyRecord.filter(
+            Q(key=key) & Q(owner=owner) & Q(creation_date__lt=expired)
+        ).delete()
+
+        try:
+            record = await IdempotencyRecord.create(
+                key=key, owner=owner, fingerprint=fingerprint
+            )
+            return record, None
+        except IntegrityError:
+            pass
+
+        record = await IdempotencyRecord.filter(Q(key=key) & Q(owner=owner)).first()
+        if record is None:
+            # The previous request failed and freed the key in the meantime
+            return await self.claim_key(key, owner, fingerprint)
+
+        if record.fingerprint != fingerprint:
+            return None, JSONResponse(
+                {"detail": "Idempotency-Key was already used for another request"},
+                status_code=422,
+            )
+
+        if record.status_code is None:
+            now = datetime.datetime.utcnow()
+            lease_expired = now - datetime.timedelta(seconds=IDEMPOTENCY_LEASE)
+
+            # Only one retry can take over, as the lease is renewed on update
+            taken_over = await IdempotencyRecord.filter(
+                Q(id=record.id)
+                & Q(status_code__isnull=True)
+                & Q(creation_date__lt=lease_expired)
+            ).update(creation_date=now)
+            if taken_over == 1:
+                record.creation_date = now
+                return record, None
+
+            return None, JSONResponse(
+                {"detail": "A request with this Idempotency-Key is in progress"},
+                status_code=409,
+            )
+
+        return None, Response(
+            content=record.response_body,
+            status_code=record.status_code,
+            media_type=record.response_content_type,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+    async def run_and_store(
+        self,
+        scope: Scope,
+        body: bytes,
+        receive: Receive,
+        send: Send,
+        record: IdempotencyRecord,
+    ):
+        status_code = 500
+        content_type = None
+        chunks = []
+        replayed = False
+
+        async def replay_body() -> Message:
+            nonlocal replayed
+
+            # Later calls wait for the client to disconnect, as responses
+            # streaming their body listen for it
+            if replayed:
+                return await receive()
+
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def capture_response(message: Message):
+            nonlocal status_code, content_type
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, capture_response)
+        except BaseException:
+            # Cancelled requests free their key as well
+            with anyio.CancelScope(shield=True):
+                await record.delete()
+            raise
+
+        # Server errors may not have been applied, let the client retry them
+        if status_code >= 500:
+            await record.delete()
+            return
+
+        try:
+            record.status_code = status_code
+            record.response_body = b"".join(chunks).decode()
+            record.response_content_type = (
+                None if content_type is None else content_type.decode("latin-1")
+            )
+            await record.save(
+                update_fields=["status_code", "response_body", "response_content_type"]
+            )
+        except UnicodeDecodeError:
+            logging.info(f"Response for Idempotency-Key {record.key} not stored")
+            await record.delete()
+
+
+async def read_body(receive: Receive) -> bytes | None:
+    """Read the whole request body, or None if it is larger than
+    IDEMPOTENCY_MAX_BODY_SIZE. Raises ClientDisconnect if the client leaves
+    before sending all of it."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnect()
+
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        if size > IDEMPOTENCY_MAX_BODY_SIZE:
+            return None
+
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def purge_expired() -> int:
+    expired = datetime.datetime.utcnow() - datetime.timedelta(hours=IDEMPOTENCY_KEY_TTL)
+
+    return await IdempotencyRecord.filter(creation_date__lt=expired).delete()
+
+
+async def purge_expired_periodically(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            purged_count = await purge_expired()
+            logging.info(f"Purged {purged_count} expired idempotency keys")
+        except Exception as e:
+            logging.error(f"Error while purging idempotency keys {e}")
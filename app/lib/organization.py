@@ -0,0 +1,34 @@
+from app.lib import cache, environment
+from app.model import Organization
+
+
+# Seconds organizations are cached by identifier, 0 disables it
+ORGANIZATION_CACHE_TTL = environment.get("ORGANIZATION_CACHE_TTL", int, 60)
+
+# Replace with a shared backend to invalidate edits across processes
+organization_cache: cache.CacheBackend = cache.MemoryBackend()
+
+
+def cache_key(identifier: str) -> str:
+    return f"organization:{identifier}"
+
+
+async def get_organization(identifier: str) -> Organization | None:
+    """Get organization by identifier, reading it from the organization cache
+    when possible. Every call returns a new instance."""
+    row = await organization_cache.get(cache_key(identifier))
+
+    if row is None:
+        rows = await Organization.filter(identifier=identifier).limit(1).values()
+        if len(rows) == 0:
+            return None
+
+        row = rows[0]
+        await organization_cache.set(cache_key(identifier), row, ORGANIZATION_CACHE_TTL)
+
+    return Organization._init_from_db(**row)
+
+
+async def invalidate_organization(identifier: str):
+    """Must be called whenever an organization is changed."""
+    await organization_cache.delete(cache_key(identifier))
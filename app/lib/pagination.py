@@ -0,0 +1,74 @@
+from tortoise.expressions import Q
+from tortoise.models import Model
+from tortoise.queryset import QuerySet
+from typing import Dict, List, Optional, Tuple
+
+import base64
+import datetime
+import json
+import math
+
+
+def encode_cursor(date: datetime.datetime, id: int) -> str:
+    data = json.dumps({"date": date.isoformat(), "id": id})
+
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+
+        return datetime.datetime.fromisoformat(data["date"]), int(data["id"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def page_count(total: int, count: int) -> int:
+    return max(1, math.ceil(total / count))
+
+
+async def fetch_page(
+    queryset: QuerySet,
+    date_field: str,
+    page: int,
+    count: int,
+    cursor: Optional[Tuple[datetime.datetime, int]] = None,
+    values: Optional[List[str]] = None,
+    descending: bool = True,
+) -> Tuple[List[Model | Dict], Optional[str]]:
+    """Fetch a page of the queryset, newest first unless not `descending`.
+    Pages are selected by the decoded `cursor` when given, so deep pages do not
+    scan the ones before them, and by `page` otherwise. Returns the rows, as
+    dicts of `values` if given, and the next page cursor, if any."""
+    after = "lt" if descending else "gt"
+
+    if cursor is not None:
+        date, id = cursor
+        queryset = queryset.filter(
+            Q(**{f"{date_field}__{after}": date})
+            | Q(**{date_field: date, "id__gt": id})
+        )
+    else:
+        queryset = queryset.offset((page - 1) * count)
+
+    # Rows with the same date keep their insertion order
+    # Fetch one extra row to know if there is a next page
+    order = f"-{date_field}" if descending else date_field
+    queryset = queryset.order_by(order, "id").limit(count + 1)
+
+    if values is None:
+        rows = await queryset
+    else:
+        rows = await queryset.values(*dict.fromkeys([*values, date_field, "id"]))
+
+    next_cursor = None
+    if len(rows) > count:
+        rows = rows[:count]
+
+        if values is None:
+            next_cursor = encode_cursor(getattr(rows[-1], date_field), rows[-1].id)
+        else:
+            next_cursor = encode_cursor(rows[-1][date_field], rows[-1]["id"])
+
+    return rows, next_cursor
@@ -0,0 +1,26 @@
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+from typing import Any
+
+import orjson
+
+
+def dump_spec(spec: Any):
+    if isinstance(spec, BaseModel):
+        return spec.model_dump()
+
+    # Anything orjson does not know, such as subclasses of datetime
+    return to_jsonable_python(spec)
+
+
+class SpecResponse(ORJSONResponse):
+    """Response built from specs that are already valid. FastAPI validates
+    returned content against the response model again, but not responses."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=dump_spec,
+            option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+        )
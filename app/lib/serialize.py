@@ -0,0 +1,46 @@
+from pydantic import BaseModel
+from typing import Callable, Dict, List, Tuple, Type, TypeVar
+
+import functools
+import operator
+
+
+Spec = TypeVar("Spec", bound=BaseModel)
+
+
+@functools.cache
+def compile_spec(
+    spec: Type[Spec], prefix: str = ""
+) -> Tuple[List[str], Callable[[Dict], Spec]]:
+    """Build the `.values()` lookups a spec needs, and a function that builds
+    the spec from a row of those values without validating it again. Nested
+    specs are read from the relation with their field name."""
+    lookups = []
+    getters = []
+
+    for name, field in spec.model_fields.items():
+        if isinstance(field.annotation, type) and issubclass(
+            field.annotation, BaseModel
+        ):
+            nested_lookups, getter = compile_spec(field.annotation, f"{prefix}{name}__")
+            lookups.extend(nested_lookups)
+        else:
+            lookups.append(f"{prefix}{name}")
+            getter = operator.itemgetter(f"{prefix}{name}")
+
+        getters.append((name, getter))
+
+    def build(row: Dict) -> Spec:
+        return spec.model_construct(**{name: getter(row) for name, getter in getters})
+
+    return lookups, build
+
+
+def lookups(spec: Type[BaseModel], prefix: str = "") -> List[str]:
+    return compile_spec(spec, prefix)[0]
+
+
+def build(spec: Type[Spec], rows: List[Dict], prefix: str = "") -> List[Spec]:
+    build_row = compile_spec(spec, prefix)[1]
+
+    return [build_row(row) for row in rows]
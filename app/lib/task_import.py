@@ -0,0 +1,178 @@
+from pydantic import ValidationError
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app import specs
+from app.lib import auth, counts, task_status, upload
+from app.model import OrganizationMembership, Task, TaskAction, task_status_flags
+
+
+CONTENT_TYPES = (upload.CSV_CONTENT_TYPE, upload.JSON_CONTENT_TYPE)
+
+OPTIONAL_FIELDS = {
+    name
+    for name, field in specs.ImportTaskRowSpec.model_fields.items()
+    if not field.is_required()
+}
+
+
+def read_rows(
+    chunks: AsyncIterator[bytes], content_type: str
+) -> AsyncIterator[Optional[Dict]]:
+    """Parse a CSV or JSON array upload of tasks. Empty cells of optional
+    fields are left out, so they take the default."""
+    records = upload.read_records(chunks, content_type, CONTENT_TYPES)
+
+    async def normalize():
+        async for record in records:
+            if not isinstance(record, dict):
+                yield None
+                continue
+
+            yield {
+                key: value
+                for key, value in record.items()
+                if value != "" or key not in OPTIONAL_FIELDS
+            }
+
+    return normalize()
+
+
+def parse_row(row: Optional[Dict]) -> Tuple[Optional[specs.ImportTaskRowSpec], str]:
+    if row is None:
+        return None, "Invalid row"
+
+    try:
+        return specs.ImportTaskRowSpec.model_validate(row), ""
+    except ValidationError as e:
+        error = e.errors()[0]
+        location = ".".join(str(part) for part in error["loc"])
+
+        return None, f"Invalid {location}: {error['msg']}"
+
+
+async def import_chunk(
+    membership: OrganizationMembership,
+    rows: List[Tuple[int, Optional[Dict]]],
+    taken: set,
+) -> List[Dict]:
+    parsed = [(number, *parse_row(row)) for number, row in rows]
+    valid = [spec for _, spec, _ in parsed if spec is not None]
+
+    taken.update(
+        await Task.filter(
+            organization_id=membership.organization_id,
+            identifier__in=[spec.identifier for spec in valid],
+        ).values_list("identifier", flat=True)
+    )
+    owners = {
+        owner.user.email: owner
+        for owner in await OrganizationMembership.filter(
+            organization_id=membership.organization_id,
+            user__email__in=[spec.owner for spec in valid if spec.owner is not None],
+        ).select_related("user")
+    }
+    reviewer = auth.has_review_privileges(membership.user)
+
+    results = []
+    tasks = []
+    approved = []
+    for number, spec, detail in parsed:
+        if spec is not None:
+            owner = membership if spec.owner is None else owners.get(spec.owner)
+
+            if spec.identifier in taken:
+                detail = "Task identifier taken"
+            elif owner is None:
+                detail = "Owner is not a member of this organization"
+            elif owner.id != membership.id and not reviewer:
+                detail = "Only teacher can create tasks for other members"
+            elif spec.approved and not reviewer:
+                detail = "Only teacher can approve task start"
+
+        if detail:
+            results.append({"row": number, "status": "error", "detail": detail})
+            continue
+
+        # Bulk inserts skip the hook keeping the flags in sync
+        status = task_status.ACTIVE if spec.approved else task_status.PENDING
+
+        taken.add(spec.identifier)
+        tasks.append(
+            Task(
+                identifier=spec.identifier,
+                name=spec.name,
+                description=spec.description,
+                deadline=spec.deadline,
+                is_individual=True,
+                status=status,
+                **task_status_flags(status),
+                owner_membership_id=owner.id,
+                organization_id=membership.organization_id,
+            )
+        )
+        if spec.approved:
+            approved.append(spec.identifier)
+
+        results.append(
+            {"row": number, "identifier": spec.identifier, "status": "created"}
+        )
+
+    if len(tasks) == 0:
+        return results
+
+    task_ids = []
+    try:
+        async with in_transaction():
+            await Task.bulk_create(tasks)
+
+            if len(approved) > 0:
+                # Bulk inserts do not give back the ids of the tasks
+                task_ids = await Task.filter(
+                    organization_id=membership.organization_id,
+                    identifier__in=approved,
+                ).values_list("id", flat=True)
+                await TaskAction.bulk_create(
+                    [
+                        TaskAction(
+                            name="Approve task start",
+                            description="",
+                            author_id=membership.user_id,
+                            task_id=task_id,
+                        )
+                        for task_id in task_ids
+                    ]
+                )
+    except IntegrityError:
+        # Another request took one of the identifiers meanwhile
+        return [
+            {
+                "row": result["row"],
+                "status": "error",
+                "detail": "Task identifier taken while importing, try again",
+            }
+            if result["status"] == "created"
+            else result
+            for result in results
+        ]
+
+    counts.invalidate("organization_tasks", membership.organization_id)
+    for task_id in task_ids:
+        counts.invalidate("task_actions", task_id)
+
+    return results
+
+
+async def import_tasks(
+    membership: OrganizationMembership, rows: AsyncIterator[Optional[Dict]]
+) -> List[Dict]:
+    """Create individual tasks for the members of an organization, in chunks
+    checked with a few queries and inserted in one transaction each. Tasks
+    are owned by `membership` unless the row names another member, which
+    only reviewers can do. Returns a result per row, numbered from 1."""
+    taken = set()
+
+    return await upload.process_chunks(
+        rows, lambda chunk: import_chunk(membership, chunk, taken)
+    )
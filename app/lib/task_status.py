@@ -0,0 +1,79 @@
+from typing import List, Tuple
+
+from app.lib import counts
+from app.model import Task, TaskStatus, task_status_flags
+
+
+PENDING = TaskStatus.PENDING.value
+REJECTED = TaskStatus.REJECTED.value
+ACTIVE = TaskStatus.ACTIVE.value
+SUBMITTED = TaskStatus.SUBMITTED.value
+COMPLETED = TaskStatus.COMPLETED.value
+FAILED = TaskStatus.FAILED.value
+
+# Started and not finished yet
+STARTED = (ACTIVE, SUBMITTED)
+
+# Statuses each transition can happen from, and the status it leads to
+TRANSITIONS = {
+    "approve_start": ((PENDING,), ACTIVE),
+    "reject_start": ((PENDING,), REJECTED),
+    "submit": (STARTED, SUBMITTED),
+    "request_changes": (STARTED, ACTIVE),
+    "approve_submission": (STARTED, COMPLETED),
+    "reject_submission": (STARTED, FAILED),
+}
+
+
+class TransitionError(ValueError):
+    pass
+
+
+def check(status: str, sources: Tuple[str, ...]):
+    """Raise TransitionError explaining why a task with `status` cannot be
+    changed when only `sources` are allowed."""
+    if status in sources:
+        return
+
+    if PENDING in sources:
+        raise TransitionError("Task has already started")
+
+    if status in (PENDING, REJECTED):
+        raise TransitionError("Task has not been approved by a teacher yet")
+
+    raise TransitionError("Task is not active anymore")
+
+
+async def transition(task: Task, name: str, **fields):
+    """Apply a transition to the task, together with the given fields, with
+    an UPDATE conditioned on the status. Raises TransitionError if the task
+    is not in a status the transition can happen from, even when another
+    request changed it after the task was read."""
+    sources, target = TRANSITIONS[name]
+    check(task.status, sources)
+
+    changes = {"status": target, **task_status_flags(target), **fields}
+    updated = await Task.filter(id=task.id, status__in=sources).update(**changes)
+    if updated == 0:
+        task.status = await Task.get(id=task.id).values_list("status", flat=True)
+        check(task.status, sources)
+
+        raise TransitionError("Task was changed meanwhile, try again")
+
+    task.update_from_dict(changes)
+
+    # Updates skip the signals clearing the totals filtered by status
+    counts.invalidate("organization_tasks", task.organization_id)
+
+
+async def transition_many(task_ids: List[int], name: str) -> int:
+    """Apply a transition to every task still in a status it can happen
+    from, returning how many were changed. Callers must invalidate the
+    organization task counts."""
+    sources, target = TRANSITIONS[name]
+    if len(task_ids) == 0:
+        return 0
+
+    return await Task.filter(id__in=task_ids, status__in=sources).update(
+        status=target, **task_status_flags(target)
+    )
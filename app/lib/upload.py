@@ -0,0 +1,176 @@
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.lib import environment
+
+import codecs
+import csv
+import json
+import orjson
+
+
+# Rows validated and inserted together when uploading in bulk
+UPLOAD_CHUNK_SIZE = environment.get("UPLOAD_CHUNK_SIZE", int, 500)
+
+CSV_CONTENT_TYPE = "text/csv"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+JSON_CONTENT_TYPE = "application/json"
+
+
+class UploadFormatError(ValueError):
+    pass
+
+
+def decode_line(line: bytes, number: int) -> str:
+    try:
+        return line.decode("utf-8-sig").strip()
+    except UnicodeDecodeError:
+        raise UploadFormatError(f"Line {number} of the upload is not encoded in UTF-8")
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    remainder = b""
+    number = 0
+    async for chunk in chunks:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+
+        for line in lines:
+            number += 1
+            yield decode_line(line, number)
+
+    if len(remainder) > 0:
+        yield decode_line(remainder, number + 1)
+
+
+async def read_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+    # The first row names the columns
+    header = None
+    async for line in read_lines(chunks):
+        if len(line) == 0:
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [column.strip().lower() for column in values]
+        else:
+            yield dict(zip(header, values))
+
+
+async def read_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Optional[Dict]]:
+    async for line in read_lines(chunks):
+        if len(line) == 0:
+            continue
+
+        try:
+            yield orjson.loads(line)
+        except orjson.JSONDecodeError:
+            yield None
+
+
+async def read_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+    """Decode the items of a JSON array as they arrive, so the whole array is
+    never held in memory."""
+    decoder = json.JSONDecoder()
+    # Characters may be split across chunks
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+
+    async for chunk in chunks:
+        try:
+            buffer += text_decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise UploadFormatError("Upload must be encoded in UTF-8")
+
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if len(buffer) == 0:
+                    break
+                if buffer[0] != "[":
+                    raise UploadFormatError("Upload must be a JSON array")
+
+                started = True
+                buffer = buffer[1:]
+                continue
+
+            if buffer[:1] == ",":
+                buffer = buffer[1:].lstrip()
+            if buffer[:1] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # The item continues in the next chunk
+                break
+
+            buffer = buffer[end:]
+            yield item
+
+    raise UploadFormatError("Upload must be a JSON array")
+
+
+def read_records(
+    chunks: AsyncIterator[bytes], content_type: str, allowed: Tuple[str, ...]
+) -> AsyncIterator[Optional[Dict]]:
+    """Parse an upload of one of the `allowed` content types, yielding a value
+    per record. Records that cannot be parsed are yielded as None."""
+    readers = {
+        CSV_CONTENT_TYPE: read_csv,
+        NDJSON_CONTENT_TYPE: read_ndjson,
+        JSON_CONTENT_TYPE: read_json_array,
+    }
+
+    if content_type not in allowed:
+        raise UploadFormatError(f"Upload must be one of {', '.join(allowed)}")
+
+    return readers[content_type](chunks)
+
+
+async def read_chunks(
+    records: AsyncIterator[Optional[Dict]], size: Optional[int] = None
+) -> AsyncIterator[List[Tuple[int, Optional[Dict]]]]:
+    """Group records in lists of (row number, record), numbered from 1."""
+    size = UPLOAD_CHUNK_SIZE if size is None else size
+    chunk = []
+
+    number = 0
+    async for record in records:
+        number += 1
+        chunk.append((number, record if isinstance(record, dict) else None))
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+async def process_chunks(
+    records: AsyncIterator[Optional[Dict]],
+    process: Callable[[List[Tuple[int, Optional[Dict]]]], Awaitable[List[Dict]]],
+) -> List[Dict]:
+    """Run `process` on each chunk of records, which stores it and returns a
+    result per row.
+
+    UploadFormatError is raised if the upload is malformed before anything
+    was stored. Later, the chunks already stored can not be taken back, so
+    the results end with an error for the first row left out instead."""
+    results = []
+    processed_count = 0
+
+    try:
+        async for chunk in read_chunks(records):
+            results.extend(await process(chunk))
+            processed_count += len(chunk)
+    except UploadFormatError as e:
+        if processed_count == 0:
+            raise
+
+        results.append(
+            {"row": processed_count + 1, "status": "error", "detail": str(e)}
+        )
+
+    return results
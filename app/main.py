@@ -1,27 +1,38 @@
 from tortoise.contrib.fastapi import register_tortoise
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from app.routers import users, organizations, tasks, groups
-from app.lib import environment
+from app.lib import environment, balance, cardano, idempotency
+from app.lib.idempotency import IdempotencyMiddleware
 
+import asyncio
 import logging
 
 
 DATABASE = environment.get("DATABASE")
 
+# Seconds between balance compaction runs, 0 disables it
+BALANCE_COMPACTION_INTERVAL = environment.get("BALANCE_COMPACTION_INTERVAL", int, 0)
+
+# Seconds between purges of expired idempotency keys, 0 disables it
+IDEMPOTENCY_PURGE_INTERVAL = environment.get("IDEMPOTENCY_PURGE_INTERVAL", int, 3600)
+
 
 logging.basicConfig(
     level=logging.INFO, format="%(filename)s:%(lineno)s %(levelname)s:%(message)s"
 )
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.include_router(users.router)
 app.include_router(organizations.router)
 app.include_router(tasks.router)
 app.include_router(groups.router)
 
+app.add_middleware(IdempotencyMiddleware)
+
 origins = ["*"]
 
 app.add_middleware(
@@ -38,4 +49,42 @@ async def health():
     return {}
 
 
+# Periodic jobs, kept referenced so they are not collected while running
+app.state.background_tasks = []
+
+
+@app.on_event("startup")
+async def start_balance_compaction():
+    if BALANCE_COMPACTION_INTERVAL > 0:
+        app.state.background_tasks.append(
+            asyncio.create_task(
+                balance.compact_balances_periodically(BALANCE_COMPACTION_INTERVAL)
+            )
+        )
+
+
+@app.on_event("startup")
+async def start_idempotency_purge():
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        app.state.background_tasks.append(
+            asyncio.create_task(
+                idempotency.purge_expired_periodically(IDEMPOTENCY_PURGE_INTERVAL)
+            )
+        )
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in app.state.background_tasks:
+        task.cancel()
+
+    await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+    app.state.background_tasks.clear()
+
+
+@app.on_event("shutdown")
+async def stop_signature_verifier():
+    cardano.signature_verifier.shutdown()
+
+
 register_tortoise(app, db_url=DATABASE, modules={"models": ["app.model"]})
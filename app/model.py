@@ -1,5 +1,6 @@
 from tortoise import fields, models
 from tortoise.contrib.pydantic import pydantic_model_creator
+from tortoise.signals import pre_save
 
 from app.lib import utils
 
@@ -85,6 +86,16 @@ class OrganizationMembership(models.Model):
 
     membership_date = fields.DatetimeField(default=datetime.datetime.utcnow)
 
+    class Meta:
+        # A user joins an organization once, even when enrolled concurrently
+        unique_together = (("user", "organization"),)
+        # Listing pages by membership date, and tasks by owner area
+        indexes = (
+            ("organization", "membership_date", "id"),
+            ("user", "membership_date", "id"),
+            ("organization", "area"),
+        )
+
 
 class Group(models.Model):
     id = fields.IntField(pk=True)
@@ -125,6 +136,10 @@ class GroupMembership(models.Model):
 
     invite_date = fields.DatetimeField(default=datetime.datetime.utcnow)
 
+    class Meta:
+        # Listing pages by invite date
+        indexes = (("user", "invite_date", "id"),)
+
     class PydanticMeta:
         exclude = ["id"]
 
@@ -132,6 +147,38 @@ class GroupMembership(models.Model):
 GroupMembershipSpec = pydantic_model_creator(GroupMembership, name="GroupMembership")
 
 
+class TaskStatus(Enum):
+    PENDING = "pending"  # Waiting for a teacher to approve the start
+    REJECTED = "rejected"  # Start rejected
+    ACTIVE = "active"  # Started, nothing waiting for review
+    SUBMITTED = "submitted"  # Latest submission waiting for review
+    COMPLETED = "completed"  # Submission approved
+    FAILED = "failed"  # Submission rejected
+
+
+# Flags set for each status, kept for clients still reading them
+TASK_STATUS_FLAGS = {
+    TaskStatus.PENDING.value: (),
+    TaskStatus.REJECTED.value: ("is_rejected_start",),
+    TaskStatus.ACTIVE.value: ("is_approved_start",),
+    TaskStatus.SUBMITTED.value: ("is_approved_start",),
+    TaskStatus.COMPLETED.value: ("is_approved_start", "is_approved_completed"),
+    TaskStatus.FAILED.value: ("is_approved_start", "is_rejected_completed"),
+}
+
+
+def task_status_flags(status: str) -> dict:
+    return {
+        flag: flag in TASK_STATUS_FLAGS[status]
+        for flag in [
+            "is_approved_start",
+            "is_rejected_start",
+            "is_approved_completed",
+            "is_rejected_completed",
+        ]
+    }
+
+
 class Task(models.Model):
     id = fields.IntField(pk=True)
 
@@ -160,6 +207,11 @@ class Task(models.Model):
         null=True,
     )
 
+    # Same as the group's or owner's, set on save when missing
+    organization: fields.ForeignKeyRelation[Organization] = fields.ForeignKeyField(
+        model_name="models.Organization", related_name="tasks"
+    )
+
     is_approved_start = fields.BooleanField(default=False)  # By teacher
     is_rejected_start = fields.BooleanField(default=False)
 
@@ -168,12 +220,65 @@ class Task(models.Model):
 
     is_rewards_claimed = fields.BooleanField(default=False)
 
+    # Changed through app.lib.task_status, the flags above follow it
+    status = fields.CharField(max_length=16, default=TaskStatus.PENDING.value)
+
     creation_date = fields.DatetimeField(default=datetime.datetime.utcnow)
 
+    class Meta:
+        # Task identifiers are unique in the organization
+        unique_together = (("organization", "identifier"),)
+        # Listing pages by creation date or deadline, and the listing filters.
+        # Name and identifier use varchar_pattern_ops in Postgres for prefixes
+        indexes = (
+            ("organization", "creation_date", "id"),
+            ("organization", "deadline", "id"),
+            ("group", "creation_date", "id"),
+            ("organization", "status", "creation_date", "id"),
+            ("organization", "name"),
+            ("organization", "identifier"),
+        )
+
     class PydanticMeta:
         exclude = ["id"]
 
 
+@pre_save(Task)
+async def sync_task_status(sender, instance: Task, using_db, update_fields):
+    # The status is the source of truth, saved tasks change it through
+    # app.lib.task_status and their flags always follow it
+    if instance._saved_in_db or instance.status != TaskStatus.PENDING.value:
+        instance.update_from_dict(task_status_flags(instance.status))
+        return
+
+    # New tasks created with flags instead of a status get the one they describe
+    if instance.is_approved_completed:
+        instance.status = TaskStatus.COMPLETED.value
+    elif instance.is_rejected_completed:
+        instance.status = TaskStatus.FAILED.value
+    elif instance.is_rejected_start:
+        instance.status = TaskStatus.REJECTED.value
+    elif instance.is_approved_start:
+        instance.status = TaskStatus.ACTIVE.value
+
+    instance.update_from_dict(task_status_flags(instance.status))
+
+
+@pre_save(Task)
+async def set_task_organization(sender, instance: Task, using_db, update_fields):
+    if instance.organization_id is not None:
+        return
+
+    if instance.group_id is not None:
+        group = await Group.get(id=instance.group_id).using_db(using_db)
+        instance.organization_id = group.organization_id
+    elif instance.owner_membership_id is not None:
+        membership = await OrganizationMembership.get(
+            id=instance.owner_membership_id
+        ).using_db(using_db)
+        instance.organization_id = membership.organization_id
+
+
 TaskSpec = pydantic_model_creator(Task, name="Task")
 
 
@@ -210,6 +315,10 @@ class TaskFund(models.Model):
 
     complete_date = fields.DatetimeField(null=True)
 
+    class Meta:
+        # A member can only fund each task once
+        unique_together = (("user_member", "task"),)
+
 
 class TaskAction(models.Model):
     id = fields.IntField(pk=True)
@@ -229,6 +338,10 @@ class TaskAction(models.Model):
 
     action_date = fields.DatetimeField(default=datetime.datetime.utcnow)
 
+    class Meta:
+        # Listing pages by action date
+        indexes = (("task", "action_date", "id"),)
+
     class PydanticMeta:
         exclude = ["id"]
 
@@ -252,6 +365,11 @@ class UserBalance(models.Model):
     is_error = fields.BooleanField(default=False)
     claim_error = fields.TextField(null=True)
 
+    # Set on fragments merged by compaction, which are then marked as claimed
+    compacted_into: fields.ForeignKeyRelation["UserBalance"] = fields.ForeignKeyField(
+        model_name="models.UserBalance", related_name="compacted_balances", null=True
+    )
+
     user_member: fields.ForeignKeyRelation[
         "OrganizationMembership"
     ] = fields.ForeignKeyField(
@@ -260,3 +378,42 @@ class UserBalance(models.Model):
 
     balance_date = fields.DatetimeField(default=datetime.datetime.utcnow)
     claim_date = fields.DatetimeField(null=True)
+
+
+class MembershipBalanceSnapshot(models.Model):
+    id = fields.IntField(pk=True)
+
+    # Running totals of the UserBalance ledger, kept in sync by app.lib.balance
+    user_member: fields.OneToOneRelation[
+        "OrganizationMembership"
+    ] = fields.OneToOneField(
+        model_name="models.OrganizationMembership", related_name="balance_snapshot"
+    )
+
+    owed = fields.BigIntField(default=0)
+    escrowed = fields.BigIntField(default=0)
+    claimed = fields.BigIntField(default=0)
+
+    last_claim_date = fields.DatetimeField(null=True)
+    update_date = fields.DatetimeField(default=datetime.datetime.utcnow)
+
+
+class IdempotencyRecord(models.Model):
+    id = fields.IntField(pk=True)
+
+    # Sent by the client in the Idempotency-Key header
+    key = fields.CharField(max_length=255)
+    # Hash of the Authorization header, so keys are scoped to who sent them
+    owner = fields.CharField(max_length=64)
+    # Hash of the method, path and body of the first request with this key
+    fingerprint = fields.CharField(max_length=64)
+
+    # Both are null while the first request is still being processed
+    status_code = fields.IntField(null=True)
+    response_body = fields.TextField(null=True)
+    response_content_type = fields.CharField(max_length=128, null=True)
+
+    creation_date = fields.DatetimeField(default=datetime.datetime.utcnow)
+
+    class Meta:
+        unique_together = (("key", "owner"),)
@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
 from typing import Annotated
 
 from app import dependecy, specs
 from app.model import User, UserType, OrganizationMembership, Group, GroupMembership
-from app.lib import group
+from app.lib import counts, group
 
 import logging
 
@@ -42,9 +43,29 @@ async def group_create(
     if existing_group is not None:
         raise HTTPException(status_code=400, detail="Group identifier taken")
 
-    members = []  # This is so we don't change the database until everything is okay
+    # Validate every participant with a few queries before changing anything
+    users = {
+        member_user.email: member_user
+        for member_user in await User.filter(email__in=body.members)
+    }
+    memberships = {
+        membership.user_id: membership
+        for membership in await OrganizationMembership.filter(
+            organization=organization,
+            user_id__in=[member_user.id for member_user in users.values()],
+        )
+    }
+    grouped_user_ids = set(
+        await GroupMembership.filter(
+            user_id__in=list(memberships.keys()),
+            group__organization=organization,
+            accepted=True,
+        ).values_list("user_id", flat=True)
+    )
+
+    members = []
     for member_email in body.members:
-        member_user = await User.filter(email=member_email).first()
+        member_user = users.get(member_email)
         if member_user is None:
             raise HTTPException(
                 status_code=400, detail="Group participant account not found"
@@ -55,13 +76,7 @@ async def group_create(
                 status_code=400, detail="Group participant is not student"
             )
 
-        membership = (
-            await OrganizationMembership.filter(
-                Q(user=member_user) & Q(organization=organization)
-            )
-            .prefetch_related("user", "organization")
-            .first()
-        )
+        membership = memberships.get(member_user.id)
         if membership is None:
             raise HTTPException(
                 status_code=400,
@@ -74,7 +89,7 @@ async def group_create(
                 detail="Group participant has different area than leader",
             )
 
-        if await group.is_member_of_group(membership):
+        if member_user.id in grouped_user_ids:
             raise HTTPException(
                 status_code=400,
                 detail="Group participant is already member of a group",
@@ -82,19 +97,25 @@ async def group_create(
 
         members.append(member_user)
 
-    created_group = await Group.create(
-        identifier=body.identifier, name=body.name, organization=organization
-    )
+    async with in_transaction():
+        created_group = await Group.create(
+            identifier=body.identifier, name=body.name, organization=organization
+        )
 
-    await GroupMembership.create(
-        group=created_group,
-        user=user,
-        accepted=True,
-        leader=True,
-    )
+        await GroupMembership.bulk_create(
+            [
+                GroupMembership(
+                    group=created_group, user=user, accepted=True, leader=True
+                )
+            ]
+            + [
+                GroupMembership(group=created_group, user=member_user)
+                for member_user in members
+            ]
+        )
 
-    for member_user in members:
-        await GroupMembership.create(group=created_group, user=member_user)
+    for member_user in [user] + members:
+        counts.invalidate("user_groups", member_user.id)
 
     pydantic_group = await specs.GroupSpec.from_tortoise_orm(created_group)
 
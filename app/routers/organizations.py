@@ -1,19 +1,36 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import Annotated, List
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Annotated
+from tortoise.exceptions import IntegrityError
 from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
 
 from app import dependecy, specs
+from app.lib import (
+    auth,
+    balance,
+    counts,
+    enrollment,
+    pagination,
+    response,
+    serialize,
+    task_status,
+    upload,
+    organization as organization_lib,
+)
 from app.model import (
     User,
     UserType,
     Organization,
     OrganizationMembership,
     Task,
-    UserBalance,
+    TaskStatus,
 )
 
 
+import datetime
 import logging
+import orjson
 
 
 logging.basicConfig(
@@ -82,6 +99,7 @@ async def organization_edit(
 
     await organization.update_from_dict(update_dict)
     await organization.save()
+    await organization_lib.invalidate_organization(organization.identifier)
 
     pydantic_organization = await specs.OrganizationSpec.from_tortoise_orm(organization)
 
@@ -94,7 +112,7 @@ async def organization_join(
     body: specs.JoinOrganizationBodySpec,
     organization_identifier: str,
 ):
-    organization = await Organization.filter(identifier=organization_identifier).first()
+    organization = await organization_lib.get_organization(organization_identifier)
     if organization is None:
         raise HTTPException(status_code=404, detail="Organization not found")
 
@@ -140,34 +158,72 @@ async def organization_join(
             status_code=400, detail="Area selected does not exist in this organization"
         )
 
-    membership = await OrganizationMembership.create(
-        user=current_user,
-        organization=organization,
-        area=None if body.area is None else body.area.lower(),
-    )
+    try:
+        async with in_transaction():
+            membership = await OrganizationMembership.create(
+                user=current_user,
+                organization=organization,
+                area=None if body.area is None else body.area.lower(),
+            )
 
-    if organization.default_credits > 0:
-        await UserBalance.create(
-            amount=organization.default_credits, user_member=membership
+            if organization.default_credits > 0:
+                await balance.create_balance(
+                    amount=organization.default_credits, user_member=membership
+                )
+    except IntegrityError:
+        # Joined or was enrolled by another request meanwhile
+        raise HTTPException(
+            status_code=400, detail="User is already part of this organization"
         )
 
     return {"message": f"Successfully joined {organization_identifier}"}
 
 
+@router.post("/{organization_identifier}/enroll")
+async def organization_enroll(
+    current_user: Annotated[User, Depends(dependecy.get_current_active_user)],
+    organization_identifier: str,
+    request: Request,
+):
+    organization = await organization_lib.get_organization(organization_identifier)
+    if organization is None:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
+    if organization.admin_id != current_user.id:
+        raise HTTPException(
+            status_code=400,
+            detail="User does not have permission to enroll users in organization",
+        )
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    try:
+        results = await enrollment.enroll(
+            organization, enrollment.read_rows(request.stream(), content_type)
+        )
+    except upload.UploadFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        (orjson.dumps(result) + b"\n" for result in results),
+        media_type=upload.NDJSON_CONTENT_TYPE,
+    )
+
+
 @router.get("/{organization_identifier}", response_model=specs.OrganizationSpec)
 async def organization_read(organization_identifier: str):
-    organization = await Organization.filter(identifier=organization_identifier).first()
+    organization = await organization_lib.get_organization(organization_identifier)
     if organization is None:
         raise HTTPException(status_code=404, detail="Organization not found")
 
     pydantic_organization = await specs.OrganizationSpec.from_tortoise_orm(organization)
 
-    return pydantic_organization
+    return response.SpecResponse(pydantic_organization)
 
 
 @router.get("/{organization_identifier}/areas")
 async def organization_areas_read(organization_identifier: str):
-    organization = await Organization.filter(identifier=organization_identifier).first()
+    organization = await organization_lib.get_organization(organization_identifier)
     if organization is None:
         raise HTTPException(status_code=404, detail="Organization not found")
 
@@ -181,8 +237,18 @@ async def organization_tasks_read(
     count: Annotated[int, Query(ge=1, le=20)] = 10,
     individual: bool | None = None,
     group: bool | None = None,
+    status: Annotated[list[TaskStatus] | None, Query()] = None,
+    deadline_after: datetime.datetime | None = None,
+    deadline_before: datetime.datetime | None = None,
+    area: str | None = None,
+    group_identifier: str | None = None,
+    prefix: Annotated[str | None, Query(min_length=1, max_length=64)] = None,
+    sort: Annotated[
+        str, Query(pattern=r"^-?(creation_date|deadline)$")
+    ] = "-creation_date",
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
 ):
-    organization = await Organization.filter(identifier=organization_identifier).first()
+    organization = await organization_lib.get_organization(organization_identifier)
     if organization is None:
         raise HTTPException(status_code=404, detail="Organization not found")
 
@@ -194,52 +260,115 @@ async def organization_tasks_read(
     elif group is None:
         group = False
 
-    tasks: List["Task"] = []
+    if not individual and not group:
+        raise HTTPException(
+            status_code=400,
+            detail="There are no tasks which are neither group or individual",
+        )
 
-    if individual and group:
-        # Page 1 must be from first element to count element
-        # Page 2 must be from count element to 2*count element
-        tasks = (
-            Task.filter(
-                Q(group__organization=organization)
-                | Q(owner_membership__organization=organization)
-            )
-            .order_by("-creation_date")
-            .offset((page - 1) * count)
-            .limit(count)
-            .all()
+    # Every filter given is added to the same query
+    filters = {}
+    if individual != group:
+        filters["is_individual"] = individual
+    if status is not None:
+        filters["status__in"] = [value.value for value in status]
+    if deadline_after is not None:
+        filters["deadline__gte"] = deadline_after
+    if deadline_before is not None:
+        filters["deadline__lt"] = deadline_before
+    if area is not None:
+        filters["owner_membership__area"] = area.lower()
+    if group_identifier is not None:
+        filters["group__identifier"] = group_identifier
+
+    tasks = Task.filter(organization=organization, **filters)
+    if prefix is not None:
+        tasks = tasks.filter(
+            Q(name__startswith=prefix) | Q(identifier__startswith=prefix)
         )
-    elif individual:
-        tasks = (
-            Task.filter(
-                Q(owner_membership__organization=organization) & Q(is_individual=True)
-            )
-            .order_by("-creation_date")
-            .offset((page - 1) * count)
-            .limit(count)
-            .all()
+
+    # Totals are cached for each combination of filters
+    variant = repr(sorted(filters.items())) + repr(prefix)
+    count_tasks = await counts.get_count(
+        tasks, "organization_tasks", organization.id, variant
+    )
+    max_page = pagination.page_count(count_tasks, count)
+
+    tasks, next_cursor = await pagination.fetch_page(
+        tasks,
+        sort.lstrip("-"),
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.TaskSpec),
+        descending=sort.startswith("-"),
+    )
+
+    pydantic_tasks = serialize.build(specs.TaskSpec, tasks)
+
+    return response.SpecResponse(
+        specs.TasksResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            tasks=pydantic_tasks,
         )
-    elif group:
-        tasks = (
-            Task.filter(Q(group__organization=organization) & Q(is_individual=False))
-            .order_by("-creation_date")
-            .offset((page - 1) * count)
-            .limit(count)
-            .all()
+    )
+
+
+@router.get(
+    "/{organization_identifier}/tasks/inbox", response_model=specs.TasksResponse
+)
+async def organization_tasks_inbox_read(
+    current_membership: Annotated[
+        OrganizationMembership, Depends(dependecy.get_current_user_membership)
+    ],
+    page: Annotated[int, Query(ge=1)] = 1,
+    count: Annotated[int, Query(ge=1, le=20)] = 10,
+    start: bool = True,
+    submission: bool = True,
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
+):
+    if not auth.has_review_privileges(current_membership.user):
+        raise HTTPException(
+            status_code=400, detail="Only teacher can read the review inbox"
         )
-    else:
+
+    statuses = []
+    if start:
+        statuses.append(task_status.PENDING)
+    if submission:
+        statuses.append(task_status.SUBMITTED)
+
+    if len(statuses) == 0:
         raise HTTPException(
-            status_code=400,
-            detail="There are no tasks which are neither group or individual",
+            status_code=400, detail="Select start or submission reviews"
         )
 
-    count_tasks = await Task.filter(group__organization=organization).count()
-    max_page = (count_tasks // (count + 1)) + 1
+    tasks = Task.filter(
+        organization_id=current_membership.organization_id, status__in=statuses
+    )
 
-    pydantic_tasks = await specs.TaskSpec.from_queryset(tasks)
+    max_page = pagination.page_count(await tasks.count(), count)
 
-    return specs.TasksResponse(
-        current_page=page, max_page=max_page, tasks=pydantic_tasks
+    tasks, next_cursor = await pagination.fetch_page(
+        tasks,
+        "creation_date",
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.TaskSpec),
+    )
+
+    pydantic_tasks = serialize.build(specs.TaskSpec, tasks)
+
+    return response.SpecResponse(
+        specs.TasksResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            tasks=pydantic_tasks,
+        )
     )
 
 
@@ -250,25 +379,35 @@ async def organization_users_read(
     organization_identifier: str,
     page: Annotated[int, Query(ge=1)] = 1,
     count: Annotated[int, Query(ge=1, le=20)] = 10,
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
 ):
-    organization_memberships = await (
-        OrganizationMembership.filter(organization__identifier=organization_identifier)
-        .order_by("-membership_date")
-        .offset((page - 1) * count)
-        .limit(count)
-        .prefetch_related("user")
-        .all()
-    )
+    organization = await organization_lib.get_organization(organization_identifier)
+    if organization is None:
+        raise HTTPException(status_code=404, detail="Organization not found")
 
-    count_users = await OrganizationMembership.filter(
-        organization__identifier=organization_identifier
-    ).count()
-    max_page = (count_users // (count + 1)) + 1
+    organization_memberships = OrganizationMembership.filter(organization=organization)
 
-    pydantic_users = []
-    for membership in organization_memberships:
-        pydantic_users.append(await specs.UserSpec.from_tortoise_orm(membership.user))
+    count_users = await counts.get_count(
+        organization_memberships, "organization_users", organization.id
+    )
+    max_page = pagination.page_count(count_users, count)
+
+    organization_memberships, next_cursor = await pagination.fetch_page(
+        organization_memberships,
+        "membership_date",
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.UserSpec, "user__"),
+    )
+
+    pydantic_users = serialize.build(specs.UserSpec, organization_memberships, "user__")
 
-    return specs.OrganizationUsersResponse(
-        current_page=page, max_page=max_page, users=pydantic_users
+    return response.SpecResponse(
+        specs.OrganizationUsersResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            users=pydantic_users,
+        )
     )
@@ -1,11 +1,23 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from tortoise.expressions import Q
+from tortoise.exceptions import IntegrityError
+from tortoise.transactions import in_transaction
 from typing import Annotated
 
 from app import dependecy, specs
-from app.lib import balance, auth, group
+from app.lib import (
+    balance,
+    auth,
+    counts,
+    group,
+    pagination,
+    response,
+    serialize,
+    task_import,
+    task_status,
+    upload,
+)
 from app.model import (
-    UserBalance,
     OrganizationMembership,
     GroupMembership,
     Task,
@@ -15,6 +27,7 @@ from app.model import (
 )
 
 
+import datetime
 import logging
 
 
@@ -38,8 +51,7 @@ async def group_task_create(
     # Make sure there is no other task with this identifier in this
     # organization
     existing_task = await Task.filter(
-        Q(identifier=body.identifier)
-        & Q(group__organization=current_membership.organization)
+        identifier=body.identifier, organization_id=current_membership.organization_id
     ).first()
     if existing_task is not None:
         raise HTTPException(status_code=400, detail="Task identifier taken")
@@ -69,14 +81,18 @@ async def group_task_create(
                 detail="Select reward for user not member of this group",
             )
 
-    task = await Task.create(
-        identifier=body.identifier,
-        name=body.name,
-        description=body.description,
-        deadline=body.deadline,
-        group=group_membership.group,
-        is_individual=False,
-    )
+    try:
+        task = await Task.create(
+            identifier=body.identifier,
+            name=body.name,
+            description=body.description,
+            deadline=body.deadline,
+            group=group_membership.group,
+            organization_id=current_membership.organization_id,
+            is_individual=False,
+        )
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Task identifier taken")
 
     for reward, member in rewards.values():
         await TaskReward.create(group_member=member, task=task, reward=reward)
@@ -96,26 +112,128 @@ async def individual_task_create(
     # Make sure there is no other task with this identifier in this
     # organization
     existing_task = await Task.filter(
-        Q(identifier=body.identifier)
-        & Q(group__organization=current_membership.organization)
+        identifier=body.identifier, organization_id=current_membership.organization_id
     ).first()
     if existing_task is not None:
         raise HTTPException(status_code=400, detail="Task identifier taken")
 
-    task = await Task.create(
-        identifier=body.identifier,
-        name=body.name,
-        description=body.description,
-        deadline=body.deadline,
-        is_individual=True,
-        owner_membership=current_membership,
-    )
+    try:
+        task = await Task.create(
+            identifier=body.identifier,
+            name=body.name,
+            description=body.description,
+            deadline=body.deadline,
+            is_individual=True,
+            owner_membership=current_membership,
+            organization_id=current_membership.organization_id,
+        )
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Task identifier taken")
 
     pydantic_task = await specs.TaskSpec.from_tortoise_orm(task)
 
     return pydantic_task
 
 
+@router.post("/create/bulk")
+async def task_create_bulk(
+    current_membership: Annotated[
+        OrganizationMembership, Depends(dependecy.get_current_user_membership)
+    ],
+    request: Request,
+):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    try:
+        results = await task_import.import_tasks(
+            current_membership,
+            task_import.read_rows(request.stream(), content_type),
+        )
+    except upload.UploadFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return response.SpecResponse(results)
+
+
+@router.post("/start/review")
+async def task_start_review_bulk(
+    current_membership: Annotated[
+        OrganizationMembership, Depends(dependecy.get_current_user_membership)
+    ],
+    body: specs.ReviewTaskStartsBodySpec,
+):
+    if not auth.has_review_privileges(current_membership.user):
+        raise HTTPException(
+            status_code=400, detail="Only teacher can review task starts"
+        )
+
+    results = []
+    decisions = {True: [], False: []}
+
+    async with in_transaction():
+        # Locked so concurrent reviews of the same tasks wait for this one, in
+        # the same order so overlapping reviews can not deadlock
+        locked = (
+            await Task.filter(
+                organization_id=current_membership.organization_id,
+                identifier__in=[review.identifier for review in body.reviews],
+            )
+            .order_by("id")
+            .select_for_update()
+        )
+        tasks = {task.identifier: task for task in locked}
+
+        reviewed = set()
+        for review in body.reviews:
+            task = tasks.get(review.identifier)
+
+            if task is None:
+                detail = "Task not found"
+            elif review.identifier in reviewed:
+                detail = "Task is reviewed more than once"
+            elif task.status != task_status.PENDING:
+                detail = "Task has already started"
+            else:
+                reviewed.add(review.identifier)
+                decisions[review.approve].append(task.id)
+                results.append(
+                    {
+                        "identifier": review.identifier,
+                        "status": "approved" if review.approve else "rejected",
+                    }
+                )
+                continue
+
+            results.append(
+                {"identifier": review.identifier, "status": "error", "detail": detail}
+            )
+
+        for approve, task_ids in decisions.items():
+            await task_status.transition_many(
+                task_ids, "approve_start" if approve else "reject_start"
+            )
+
+        await TaskAction.bulk_create(
+            [
+                TaskAction(
+                    name="Approve task start" if approve else "Reject task start",
+                    description="",
+                    author_id=current_membership.user_id,
+                    task_id=task_id,
+                )
+                for approve, task_ids in decisions.items()
+                for task_id in task_ids
+            ]
+        )
+
+    counts.invalidate("organization_tasks", current_membership.organization_id)
+    for task_ids in decisions.values():
+        for task_id in task_ids:
+            counts.invalidate("task_actions", task_id)
+
+    return {"results": results}
+
+
 @router.post("/{task_identifier}/start/approve")
 async def task_start_approve(
     current_membership: Annotated[
@@ -128,10 +246,6 @@ async def task_start_approve(
             status_code=400, detail="Only teacher can approve task start"
         )
 
-    if task.is_approved_start or task.is_rejected_start:
-        raise HTTPException(status_code=400, detail="Task has already started")
-
-    task.update_from_dict({"is_approved_start": True, "is_rejected_start": False})
     task_action = TaskAction(
         name="Approve task start",
         description="",
@@ -139,8 +253,12 @@ async def task_start_approve(
         task=task,
     )
 
-    await task.save()
-    await task_action.save()
+    try:
+        async with in_transaction():
+            await task_status.transition(task, "approve_start")
+            await task_action.save()
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"message": "Successfully aproved start of task"}
 
@@ -157,10 +275,6 @@ async def task_start_reject(
             status_code=400, detail="Does not have permission to approve task start"
         )
 
-    if task.is_approved_start or task.is_rejected_start:
-        raise HTTPException(status_code=400, detail="Task has already started")
-
-    task.update_from_dict({"is_approved_start": False, "is_rejected_start": True})
     task_action = TaskAction(
         name="Reject task start",
         description="",
@@ -168,8 +282,12 @@ async def task_start_reject(
         task=task,
     )
 
-    await task.save()
-    await task_action.save()
+    try:
+        async with in_transaction():
+            await task_status.transition(task, "reject_start")
+            await task_action.save()
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"message": "Successfully rejected start of task"}
 
@@ -187,14 +305,6 @@ async def task_submission(
             status_code=400, detail="User does not have user permissions for this task"
         )
 
-    if not task.is_approved_start:
-        raise HTTPException(
-            status_code=400, detail="Task has not been approved by a teacher yet"
-        )
-
-    if task.is_rejected_completed or task.is_approved_completed:
-        raise HTTPException(status_code=400, detail="Task is not active anymore")
-
     task_action = TaskAction(
         name=body.name,
         description=body.description,
@@ -203,7 +313,12 @@ async def task_submission(
         is_submission=True,
     )
 
-    await task_action.save()
+    try:
+        async with in_transaction():
+            await task_status.transition(task, "submit")
+            await task_action.save()
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"message": "Successfully submitted task for review"}
 
@@ -222,55 +337,6 @@ async def task_submission_approve(
             detail="User does not have permission to approve task submission",
         )
 
-    if not task.is_approved_start:
-        raise HTTPException(
-            status_code=400, detail="Task has not been approved by a teacher yet"
-        )
-
-    if task.is_rejected_completed or task.is_approved_completed:
-        raise HTTPException(status_code=400, detail="Task is not active anymore")
-
-    if task.is_individual:
-        funds = await TaskFund.filter(task=task).all()
-
-        if not task.owner_membership:
-            raise ValueError(f"Task {task.identifier} is individual but has no owner")
-
-        for fund in funds:
-            await fund.fetch_related("user_member")
-            await fund.fetch_related("task")
-
-            await balance.fund_release(fund)
-
-            fund.is_completed = True
-            await fund.save()
-    else:
-        rewards = await TaskReward.filter(task=task).all()
-
-        for reward in rewards:
-            await reward.fetch_related("group_member")
-            await reward.group_member.fetch_related("user")
-            await reward.group_member.fetch_related("group")
-            await reward.group_member.group.fetch_related("organization")
-
-            # Find user organization membership
-            user_membership = await OrganizationMembership.filter(
-                Q(user=reward.group_member.user)
-                & Q(organization=reward.group_member.group.organization)
-            ).first()
-            if user_membership is None:
-                raise ValueError(
-                    f"Could not find user membership for group membership {reward.group_member.id}"
-                )
-
-            reward.is_completed = True
-            await reward.save()
-
-            await UserBalance.create(amount=reward.reward, user_member=user_membership)
-
-    task.update_from_dict(
-        {"is_approved_completed": True, "is_rejected_completed": False}
-    )
     task_action = TaskAction(
         name="Approve task submission",
         description=body.description,
@@ -279,8 +345,25 @@ async def task_submission_approve(
         is_review=True,
     )
 
-    await task.save()
-    await task_action.save()
+    try:
+        async with balance.ledger_write() as deltas:
+            await task_status.transition(task, "approve_submission")
+
+            if task.is_individual:
+                if not task.owner_membership:
+                    raise ValueError(
+                        f"Task {task.identifier} is individual but has no owner"
+                    )
+
+                await balance.settle_task_funds(task, release=True, deltas=deltas)
+            else:
+                await balance.pay_task_rewards(
+                    task, current_membership.organization_id, deltas
+                )
+
+            await task_action.save()
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"message": "Successfully approved task submission"}
 
@@ -299,38 +382,6 @@ async def task_submission_reject(
             detail="User does not have permission to reject task submission",
         )
 
-    if not task.is_approved_start:
-        raise HTTPException(
-            status_code=400, detail="Task has not been approved by a teacher yet"
-        )
-
-    if task.is_rejected_completed or task.is_approved_completed:
-        raise HTTPException(status_code=400, detail="Task is not active anymore")
-
-    if task.is_individual:
-        funds = await TaskFund.filter(task=task).all()
-
-        if not task.owner_membership:
-            raise ValueError(f"Task {task.identifier} is individual but has no owner")
-
-        for fund in funds:
-            await fund.fetch_related("user_member")
-            await fund.fetch_related("task")
-
-            await balance.fund_retreat(fund)
-
-            fund.is_completed = True
-            await fund.save()
-    else:
-        rewards = await TaskReward.filter(task=task).all()
-
-        for reward in rewards:
-            reward.is_completed = True
-            await reward.save()
-
-    task.update_from_dict(
-        {"is_approved_completed": False, "is_rejected_completed": True}
-    )
     task_action = TaskAction(
         name="Reject task submission",
         description=body.description,
@@ -339,8 +390,25 @@ async def task_submission_reject(
         is_review=True,
     )
 
-    await task.save()
-    await task_action.save()
+    try:
+        async with in_transaction():
+            await task_status.transition(task, "reject_submission")
+
+            if task.is_individual:
+                if not task.owner_membership:
+                    raise ValueError(
+                        f"Task {task.identifier} is individual but has no owner"
+                    )
+
+                await balance.settle_task_funds(task, release=False)
+            else:
+                await TaskReward.filter(task=task).update(
+                    is_completed=True, complete_date=datetime.datetime.utcnow()
+                )
+
+            await task_action.save()
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"message": "Successfully rejected task submission"}
 
@@ -358,18 +426,6 @@ async def task_submission_review(
             status_code=400, detail="User does not have user permissions for this task"
         )
 
-    if not task.is_approved_start:
-        raise HTTPException(
-            status_code=400, detail="Task has not been approved by a teacher yet"
-        )
-
-    if task.is_rejected_completed or task.is_approved_completed:
-        raise HTTPException(status_code=400, detail="Task is not active anymore")
-
-    if body.extended_deadline is not None:
-        task.update_from_dict({"deadline": body.extended_deadline})
-        await task.save()
-
     task_action = TaskAction(
         name="Asked to review and resubmit task",
         description=body.description,
@@ -378,7 +434,16 @@ async def task_submission_review(
         is_review=True,
     )
 
-    await task_action.save()
+    changes = {}
+    if body.extended_deadline is not None:
+        changes["deadline"] = body.extended_deadline
+
+    try:
+        async with in_transaction():
+            await task_status.transition(task, "request_changes", **changes)
+            await task_action.save()
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"message": "Successfully asked for a task resubmission"}
 
@@ -391,13 +456,10 @@ async def task_fund(
     task: Annotated[Task, Depends(dependecy.get_individual_task)],
     body: specs.FundTaskBodySpec,
 ):
-    if not task.is_approved_start:
-        raise HTTPException(
-            status_code=400, detail="Task has not been approved by a teacher yet"
-        )
-
-    if task.is_rejected_completed or task.is_approved_completed:
-        raise HTTPException(status_code=400, detail="Task is not active anymore")
+    try:
+        task_status.check(task.status, task_status.STARTED)
+    except task_status.TransitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     if task.is_individual == False:
         raise HTTPException(status_code=400, detail="Task must be individual to fund")
@@ -409,14 +471,6 @@ async def task_fund(
                 detail=f"Cannot fund task from student of same school. {current_membership.area}",
             )
 
-    # Make sure user has balance
-    user_balance = await balance.get_user_available_balance(current_membership)
-    if user_balance < body.amount:
-        raise HTTPException(
-            status_code=400,
-            detail=f"User does not have enough balance. Has {user_balance} tokens in wallet.",
-        )
-
     # Check if there exists a task fund from this user to this task already
     existing_task_fund = await TaskFund.filter(
         Q(user_member=current_membership) & Q(task=task)
@@ -426,19 +480,27 @@ async def task_fund(
             status_code=400, detail=f"User has already funded this task"
         )
 
-    task_fund = await TaskFund.create(
-        amount=body.amount, user_member=current_membership, task=task
-    )
-
-    await balance.fund_escrow(task_fund)
+    try:
+        async with in_transaction():
+            await balance.fund_task(current_membership, task, body.amount)
 
-    task_action = TaskAction(
-        name="Task funded",
-        description=f"Task funded with {body.amount} tokens. Funds will be available upon completion.",
-        author=current_membership.user,
-        task=task,
-    )
-    await task_action.save()
+            task_action = TaskAction(
+                name="Task funded",
+                description=f"Task funded with {body.amount} tokens. Funds will be available upon completion.",
+                author=current_membership.user,
+                task=task,
+            )
+            await task_action.save()
+    except balance.InsufficientBalanceError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"User does not have enough balance. Has {e.available} tokens in wallet.",
+        )
+    except IntegrityError:
+        # Funded by a concurrent request since the check above
+        raise HTTPException(
+            status_code=400, detail=f"User has already funded this task"
+        )
 
     return {"message": "Successfully funded task"}
 
@@ -447,22 +509,16 @@ async def task_fund(
 async def task_read(task: Annotated[Task, Depends(dependecy.get_task)]):
     pydantic_task = await specs.TaskSpec.from_tortoise_orm(task)
 
-    return pydantic_task
+    return response.SpecResponse(pydantic_task)
 
 
 @router.get("/{task_identifier}/members", response_model=list[specs.UserSpec])
 async def task_members_read(task: Annotated[Task, Depends(dependecy.get_group_task)]):
-    members = (
-        await GroupMembership.filter(Q(group=task.group) & Q(accepted=True))
-        .prefetch_related("user")
-        .all()
-    )
-
-    users = []
-    for member in members:
-        users.append(await specs.UserSpec.from_tortoise_orm(member.user))
+    members = await GroupMembership.filter(
+        group_id=task.group_id, accepted=True
+    ).values(*serialize.lookups(specs.UserSpec, "user__"))
 
-    return users
+    return response.SpecResponse(serialize.build(specs.UserSpec, members, "user__"))
 
 
 @router.get("/{task_identifier}/owner", response_model=specs.UserSpec)
@@ -473,7 +529,7 @@ async def task_owner_read(
     await task.owner_membership.fetch_related("user")
 
     pydantic_user = await specs.UserSpec.from_tortoise_orm(task.owner_membership.user)
-    return pydantic_user
+    return response.SpecResponse(pydantic_user)
 
 
 @router.get("/{task_identifier}/actions", response_model=specs.TaskActionsResponse)
@@ -481,20 +537,29 @@ async def task_actions_read(
     task: Annotated[Task, Depends(dependecy.get_task)],
     page: Annotated[int, Query(ge=1)] = 1,
     count: Annotated[int, Query(ge=1, le=20)] = 10,
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
 ):
-    task_actions = (
-        TaskAction.filter(task=task)
-        .order_by("-action_date")
-        .offset((page - 1) * count)
-        .limit(count)
-        .all()
+    task_actions = TaskAction.filter(task=task)
+
+    count_actions = await counts.get_count(task_actions, "task_actions", task.id)
+    max_page = pagination.page_count(count_actions, count)
+
+    task_actions, next_cursor = await pagination.fetch_page(
+        task_actions,
+        "action_date",
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.TaskActionSpec),
     )
 
-    count_tasks = await TaskAction.filter(task=task).count()
-    max_page = (count_tasks // (count + 1)) + 1
-
-    pydantic_actions = await specs.TaskActionSpec.from_queryset(task_actions)
+    pydantic_actions = serialize.build(specs.TaskActionSpec, task_actions)
 
-    return specs.TaskActionsResponse(
-        current_page=page, max_page=max_page, actions=pydantic_actions
+    return response.SpecResponse(
+        specs.TaskActionsResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            actions=pydantic_actions,
+        )
     )
@@ -4,8 +4,19 @@ from tortoise.expressions import Q
 from typing import Annotated
 
 from app import dependecy, specs
-from app.model import User, OrganizationMembership, GroupMembership, Task, UserBalance
-from app.lib import cardano, auth, balance, group, environment, utils
+from app.model import User, OrganizationMembership, GroupMembership, Task
+from app.lib import (
+    cardano,
+    auth,
+    balance,
+    counts,
+    group,
+    environment,
+    pagination,
+    response,
+    serialize,
+    utils,
+)
 
 import pycardano as pyc
 import datetime
@@ -26,7 +37,15 @@ router = APIRouter(prefix="/users")
 async def user_login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
 ):
-    user = await auth.authenticate_user(form_data.username, form_data.password)
+    try:
+        user = await auth.authenticate_user(form_data.username, form_data.password)
+    except cardano.VerifierBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": "1"},
+        )
+
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -35,9 +54,7 @@ async def user_login_for_access_token(
         )
 
     access_token_expires = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(
-        data={"sub": user.stake_address}, expires_delta=access_token_expires
-    )
+    access_token = auth.create_user_access_token(user, access_token_expires)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -56,7 +73,18 @@ async def user_register(body: specs.RegisterBodySpec):
             detail="Stake address is from preprod, but it must be from mainnet",
         )
 
-    if not cardano.verify_signature(body.signature, body.stake_address):
+    try:
+        verified = await cardano.verify_signature_async(
+            body.signature, body.stake_address
+        )
+    except cardano.VerifierBusyError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    if not verified:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
     user = await User.filter(
@@ -86,11 +114,13 @@ async def user_email_confirm(
             {"email_validation_string": utils.string_generator()}
         )
         await current_user.save()
+        auth.invalidate_user(current_user)
 
         raise HTTPException(status_code=400, detail="Wrong email string")
 
     await current_user.update_from_dict({"active": True})
     await current_user.save()
+    auth.invalidate_user(current_user)
 
     return {"message": "Successfully confirmed the email"}
 
@@ -114,6 +144,7 @@ async def user_add_payment_address(
 
     await current_user.update_from_dict({"payment_address": body.address})
     await current_user.save()
+    auth.invalidate_user(current_user)
 
     return {"message": "Successfully confirmed the email"}
 
@@ -124,7 +155,7 @@ async def user_read(
 ):
     pydantic_user = await specs.UserSpec.from_tortoise_orm(current_user)
 
-    return pydantic_user
+    return response.SpecResponse(pydantic_user)
 
 
 @router.get("/me/organizations", response_model=specs.UserOrganizationsResponse)
@@ -132,27 +163,35 @@ async def user_organizations_read(
     current_user: Annotated[specs.UserSpec, Depends(dependecy.get_current_active_user)],
     page: Annotated[int, Query(ge=1)] = 1,
     count: Annotated[int, Query(ge=1, le=20)] = 10,
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
 ):
-    organization_memberships = await (
-        OrganizationMembership.filter(user=current_user)
-        .order_by("-membership_date")
-        .offset((page - 1) * count)
-        .limit(count)
-        .prefetch_related("organization")
-        .all()
+    organization_memberships = OrganizationMembership.filter(user=current_user)
+
+    count_organizations = await counts.get_count(
+        organization_memberships, "user_organizations", current_user.id
+    )
+    max_page = pagination.page_count(count_organizations, count)
+
+    organization_memberships, next_cursor = await pagination.fetch_page(
+        organization_memberships,
+        "membership_date",
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.OrganizationSpec, "organization__"),
     )
 
-    count_users = await OrganizationMembership.filter(user=current_user).count()
-    max_page = (count_users // (count + 1)) + 1
+    pydantic_organizations = serialize.build(
+        specs.OrganizationSpec, organization_memberships, "organization__"
+    )
 
-    pydantic_organizations = []
-    for membership in organization_memberships:
-        pydantic_organizations.append(
-            await specs.OrganizationSpec.from_tortoise_orm(membership.organization)
+    return response.SpecResponse(
+        specs.UserOrganizationsResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            organizations=pydantic_organizations,
         )
-
-    return specs.UserOrganizationsResponse(
-        current_page=page, max_page=max_page, organizations=pydantic_organizations
     )
 
 
@@ -166,30 +205,39 @@ async def user_tasks_read(
     ],
     page: Annotated[int, Query(ge=1)] = 1,
     count: Annotated[int, Query(ge=1, le=20)] = 10,
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
 ):
     group_membership = await group.get_user_group_membership(current_membership)
     if group_membership is None:
-        return specs.TasksResponse(current_page=1, max_page=1, tasks=[])
-
-    await group_membership.fetch_related("group")
-
-    # Page 1 must be from first element to count element
-    # Page 2 must be from count element to 2*count element
-    tasks = (
-        Task.filter(group=group_membership.group)
-        .order_by("-creation_date")
-        .offset((page - 1) * count)
-        .limit(count)
-        .all()
-    )
+        return response.SpecResponse(
+            specs.TasksResponse(current_page=1, max_page=1, tasks=[])
+        )
 
-    count_tasks = await Task.filter(group=group_membership.group).count()
-    max_page = (count_tasks // (count + 1)) + 1
+    tasks = Task.filter(group_id=group_membership.group_id)
+
+    count_tasks = await counts.get_count(
+        tasks, "group_tasks", group_membership.group_id
+    )
+    max_page = pagination.page_count(count_tasks, count)
+
+    tasks, next_cursor = await pagination.fetch_page(
+        tasks,
+        "creation_date",
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.TaskSpec),
+    )
 
-    pydantic_tasks = await specs.TaskSpec.from_queryset(tasks)
+    pydantic_tasks = serialize.build(specs.TaskSpec, tasks)
 
-    return specs.TasksResponse(
-        current_page=page, max_page=max_page, tasks=pydantic_tasks
+    return response.SpecResponse(
+        specs.TasksResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            tasks=pydantic_tasks,
+        )
     )
 
 
@@ -202,25 +250,16 @@ async def user_balance_read(
         OrganizationMembership, Depends(dependecy.get_current_user_membership)
     ]
 ):
-    owed_balance = await balance.get_user_owed_balance(current_membership)
-    escrowed_balance = await balance.get_user_escrowed_balance(current_membership)
-    claimed_balance = await balance.get_user_claimed_balance(current_membership)
-
-    last_claim_date = (
-        await UserBalance.filter(Q(user_member=current_membership) & Q(is_claimed=True))
-        .order_by("-claim_date")
-        .first()
-    )
-
-    if last_claim_date is not None:
-        last_claim_date = last_claim_date.claim_date.isoformat()
-
-    return specs.BalanceResponse(
-        owed=owed_balance,
-        available=owed_balance - escrowed_balance,
-        escrowed=escrowed_balance,
-        claimed=claimed_balance,
-        last_claim_date=last_claim_date,
+    summary = await balance.get_user_balance_summary(current_membership)
+
+    return response.SpecResponse(
+        specs.BalanceResponse(
+            owed=summary.owed,
+            available=summary.available,
+            escrowed=summary.escrowed,
+            claimed=summary.claimed,
+            last_claim_date=summary.last_claim_date,
+        )
     )
 
 
@@ -234,34 +273,39 @@ async def user_groups_read(
     ],
     page: Annotated[int, Query(ge=1)] = 1,
     count: Annotated[int, Query(ge=1, le=20)] = 10,
+    cursor: Annotated[tuple | None, Depends(dependecy.get_page_cursor)] = None,
 ):
-    group_memberships = await (
-        GroupMembership.filter(
-            Q(user=organization_membership.user)
-            & Q(group__organization=organization_membership.organization)
-        )
-        .order_by("-invite_date")
-        .offset((page - 1) * count)
-        .limit(count)
-        .prefetch_related("group")
-        .all()
+    group_memberships = GroupMembership.filter(
+        user_id=organization_membership.user_id,
+        group__organization_id=organization_membership.organization_id,
     )
 
-    count_groups = await OrganizationMembership.filter(
-        user=organization_membership.user
-    ).count()
-    max_page = (count_groups // (count + 1)) + 1
+    count_groups = await counts.get_count(
+        group_memberships,
+        "user_groups",
+        organization_membership.user_id,
+        str(organization_membership.organization_id),
+    )
+    max_page = pagination.page_count(count_groups, count)
+
+    group_memberships, next_cursor = await pagination.fetch_page(
+        group_memberships,
+        "invite_date",
+        page,
+        count,
+        cursor,
+        values=serialize.lookups(specs.GroupMembershipExtendedSpec),
+    )
 
-    pydantic_groups_membership = []
-    for membership in group_memberships:
-        group_membership = await specs.GroupMembershipSpec.from_tortoise_orm(membership)
+    pydantic_groups_membership = serialize.build(
+        specs.GroupMembershipExtendedSpec, group_memberships
+    )
 
-        pydantic_groups_membership.append(
-            specs.GroupMembershipExtendedSpec(
-                **group_membership.model_dump(), group=membership.group
-            )
+    return response.SpecResponse(
+        specs.OrganizationGroupsResponse(
+            current_page=page,
+            max_page=max_page,
+            next_cursor=next_cursor,
+            groups=pydantic_groups_membership,
         )
-
-    return specs.OrganizationGroupsResponse(
-        current_page=page, max_page=max_page, groups=pydantic_groups_membership
     )
@@ -21,6 +21,7 @@ class TokenSpec(BaseModel):
 
 class TokenDataSpec(BaseModel):
     username: str | None = None
+    user_id: int | None = None
 
 
 class RegisterBodySpec(BaseModel):
@@ -79,6 +80,20 @@ class CreateIndividualTaskBodySpec(BaseModel):
     deadline: datetime.datetime
 
 
+class ImportTaskRowSpec(CreateIndividualTaskBodySpec):
+    owner: Optional[str] = None  # email of the member doing the task
+    approved: bool = False  # start approved by the importer
+
+
+class TaskStartReviewSpec(BaseModel):
+    identifier: str
+    approve: bool  # otherwise reject
+
+
+class ReviewTaskStartsBodySpec(BaseModel):
+    reviews: Annotated[list[TaskStartReviewSpec], Field(max_length=500)]
+
+
 class SubmitTaskBodySpec(BaseModel):
     name: Annotated[str, Field(max_length=128)]
     description: Annotated[str, Field(max_length=1024)]
@@ -100,6 +115,8 @@ class FundTaskBodySpec(BaseModel):
 class ListResponse(BaseModel):
     current_page: int
     max_page: int
+    # Pass as cursor to get the next page, None on the last one
+    next_cursor: Optional[str] = None
 
 
 class TasksResponse(ListResponse):
@@ -0,0 +1,96 @@
+from tortoise import Tortoise, run_async
+
+from app import specs
+from app.lib import serialize
+from app.model import User, Organization, OrganizationMembership, Task
+
+import datetime
+import time
+
+
+async def per_row(limit: int):
+    tasks = await Task.all().order_by("-creation_date").limit(limit)
+    start = time.perf_counter()
+
+    result = [await specs.TaskSpec.from_tortoise_orm(task) for task in tasks]
+
+    return result, time.perf_counter() - start
+
+
+async def batch(limit: int):
+    tasks = (
+        await Task.all()
+        .order_by("-creation_date")
+        .limit(limit)
+        .values(*serialize.lookups(specs.TaskSpec))
+    )
+    start = time.perf_counter()
+
+    result = serialize.build(specs.TaskSpec, tasks)
+
+    return result, time.perf_counter() - start
+
+
+async def measure(serializer, limit: int, repeat: int):
+    total = 0
+    serializing = 0
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result, elapsed = await serializer(limit)
+
+        total += time.perf_counter() - start
+        serializing += elapsed
+
+    assert len(result) == limit
+    print(
+        f"{serializer.__name__}: {limit} rows in {total / repeat * 1000:.2f}ms, "
+        f"{serializing / repeat * 1000:.2f}ms of them serializing"
+    )
+
+
+async def benchmark():
+    await Tortoise.init(db_url="sqlite://:memory:", modules={"models": ["app.model"]})
+    await Tortoise.generate_schemas()
+
+    user = await User.create(type="student", email="a@email.com", stake_address="a")
+    organization = await Organization.create(
+        identifier="benchmark",
+        name="",
+        description="",
+        students_password="",
+        teachers_password="",
+        supervisor_password="",
+        areas=[],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization
+    )
+
+    await Task.bulk_create(
+        [
+            Task(
+                identifier=f"task_{index}",
+                name=f"Task {index}",
+                description="",
+                deadline=datetime.datetime(2024, 1, 1),
+                is_individual=True,
+                owner_membership=membership,
+                organization=organization,
+            )
+            for index in range(10_000)
+        ],
+        batch_size=1000,
+    )
+
+    for serializer in [per_row, batch]:
+        # A page of a list endpoint
+        await measure(serializer, 20, 200)
+        # An export of a whole organization
+        await measure(serializer, 10_000, 3)
+
+    await Tortoise.close_connections()
+
+
+run_async(benchmark())
@@ -0,0 +1,65 @@
+from app.lib import cardano
+
+import asyncio
+import statistics
+import sys
+import time
+
+
+STAKE_ADDRESS = "stake1uymfqdggvdrauqfh36jm4us9ac5pm7n9hj68gj8mf2pfjlscj8s0c"
+SIGNATURE = "a4010103272006215820a7823182f1b024de887bf1063f5a1dbfaa8df39aa6699c3904121c2db7124f67H1+DFJCghAmokzYG84582aa201276761646472657373581de1369035086347de01378ea5baf205ee281dfa65bcb47448fb4a82997ea166686173686564f458403d3d3d3d3d3d4f4e4c59205349474e20494620594f552041524520494e206170702e617468656e616c61626f2e636f6d3d3d3d3d3d3d31373033363837383832584026b7c67ee6691cd84550993d76880bd8aeaaef941c925ec0691561ee762c53caf4e8c28d7056a4946604187e10884e041dee5f0023f6bd1f7c480ac8c82be50f"
+
+TICK = 0.001
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def blocking_login():
+    cardano.verify_signature(SIGNATURE, STAKE_ADDRESS)
+
+
+async def offloaded_login():
+    await cardano.verify_signature_async(SIGNATURE, STAKE_ADDRESS)
+
+
+async def login_storm(login, logins: int):
+    stop = asyncio.Event()
+    lags = []
+
+    ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+    await asyncio.sleep(TICK * 10)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await ticker
+
+    lags.sort()
+    print(
+        f"{login.__name__}: {logins} logins in {elapsed:.2f}s, event loop lag "
+        f"p50 {statistics.median(lags) * 1000:.1f}ms, "
+        f"p99 {lags[int(len(lags) * 0.99)] * 1000:.1f}ms, "
+        f"max {lags[-1] * 1000:.1f}ms"
+    )
+
+
+async def benchmark(logins: int):
+    # Every login is a cache miss, as in a storm of distinct users
+    cardano.signature_cache = cardano.SignatureCache(0)
+    cardano.signature_verifier.queue_size = logins
+
+    await login_storm(blocking_login, logins)
+    await login_storm(offloaded_login, logins)
+
+    cardano.signature_verifier.shutdown()
+
+
+# Usage: python3 benchmark_signature_verification.py [logins]
+asyncio.run(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,19 @@
+from tortoise import Tortoise, run_async
+from app.lib import environment, balance
+
+import sys
+
+
+DATABASE = environment.get("DATABASE")
+
+
+async def compact(min_fragments: int):
+    await Tortoise.init(db_url=DATABASE, modules={"models": ["app.model"]})
+
+    compacted_count = await balance.compact_all_balances(min_fragments)
+
+    print(f"Compacted balances of {compacted_count} memberships")
+
+
+# Usage: python3 compact_balances.py [min_fragments]
+run_async(compact(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -0,0 +1,50 @@
+from tortoise import Tortoise, run_async
+from app.lib import environment, task_import, upload
+from app.model import OrganizationMembership
+
+import orjson
+import sys
+
+
+DATABASE = environment.get("DATABASE")
+
+CONTENT_TYPES = {".csv": upload.CSV_CONTENT_TYPE, ".json": upload.JSON_CONTENT_TYPE}
+
+
+async def read_file(path: str, size: int = 64 * 1024):
+    with open(path, "rb") as file:
+        while chunk := file.read(size):
+            yield chunk
+
+
+async def main(organization_identifier: str, email: str, path: str):
+    await Tortoise.init(db_url=DATABASE, modules={"models": ["app.model"]})
+
+    membership = (
+        await OrganizationMembership.filter(
+            organization__identifier=organization_identifier, user__email=email
+        )
+        .select_related("user", "organization")
+        .first()
+    )
+    if membership is None:
+        sys.exit(f"{email} is not a member of {organization_identifier}")
+
+    extension = path[path.rfind(".") :].lower()
+    if extension not in CONTENT_TYPES:
+        sys.exit("Tasks must be given as a .csv or .json file")
+
+    results = await task_import.import_tasks(
+        membership, task_import.read_rows(read_file(path), CONTENT_TYPES[extension])
+    )
+    for result in results:
+        print(orjson.dumps(result).decode())
+
+    created = sum(result["status"] == "created" for result in results)
+    print(f"Created {created} of {len(results)} tasks", file=sys.stderr)
+
+
+if len(sys.argv) != 4:
+    sys.exit("Usage: python3 import_tasks.py <organization> <email> <tasks.csv|.json>")
+
+run_async(main(*sys.argv[1:4]))
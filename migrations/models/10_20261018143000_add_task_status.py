@@ -0,0 +1,21 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "task" ADD "status" VARCHAR(16) NOT NULL  DEFAULT 'pending';
+        UPDATE "task" SET "status" = CASE WHEN "is_approved_completed" THEN 'completed' WHEN "is_rejected_completed" THEN 'failed' WHEN "is_rejected_start" THEN 'rejected' WHEN "is_approved_start" AND "is_review_pending" THEN 'submitted' WHEN "is_approved_start" THEN 'active' ELSE 'pending' END;
+        DROP INDEX "idx_task_organiz_a69646";
+        DROP INDEX "idx_task_organiz_8061b3";
+        ALTER TABLE "task" DROP COLUMN "is_review_pending";
+        CREATE INDEX "idx_task_organiz_f2f696" ON "task" ("organization_id", "status", "creation_date", "id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_task_organiz_f2f696";
+        ALTER TABLE "task" ADD "is_review_pending" BOOL NOT NULL  DEFAULT False;
+        UPDATE "task" SET "is_review_pending" = TRUE WHERE "status" = 'submitted';
+        CREATE INDEX "idx_task_organiz_a69646" ON "task" ("organization_id", "is_approved_start", "is_rejected_start", "creation_date", "id");
+        CREATE INDEX "idx_task_organiz_8061b3" ON "task" ("organization_id", "is_review_pending", "creation_date", "id");
+        ALTER TABLE "task" DROP COLUMN "status";"""
@@ -0,0 +1,17 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX "idx_organizatio_organiz_b75b43" ON "organizationmembership" ("organization_id", "area");
+        CREATE INDEX "idx_task_organiz_4eff74" ON "task" ("organization_id", "deadline", "id");
+        CREATE INDEX "idx_task_organiz_ddacb9" ON "task" ("organization_id", "name" varchar_pattern_ops);
+        CREATE INDEX "idx_task_organiz_dce28b" ON "task" ("organization_id", "identifier" varchar_pattern_ops);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_organizatio_organiz_b75b43";
+        DROP INDEX "idx_task_organiz_4eff74";
+        DROP INDEX "idx_task_organiz_ddacb9";
+        DROP INDEX "idx_task_organiz_dce28b";"""
@@ -0,0 +1,11 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE UNIQUE INDEX "uid_organizatio_user_id_7451d4" ON "organizationmembership" ("user_id", "organization_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "uid_organizatio_user_id_7451d4";"""
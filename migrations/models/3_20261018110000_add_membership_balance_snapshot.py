@@ -0,0 +1,29 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "membershipbalancesnapshot" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "owed" BIGINT NOT NULL  DEFAULT 0,
+    "escrowed" BIGINT NOT NULL  DEFAULT 0,
+    "claimed" BIGINT NOT NULL  DEFAULT 0,
+    "last_claim_date" TIMESTAMPTZ,
+    "update_date" TIMESTAMPTZ NOT NULL,
+    "user_member_id" INT NOT NULL UNIQUE REFERENCES "organizationmembership" ("id") ON DELETE CASCADE
+);
+        INSERT INTO "membershipbalancesnapshot" ("user_member_id", "owed", "escrowed", "claimed", "last_claim_date", "update_date")
+    SELECT "m"."id",
+        COALESCE(SUM("b"."amount") FILTER (WHERE NOT "b"."is_claimed"), 0),
+        COALESCE(SUM("b"."amount") FILTER (WHERE NOT "b"."is_claimed" AND "b"."is_escrowed"), 0),
+        COALESCE(SUM("b"."amount") FILTER (WHERE "b"."is_claimed" AND NOT "b"."is_escrowed"), 0),
+        MAX("b"."claim_date") FILTER (WHERE "b"."is_claimed"),
+        CURRENT_TIMESTAMP
+    FROM "organizationmembership" "m"
+    LEFT JOIN "userbalance" "b" ON "b"."user_member_id" = "m"."id"
+    GROUP BY "m"."id";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "membershipbalancesnapshot";"""
@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "userbalance" ADD "compacted_into_id" INT;
+        ALTER TABLE "userbalance" ADD CONSTRAINT "fk_userbala_userbala_2b6e5f8a" FOREIGN KEY ("compacted_into_id") REFERENCES "userbalance" ("id") ON DELETE CASCADE;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "userbalance" DROP CONSTRAINT "fk_userbala_userbala_2b6e5f8a";
+        ALTER TABLE "userbalance" DROP COLUMN "compacted_into_id";"""
@@ -0,0 +1,11 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE UNIQUE INDEX "uid_taskfund_user_me_4c1f0e" ON "taskfund" ("user_member_id", "task_id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "uid_taskfund_user_me_4c1f0e";"""
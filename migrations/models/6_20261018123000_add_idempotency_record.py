@@ -0,0 +1,21 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "idempotencyrecord" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "key" VARCHAR(255) NOT NULL,
+    "owner" VARCHAR(64) NOT NULL,
+    "fingerprint" VARCHAR(64) NOT NULL,
+    "status_code" INT,
+    "response_body" TEXT,
+    "response_content_type" VARCHAR(128),
+    "creation_date" TIMESTAMPTZ NOT NULL,
+    CONSTRAINT "uid_idempotenc_key_6f2b1d" UNIQUE ("key", "owner")
+);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "idempotencyrecord";"""
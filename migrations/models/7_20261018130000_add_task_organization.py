@@ -0,0 +1,18 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "task" ADD "organization_id" INT;
+        UPDATE "task" SET "organization_id" = "organizationmembership"."organization_id" FROM "organizationmembership" WHERE "task"."owner_membership_id" = "organizationmembership"."id";
+        UPDATE "task" SET "organization_id" = "group"."organization_id" FROM "group" WHERE "task"."group_id" = "group"."id" AND "task"."organization_id" IS NULL;
+        ALTER TABLE "task" ALTER COLUMN "organization_id" SET NOT NULL;
+        ALTER TABLE "task" ADD CONSTRAINT "fk_task_organiza_5d2c7e1b" FOREIGN KEY ("organization_id") REFERENCES "organization" ("id") ON DELETE CASCADE;
+        CREATE UNIQUE INDEX "uid_task_organiz_8a3f61" ON "task" ("organization_id", "identifier");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "uid_task_organiz_8a3f61";
+        ALTER TABLE "task" DROP CONSTRAINT "fk_task_organiza_5d2c7e1b";
+        ALTER TABLE "task" DROP COLUMN "organization_id";"""
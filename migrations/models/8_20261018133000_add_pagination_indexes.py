@@ -0,0 +1,21 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX "idx_groupmember_user_id_2ef119" ON "groupmembership" ("user_id", "invite_date", "id");
+        CREATE INDEX "idx_organizatio_organiz_2f88bd" ON "organizationmembership" ("organization_id", "membership_date", "id");
+        CREATE INDEX "idx_organizatio_user_id_66fdc4" ON "organizationmembership" ("user_id", "membership_date", "id");
+        CREATE INDEX "idx_task_organiz_6d1949" ON "task" ("organization_id", "creation_date", "id");
+        CREATE INDEX "idx_task_group_i_6f0181" ON "task" ("group_id", "creation_date", "id");
+        CREATE INDEX "idx_taskaction_task_id_dc212d" ON "taskaction" ("task_id", "action_date", "id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_groupmember_user_id_2ef119";
+        DROP INDEX "idx_organizatio_organiz_2f88bd";
+        DROP INDEX "idx_organizatio_user_id_66fdc4";
+        DROP INDEX "idx_task_organiz_6d1949";
+        DROP INDEX "idx_task_group_i_6f0181";
+        DROP INDEX "idx_taskaction_task_id_dc212d";"""
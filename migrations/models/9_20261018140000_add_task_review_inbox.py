@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "task" ADD "is_review_pending" BOOL NOT NULL  DEFAULT False;
+        UPDATE "task" SET "is_review_pending" = TRUE FROM (SELECT DISTINCT ON ("task_id") "task_id", "is_submission" FROM "taskaction" WHERE "is_submission" OR "is_review" ORDER BY "task_id", "action_date" DESC, "id" DESC) AS "latest" WHERE "latest"."task_id" = "task"."id" AND "latest"."is_submission";
+        CREATE INDEX "idx_task_organiz_a69646" ON "task" ("organization_id", "is_approved_start", "is_rejected_start", "creation_date", "id");
+        CREATE INDEX "idx_task_organiz_8061b3" ON "task" ("organization_id", "is_review_pending", "creation_date", "id");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX "idx_task_organiz_a69646";
+        DROP INDEX "idx_task_organiz_8061b3";
+        ALTER TABLE "task" DROP COLUMN "is_review_pending";"""
@@ -0,0 +1,19 @@
+from tortoise import Tortoise, run_async
+from app.lib import environment, balance
+
+
+DATABASE = environment.get("DATABASE")
+
+
+async def rebuild():
+    await Tortoise.init(db_url=DATABASE, modules={"models": ["app.model"]})
+
+    drifts = await balance.rebuild_snapshots()
+    for membership_id, stored, ledger in drifts:
+        print(f"Membership {membership_id} drifted: stored {stored}, ledger {ledger}")
+
+    print(f"Rebuilt balance snapshots, {len(drifts)} had drifted")
+
+
+# run_async is a helper function to run simple async Tortoise scripts.
+run_async(rebuild())
@@ -4,6 +4,7 @@ from freezegun import freeze_time
 from tortoise.expressions import Q
 
 from app.main import app
+from app.lib import auth
 from app.model import Organization, OrganizationMembership, User, Group, GroupMembership
 
 import datetime
@@ -178,6 +179,107 @@ async def test_group_create():
     # TODO: Should be able to create group as organizer or supervisor
 
 
+async def test_group_create_member_validation():
+    test_identifier = "test_group_create_member_validation"
+
+    client = TestClient(app)
+
+    users = {
+        name: await User.create(
+            type=user_type,
+            email=f"{test_identifier}_{name}@email.com",
+            stake_address=f"stake_{test_identifier}_{name}",
+            active=True,
+        )
+        for name, user_type in [
+            ("leader", "student"),
+            ("math", "student"),
+            ("history", "student"),
+            ("teacher", "teacher"),
+            ("outsider", "student"),
+            ("grouped", "student"),
+        ]
+    }
+
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=["math", "history"],
+        admin=users["teacher"],
+    )
+    for name, area in [
+        ("leader", "math"),
+        ("math", "math"),
+        ("history", "history"),
+        ("teacher", None),
+        ("grouped", "math"),
+    ]:
+        await OrganizationMembership.create(
+            user=users[name], organization=organization, area=area
+        )
+
+    other_group = await Group.create(
+        identifier=f"{test_identifier}_group_0", name="", organization=organization
+    )
+    await GroupMembership.create(
+        group=other_group, user=users["grouped"], accepted=True, leader=True
+    )
+
+    token = auth.create_user_access_token(
+        users["leader"], datetime.timedelta(minutes=5)
+    )
+
+    # Every participant is checked, whatever its position in the list
+    for members, detail in [
+        (
+            [f"{test_identifier}_unknown@email.com"],
+            "Group participant account not found",
+        ),
+        ([users["teacher"].email], "Group participant is not student"),
+        (
+            [users["outsider"].email],
+            "Group participant is not a member of this organization",
+        ),
+        (
+            [users["history"].email],
+            "Group participant has different area than leader",
+        ),
+        (
+            [users["grouped"].email],
+            "Group participant is already member of a group",
+        ),
+    ]:
+        response = client.post(
+            f"/organization/{test_identifier}_org_1/group/create",
+            json={
+                "identifier": f"{test_identifier}_group_1",
+                "name": "",
+                "members": [users["math"].email] + members,
+            },
+            headers={"Authorization": "Bearer " + token},
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == detail
+
+    # Nothing is created when a participant is rejected
+    assert not await Group.exists(identifier=f"{test_identifier}_group_1")
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/group/create",
+        json={
+            "identifier": f"{test_identifier}_group_1",
+            "name": "",
+            "members": [users["math"].email],
+        },
+        headers={"Authorization": "Bearer " + token},
+    )
+    assert response.status_code == 200
+
+
 @freeze_time("2023-12-27 15:00:00")
 async def test_group_accept():
     test_identifier = "test_group_accept"
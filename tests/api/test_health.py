@@ -1,5 +1,6 @@
 from fastapi.testclient import TestClient
 
+from app import main
 from app.main import app
 
 
@@ -9,4 +10,19 @@ def test_health():
     response = client.get("/health")
     
     assert response.status_code == 200
-    assert response.json() == {}
\ No newline at end of file
+    assert response.json() == {}
+
+async def test_background_tasks(monkeypatch):
+    monkeypatch.setattr(main, "BALANCE_COMPACTION_INTERVAL", 3600)
+    monkeypatch.setattr(main, "IDEMPOTENCY_PURGE_INTERVAL", 3600)
+
+    await main.start_balance_compaction()
+    await main.start_idempotency_purge()
+
+    tasks = list(app.state.background_tasks)
+    assert len(tasks) == 2
+
+    # Should cancel the periodic jobs on shutdown
+    await main.stop_background_tasks()
+    assert all(task.cancelled() for task in tasks)
+    assert app.state.background_tasks == []
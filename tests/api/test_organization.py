@@ -2,6 +2,7 @@ from fastapi.testclient import TestClient
 from freezegun import freeze_time
 
 from app.main import app
+from app.lib import auth, balance, enrollment
 from app.model import (
     Organization,
     OrganizationMembership,
@@ -12,6 +13,7 @@ from app.model import (
 )
 
 import datetime
+import json
 
 
 @freeze_time("2023-12-27 15:00:00")
@@ -558,7 +560,9 @@ async def test_organization_tasks_read():
     )
 
     # Individual
-    response = client.get(f"/organization/{test_identifier}_org_1/tasks?individual=true")
+    response = client.get(
+        f"/organization/{test_identifier}_org_1/tasks?individual=true"
+    )
 
     assert response.status_code == 200
 
@@ -819,3 +823,340 @@ async def test_organization_groups_read():
             "name": "Test Organization Groups Read Group 2",
         }.items()
     )
+
+
+async def test_organization_enroll():
+    test_identifier = "test_organization_enroll"
+
+    client = TestClient(app)
+
+    organizer = await User.create(
+        type="organizer",
+        email=f"{test_identifier}_organizer@email.com",
+        stake_address=f"stake_{test_identifier}_organizer",
+        active=True,
+    )
+    token = auth.create_user_access_token(organizer, datetime.timedelta(minutes=5))
+
+    students = [
+        await User.create(
+            type="student",
+            email=f"{test_identifier}_student_{index}@email.com",
+            stake_address=f"stake_{test_identifier}_student_{index}",
+        )
+        for index in range(3)
+    ]
+    teacher = await User.create(
+        type="teacher",
+        email=f"{test_identifier}_teacher@email.com",
+        stake_address=f"stake_{test_identifier}_teacher",
+    )
+
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=["math"],
+        admin=organizer,
+        default_credits=10,
+    )
+    await OrganizationMembership.create(
+        user=students[2], organization=organization, area="math"
+    )
+
+    upload = "\n".join(
+        [
+            "email,type,area",
+            f"{students[0].email},student,Math",
+            f"{students[1].email},student,history",
+            f"{students[2].email},student,math",
+            f"{teacher.email},teacher,",
+            f"{test_identifier}_unknown@email.com,student,math",
+            f"{students[0].email},student,math",
+        ]
+    )
+
+    # Only the organization admin can enroll users
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/enroll",
+        content=upload,
+        headers={
+            "Authorization": "Bearer "
+            + auth.create_user_access_token(teacher, datetime.timedelta(minutes=5)),
+            "Content-Type": "text/csv",
+        },
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/enroll",
+        content=upload,
+        headers={"Authorization": "Bearer " + token, "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 400
+
+    # Uploads in other encodings are rejected before enrolling anyone
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/enroll",
+        content=f"email,type,area\n{students[0].email},student,matemática".encode(
+            "latin-1"
+        ),
+        headers={"Authorization": "Bearer " + token, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Line 2 of the upload is not encoded in UTF-8"
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/enroll",
+        content=upload,
+        headers={"Authorization": "Bearer " + token, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [(result["row"], result["status"]) for result in results] == [
+        (1, "enrolled"),
+        (2, "error"),
+        (3, "error"),
+        (4, "enrolled"),
+        (5, "error"),
+        (6, "error"),
+    ]
+    assert results[1]["detail"] == "Area selected does not exist in this organization"
+    assert results[2]["detail"] == "User is already part of this organization"
+    assert results[4]["detail"] == "User account not found"
+    assert results[5]["detail"] == "User is already part of this organization"
+
+    membership = await OrganizationMembership.get(
+        user=students[0], organization=organization
+    )
+    assert membership.area == "math"
+    assert await balance.get_user_owed_balance(membership) == 10
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/enroll",
+        content="\n".join(
+            [
+                json.dumps(
+                    {"email": students[1].email, "type": "student", "area": "math"}
+                ),
+                "not json",
+            ]
+        ),
+        headers={
+            "Authorization": "Bearer " + token,
+            "Content-Type": "application/x-ndjson",
+        },
+    )
+    assert response.status_code == 200
+    assert [json.loads(line)["status"] for line in response.text.splitlines()] == [
+        "enrolled",
+        "error",
+    ]
+
+    response = client.get(f"/organization/{test_identifier}_org_1/users")
+    assert response.json()["max_page"] == 1
+    assert len(response.json()["users"]) == 4
+
+    # Users joining between the checks and the insert are left out, and only
+    # the memberships inserted are credited
+    late_student = await User.create(
+        type="student",
+        email=f"{test_identifier}_student_late@email.com",
+        stake_address=f"stake_{test_identifier}_student_late",
+    )
+    conflicted_ids = await enrollment.insert_memberships(
+        organization,
+        [
+            OrganizationMembership(
+                user=late_student, organization=organization, area="math"
+            ),
+            OrganizationMembership(
+                user=students[0], organization=organization, area="math"
+            ),
+        ],
+    )
+    assert conflicted_ids == {students[0].id}
+
+    late_membership = await OrganizationMembership.get(
+        user=late_student, organization=organization
+    )
+    assert await balance.get_user_owed_balance(late_membership) == 10
+    assert await balance.get_user_owed_balance(membership) == 10
+    assert (
+        await OrganizationMembership.filter(
+            user=students[0], organization=organization
+        ).count()
+        == 1
+    )
+
+
+async def test_organization_tasks_inbox_read():
+    test_identifier = "test_organization_tasks_inbox_read"
+
+    client = TestClient(app)
+
+    teacher = await User.create(
+        type="teacher",
+        email=f"{test_identifier}_teacher@email.com",
+        stake_address=f"stake_{test_identifier}_teacher",
+        active=True,
+    )
+    student = await User.create(
+        type="student",
+        email=f"{test_identifier}_student@email.com",
+        stake_address=f"stake_{test_identifier}_student",
+        active=True,
+    )
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=teacher,
+    )
+    await OrganizationMembership.create(user=teacher, organization=organization)
+    student_membership = await OrganizationMembership.create(
+        user=student, organization=organization
+    )
+
+    for index, status in enumerate(["pending", "submitted", "active", "completed"]):
+        await Task.create(
+            identifier=f"{test_identifier}_task_{index}",
+            name="",
+            description="",
+            deadline=datetime.datetime(2024, 1, 1),
+            is_individual=True,
+            status=status,
+            owner_membership=student_membership,
+        )
+
+    teacher_token = auth.create_user_access_token(
+        teacher, datetime.timedelta(minutes=5)
+    )
+
+    def read_inbox(query: str = "", token: str = teacher_token):
+        return client.get(
+            f"/organization/{test_identifier}_org_1/tasks/inbox{query}",
+            headers={"Authorization": "Bearer " + token},
+        )
+
+    response = read_inbox(
+        token=auth.create_user_access_token(student, datetime.timedelta(minutes=5))
+    )
+    assert response.status_code == 400
+
+    # Newest tasks first
+    response = read_inbox()
+    assert response.status_code == 200
+    assert [task["identifier"] for task in response.json()["tasks"]] == [
+        f"{test_identifier}_task_1",
+        f"{test_identifier}_task_0",
+    ]
+    assert response.json()["tasks"][0]["status"] == "submitted"
+    assert response.json()["tasks"][1]["status"] == "pending"
+
+    response = read_inbox("?start=false")
+    assert [task["identifier"] for task in response.json()["tasks"]] == [
+        f"{test_identifier}_task_1"
+    ]
+
+    response = read_inbox("?start=false&submission=false")
+    assert response.status_code == 400
+
+
+async def test_organization_tasks_read_filters():
+    test_identifier = "test_organization_tasks_read_filters"
+
+    client = TestClient(app)
+
+    user = await User.create(
+        type="student",
+        email=f"{test_identifier}@email.com",
+        stake_address=f"stake_{test_identifier}",
+    )
+    other_user = await User.create(
+        type="student",
+        email=f"{test_identifier}_other@email.com",
+        stake_address=f"stake_{test_identifier}_other",
+    )
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=["math", "history"],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization, area="math"
+    )
+    other_membership = await OrganizationMembership.create(
+        user=other_user, organization=organization, area="history"
+    )
+    group = await Group.create(
+        identifier=f"{test_identifier}_group_1", name="", organization=organization
+    )
+
+    for index, (name, owner, status) in enumerate(
+        [
+            ("Essay", membership, "pending"),
+            ("Exam", membership, "active"),
+            ("Essay draft", other_membership, "completed"),
+            ("Project", None, "active"),
+        ]
+    ):
+        await Task.create(
+            identifier=f"{test_identifier}_task_{index}",
+            name=name,
+            description="",
+            deadline=datetime.datetime(2024, 1, 4 - index),
+            is_individual=owner is not None,
+            owner_membership=owner,
+            group=None if owner is not None else group,
+            status=status,
+        )
+
+    def read_tasks(query: str) -> list:
+        response = client.get(f"/organization/{test_identifier}_org_1/tasks?{query}")
+        assert response.status_code == 200
+
+        return [
+            task["identifier"][len(test_identifier) + 1 :]
+            for task in response.json()["tasks"]
+        ]
+
+    assert read_tasks("status=active") == ["task_3", "task_1"]
+    assert read_tasks("status=active&status=pending&individual=true") == [
+        "task_1",
+        "task_0",
+    ]
+    assert read_tasks("area=Math") == ["task_1", "task_0"]
+    assert read_tasks(f"group_identifier={test_identifier}_group_1") == ["task_3"]
+    assert read_tasks("prefix=Essay") == ["task_2", "task_0"]
+    assert read_tasks(f"prefix={test_identifier}_task_1") == ["task_1"]
+    assert read_tasks(
+        "deadline_after=2024-01-02T00:00:00&deadline_before=2024-01-04T00:00:00"
+    ) == ["task_2", "task_1"]
+    assert read_tasks("sort=deadline") == ["task_3", "task_2", "task_1", "task_0"]
+    assert read_tasks("sort=-deadline&count=2") == ["task_0", "task_1"]
+
+    # Totals follow the filters
+    response = client.get(
+        f"/organization/{test_identifier}_org_1/tasks?status=active&count=1"
+    )
+    assert response.json()["max_page"] == 2
+
+    response = client.get(f"/organization/{test_identifier}_org_1/tasks?status=done")
+    assert response.status_code == 422
+
+    response = client.get(f"/organization/{test_identifier}_org_1/tasks?sort=name")
+    assert response.status_code == 422
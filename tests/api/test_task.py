@@ -4,6 +4,7 @@ from freezegun import freeze_time
 from tortoise.expressions import Q
 
 from app.main import app
+from app.lib import auth, upload
 from app.model import (
     Organization,
     OrganizationMembership,
@@ -12,11 +13,14 @@ from app.model import (
     Group,
     GroupMembership,
     Task,
+    TaskAction,
     TaskFund,
     TaskReward,
+    TaskStatus,
 )
 
 import datetime
+import json
 
 
 @freeze_time("2023-12-27 15:00:00")
@@ -285,7 +289,7 @@ async def test_task_start_approve():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_approved_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     # Teacher
@@ -295,7 +299,7 @@ async def test_task_start_approve():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_approved_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     # Supervisor
@@ -305,7 +309,7 @@ async def test_task_start_approve():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_approved_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     # Student - not allowed
@@ -443,7 +447,7 @@ async def test_task_start_reject():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_rejected_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     # Teacher
@@ -453,7 +457,7 @@ async def test_task_start_reject():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_rejected_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     # Supervisor
@@ -463,7 +467,7 @@ async def test_task_start_reject():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_rejected_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     # Student - not allowed
@@ -541,7 +545,7 @@ async def test_task_submission_create():
     )
     assert response.status_code == 400
 
-    created_task.update_from_dict({"is_approved_start": True})
+    created_task.update_from_dict({"status": TaskStatus.ACTIVE.value})
     await created_task.save()
 
     response = client.post(
@@ -687,7 +691,7 @@ async def test_task_submission_approve():
 
     assert task.is_approved_completed == True
 
-    created_task.update_from_dict({"is_approved_completed": False})
+    created_task.update_from_dict({"status": TaskStatus.ACTIVE.value})
     await created_task.save()
 
     # Student - not allowed
@@ -862,7 +866,7 @@ async def test_task_submission_reject():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_rejected_completed": False})
+    created_task.update_from_dict({"status": TaskStatus.ACTIVE.value})
     await created_task.save()
 
     # Teacher
@@ -873,7 +877,7 @@ async def test_task_submission_reject():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_rejected_completed": False})
+    created_task.update_from_dict({"status": TaskStatus.ACTIVE.value})
     await created_task.save()
 
     # Supervisor
@@ -884,7 +888,7 @@ async def test_task_submission_reject():
     )
     assert response.status_code == 200
 
-    created_task.update_from_dict({"is_rejected_completed": False})
+    created_task.update_from_dict({"status": TaskStatus.ACTIVE.value})
     await created_task.save()
 
     # Student - not allowed
@@ -1154,7 +1158,7 @@ async def test_task_fund():
     await created_task.save()
 
     # Should not be able to fund task which has not started yet
-    created_task.update_from_dict({"is_approved_start": False})
+    created_task.update_from_dict({"status": TaskStatus.PENDING.value})
     await created_task.save()
 
     response = client.post(
@@ -1165,9 +1169,7 @@ async def test_task_fund():
     assert response.status_code == 400
 
     # Should not be able to fund task which has already completed
-    created_task.update_from_dict(
-        {"is_approved_start": True, "is_approved_completed": True}
-    )
+    created_task.update_from_dict({"status": TaskStatus.COMPLETED.value})
     await created_task.save()
 
     response = client.post(
@@ -1178,7 +1180,7 @@ async def test_task_fund():
     assert response.status_code == 400
 
     # Should not be able to fund task if users are from the same area
-    created_task.update_from_dict({"is_approved_completed": False})
+    created_task.update_from_dict({"status": TaskStatus.ACTIVE.value})
     await created_task.save()
 
     created_membership.update_from_dict({"area": "Math"})
@@ -1242,3 +1244,273 @@ async def test_task_fund():
         headers={"Authorization": "Bearer " + token},
     )
     assert response.status_code == 400
+
+
+async def test_task_create_bulk(monkeypatch):
+    test_identifier = "test_task_create_bulk"
+
+    client = TestClient(app)
+
+    teacher = await User.create(
+        type="teacher",
+        email=f"{test_identifier}_teacher@email.com",
+        stake_address=f"stake_{test_identifier}_teacher",
+        active=True,
+    )
+    student = await User.create(
+        type="student",
+        email=f"{test_identifier}_student@email.com",
+        stake_address=f"stake_{test_identifier}_student",
+        active=True,
+    )
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=teacher,
+    )
+    await OrganizationMembership.create(user=teacher, organization=organization)
+    student_membership = await OrganizationMembership.create(
+        user=student, organization=organization
+    )
+    await Task.create(
+        identifier=f"{test_identifier}_task_0",
+        name="",
+        description="",
+        deadline=datetime.datetime(2024, 1, 1),
+        is_individual=True,
+        owner_membership=student_membership,
+    )
+
+    teacher_token = auth.create_user_access_token(
+        teacher, datetime.timedelta(minutes=5)
+    )
+    student_token = auth.create_user_access_token(
+        student, datetime.timedelta(minutes=5)
+    )
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/task/create/bulk",
+        content="\n".join(
+            [
+                "identifier,name,description,deadline,owner,approved",
+                f"{test_identifier}_task_1,Task 1,,2024-01-01T00:00:00,{student.email},true",
+                f"{test_identifier}_task_2,Task 2,,2024-01-01T00:00:00,{student.email},",
+                f"{test_identifier}_task_0,Task 0,,2024-01-01T00:00:00,{student.email},",
+                f"{test_identifier}_task_1,Task 1,,2024-01-01T00:00:00,{student.email},",
+                f"{test_identifier}_task_3,Task 3,,not a date,{student.email},",
+                f"{test_identifier}_task_4,Task 4,,2024-01-01T00:00:00,unknown@email.com,",
+            ]
+        ),
+        headers={
+            "Authorization": "Bearer " + teacher_token,
+            "Content-Type": "text/csv",
+        },
+    )
+    assert response.status_code == 200
+    assert [(result["row"], result["status"]) for result in response.json()] == [
+        (1, "created"),
+        (2, "created"),
+        (3, "error"),
+        (4, "error"),
+        (5, "error"),
+        (6, "error"),
+    ]
+    assert response.json()[2]["detail"] == "Task identifier taken"
+    assert response.json()[3]["detail"] == "Task identifier taken"
+    assert response.json()[5]["detail"] == "Owner is not a member of this organization"
+
+    task = await Task.get(identifier=f"{test_identifier}_task_1")
+    assert task.owner_membership_id == student_membership.id
+    assert task.organization_id == organization.id
+    assert task.is_approved_start
+    assert await TaskAction.filter(task=task, author=teacher).count() == 1
+    assert not (
+        await Task.get(identifier=f"{test_identifier}_task_2")
+    ).is_approved_start
+
+    # Students can only create their own tasks
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/task/create/bulk",
+        content=json.dumps(
+            [
+                {
+                    "identifier": f"{test_identifier}_task_5",
+                    "name": "Task 5",
+                    "description": "",
+                    "deadline": "2024-01-01T00:00:00",
+                },
+                {
+                    "identifier": f"{test_identifier}_task_6",
+                    "name": "Task 6",
+                    "description": "",
+                    "deadline": "2024-01-01T00:00:00",
+                    "approved": True,
+                },
+            ]
+        ),
+        headers={
+            "Authorization": "Bearer " + student_token,
+            "Content-Type": "application/json",
+        },
+    )
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()] == ["created", "error"]
+
+    response = client.get(f"/organization/{test_identifier}_org_1/tasks")
+    assert len(response.json()["tasks"]) == 4
+
+    # Truncated uploads are rejected while nothing was stored yet, and after
+    # that end with an error for the first row left out
+    monkeypatch.setattr(upload, "UPLOAD_CHUNK_SIZE", 2)
+    content = json.dumps(
+        [
+            {
+                "identifier": f"{test_identifier}_task_{index}",
+                "name": f"Task {index}",
+                "description": "",
+                "deadline": "2024-01-01T00:00:00",
+            }
+            for index in range(7, 12)
+        ]
+    )
+    headers = {
+        "Authorization": "Bearer " + teacher_token,
+        "Content-Type": "application/json",
+    }
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/task/create/bulk",
+        content=content[:100],
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/task/create/bulk",
+        content=content[:-20],
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert [(result["row"], result["status"]) for result in response.json()] == [
+        (1, "created"),
+        (2, "created"),
+        (3, "created"),
+        (4, "created"),
+        (5, "error"),
+    ]
+    assert response.json()[4]["detail"] == "Upload must be a JSON array"
+    assert (
+        await Task.filter(identifier__startswith=f"{test_identifier}_task_").count()
+        == 8
+    )
+
+
+async def test_task_start_review_bulk():
+    test_identifier = "test_task_start_review_bulk"
+
+    client = TestClient(app)
+
+    teacher = await User.create(
+        type="teacher",
+        email=f"{test_identifier}_teacher@email.com",
+        stake_address=f"stake_{test_identifier}_teacher",
+        active=True,
+    )
+    student = await User.create(
+        type="student",
+        email=f"{test_identifier}_student@email.com",
+        stake_address=f"stake_{test_identifier}_student",
+        active=True,
+    )
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=teacher,
+    )
+    await OrganizationMembership.create(user=teacher, organization=organization)
+    student_membership = await OrganizationMembership.create(
+        user=student, organization=organization
+    )
+
+    for index in range(4):
+        await Task.create(
+            identifier=f"{test_identifier}_task_{index}",
+            name="",
+            description="",
+            deadline=datetime.datetime(2024, 1, 1),
+            is_individual=True,
+            is_approved_start=index == 3,
+            owner_membership=student_membership,
+        )
+
+    body = {
+        "reviews": [
+            {"identifier": f"{test_identifier}_task_0", "approve": True},
+            {"identifier": f"{test_identifier}_task_1", "approve": False},
+            {"identifier": f"{test_identifier}_task_2", "approve": True},
+            {"identifier": f"{test_identifier}_task_2", "approve": False},
+            {"identifier": f"{test_identifier}_task_3", "approve": True},
+            {"identifier": f"{test_identifier}_task_4", "approve": True},
+        ]
+    }
+
+    # Students cannot review
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/task/start/review",
+        json=body,
+        headers={
+            "Authorization": "Bearer "
+            + auth.create_user_access_token(student, datetime.timedelta(minutes=5))
+        },
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        f"/organization/{test_identifier}_org_1/task/start/review",
+        json=body,
+        headers={
+            "Authorization": "Bearer "
+            + auth.create_user_access_token(teacher, datetime.timedelta(minutes=5))
+        },
+    )
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == [
+        "approved",
+        "rejected",
+        "approved",
+        "error",
+        "error",
+        "error",
+    ]
+    assert [result.get("detail") for result in response.json()["results"][3:]] == [
+        "Task is reviewed more than once",
+        "Task has already started",
+        "Task not found",
+    ]
+
+    tasks = {
+        task.identifier: task
+        for task in await Task.filter(organization=organization).prefetch_related(
+            "actions"
+        )
+    }
+
+    task = tasks[f"{test_identifier}_task_0"]
+    assert task.is_approved_start and not task.is_rejected_start
+    assert [action.name for action in task.actions] == ["Approve task start"]
+
+    task = tasks[f"{test_identifier}_task_1"]
+    assert task.is_rejected_start and not task.is_approved_start
+    assert [action.name for action in task.actions] == ["Reject task start"]
+
+    assert len(tasks[f"{test_identifier}_task_3"].actions) == 0
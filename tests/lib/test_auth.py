@@ -1,11 +1,13 @@
 from fastapi.testclient import TestClient
 
-from app.lib import auth
+from app.lib import auth, cardano
 from app.model import User
 from freezegun import freeze_time
 
 import pycardano as pyc
+import asyncio
 import datetime
+import time
 import pytest
 
 
@@ -29,6 +31,95 @@ async def test_authenticate_user():
     assert user_created == user_authenticated
 
 
+@pytest.mark.asyncio
+@freeze_time("2023-12-27 14:43:00")
+async def test_authenticate_user_signature_cache(monkeypatch):
+    stake_address = "stake1uymfqdggvdrauqfh36jm4us9ac5pm7n9hj68gj8mf2pfjlscj8s0c"
+    signature = "a4010103272006215820a7823182f1b024de887bf1063f5a1dbfaa8df39aa6699c3904121c2db7124f67H1+DFJCghAmokzYG84582aa201276761646472657373581de1369035086347de01378ea5baf205ee281dfa65bcb47448fb4a82997ea166686173686564f458403d3d3d3d3d3d4f4e4c59205349474e20494620594f552041524520494e206170702e617468656e616c61626f2e636f6d3d3d3d3d3d3d31373033363837383832584026b7c67ee6691cd84550993d76880bd8aeaaef941c925ec0691561ee762c53caf4e8c28d7056a4946604187e10884e041dee5f0023f6bd1f7c480ac8c82be50f"
+
+    monkeypatch.setattr(cardano, "signature_cache", cardano.SignatureCache(2))
+
+    assert cardano.verify_signature(signature, stake_address) is True
+    assert cardano.verify_signature(signature, stake_address) is True
+    assert cardano.signature_cache.misses == 1
+    assert cardano.signature_cache.hits == 1
+
+    # Invalid signatures are cached as well
+    assert cardano.verify_signature(signature[:-2], stake_address) is False
+    assert cardano.verify_signature(signature[:-2], stake_address) is False
+    assert cardano.signature_cache.hits == 2
+
+    # Should stop accepting the signature once it expires
+    with freeze_time("2023-12-27 16:43:00"):
+        assert cardano.verify_signature(signature, stake_address) is False
+
+    # Should only allow logging in once when replay protection is enabled
+    monkeypatch.setattr(cardano, "SIGNATURE_REPLAY_PROTECTION", 1)
+    user = await User.filter(stake_address=stake_address).first()
+    if user is None:
+        user = await User.create(
+            type="student", email="replay@email.com", stake_address=stake_address
+        )
+
+    assert await auth.authenticate_user(stake_address, signature) == user
+    assert await auth.authenticate_user(stake_address, signature) is None
+
+    # Evicting the verification result must not allow replaying it
+    for index in range(3):
+        cardano.signature_cache.set(f"other_{index}", None)
+
+    assert cardano.signature_cache.get(
+        cardano.signature_cache.key(signature, stake_address)
+    ) == (False, None)
+    assert await auth.authenticate_user(stake_address, signature) is None
+
+
+@pytest.mark.asyncio
+async def test_signature_verifier_backpressure(monkeypatch):
+    def slow_read_signature(signature: str, expected_address: str):
+        time.sleep(0.2)
+        return None
+
+    monkeypatch.setattr(cardano, "read_signature", slow_read_signature)
+
+    verifier = cardano.SignatureVerifier("thread", workers=1, queue_size=1)
+
+    # One verification runs, one waits and the rest are rejected
+    results = await asyncio.gather(
+        *[verifier.read_signature("signature", "address") for _ in range(4)],
+        return_exceptions=True,
+    )
+    verifier.shutdown()
+
+    assert results.count(None) == 2
+    assert all(isinstance(result, cardano.VerifierBusyError) for result in results[2:])
+    assert verifier.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_get_token_user():
+    user = await User.create(
+        type="student", email="token_user@email.com", stake_address="stake_token"
+    )
+
+    assert await auth.get_token_user(user.id, "stake_token") == user
+    assert await auth.get_token_user(None, "stake_token") == user
+    assert await auth.get_token_user(user.id, "stake_other") is None
+
+    # Should use the cached user until it is invalidated
+    await User.filter(id=user.id).update(active=False)
+
+    cached_user = await auth.get_token_user(user.id, "stake_token")
+    assert cached_user.active is True
+
+    # Changing the returned user must not change the cached one
+    cached_user.active = False
+    assert (await auth.get_token_user(user.id, "stake_token")).active is True
+
+    auth.invalidate_user(user)
+    assert (await auth.get_token_user(user.id, "stake_token")).active is False
+
+
 @pytest.mark.asyncio
 async def test_has_review_privileges():
     student = await User.create(
@@ -0,0 +1,413 @@
+from app.lib import balance
+from app.model import (
+    User,
+    Organization,
+    OrganizationMembership,
+    MembershipBalanceSnapshot,
+    UserBalance,
+    Group,
+    GroupMembership,
+    Task,
+    TaskFund,
+    TaskReward,
+)
+
+from tortoise import connections
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.utils import generate_schema_for_client
+
+import asyncio
+import contextlib
+import datetime
+import importlib
+import os
+import pytest
+import uuid
+
+
+# Concurrency tests only prove something on a database with row locks
+TEST_POSTGRES_DATABASE = os.environ.get("TEST_POSTGRES_DATABASE")
+
+
+async def create_membership(test_identifier: str) -> OrganizationMembership:
+    user = await User.create(
+        type="student",
+        email=f"{test_identifier}@email.com",
+        stake_address=f"stake_{test_identifier}",
+    )
+
+    organization = await Organization.create(
+        identifier=f"{test_identifier}_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=user,
+    )
+
+    return await OrganizationMembership.create(user=user, organization=organization)
+
+
+async def create_task_fund(
+    funder: OrganizationMembership, owner: OrganizationMembership, amount: int
+) -> TaskFund:
+    task = await Task.create(
+        identifier=f"task_{owner.id}",
+        name="",
+        description="",
+        deadline=datetime.datetime(2024, 1, 1),
+        is_individual=True,
+        is_approved_start=True,
+        owner_membership=owner,
+    )
+
+    return await TaskFund.create(amount=amount, user_member=funder, task=task)
+
+
+@pytest.mark.asyncio
+async def test_get_user_balance_summary():
+    membership = await create_membership("test_get_user_balance_summary")
+
+    # Should be empty when there is no ledger
+    summary = await balance.get_user_balance_summary(membership)
+    assert summary == balance.BalanceSummary()
+    assert summary.available == 0
+
+    await UserBalance.create(amount=3_000_000, user_member=membership)
+    await UserBalance.create(amount=2_000_000, user_member=membership)
+    await UserBalance.create(amount=5_000_000, is_escrowed=True, user_member=membership)
+    await UserBalance.create(
+        amount=7_000_000,
+        is_claimed=True,
+        claim_date=datetime.datetime(2024, 1, 5),
+        user_member=membership,
+    )
+    await UserBalance.create(
+        amount=1_000_000,
+        is_claimed=True,
+        claim_date=datetime.datetime(2024, 1, 3),
+        user_member=membership,
+    )
+
+    summary = await balance.get_user_balance_summary(membership)
+
+    assert summary.owed == 10_000_000
+    assert summary.available == 5_000_000
+    assert summary.escrowed == 5_000_000
+    assert summary.claimed == 8_000_000
+    assert summary.last_claim_date.timestamp() == (
+        datetime.datetime(2024, 1, 5, tzinfo=datetime.timezone.utc).timestamp()
+    )
+
+    assert await balance.get_user_owed_balance(membership) == 10_000_000
+    assert await balance.get_user_available_balance(membership) == 5_000_000
+    assert await balance.get_user_escrowed_balance(membership) == 5_000_000
+    assert await balance.get_user_claimed_balance(membership) == 8_000_000
+
+
+@pytest.mark.asyncio
+async def test_balance_snapshot():
+    membership = await create_membership("test_balance_snapshot")
+    other_membership = await create_membership("test_balance_snapshot_other")
+
+    await balance.create_balance(amount=3_000_000, user_member=membership)
+    await balance.create_balance(amount=2_000_000, user_member=membership)
+
+    task_fund = await create_task_fund(membership, other_membership, 4_000_000)
+    await task_fund.fetch_related("user_member")
+    await balance.fund_escrow(task_fund)
+
+    snapshot = await MembershipBalanceSnapshot.filter(user_member=membership).first()
+    assert snapshot.owed == 5_000_000
+    assert snapshot.escrowed == 4_000_000
+    assert snapshot.claimed == 5_000_000
+
+    await balance.fund_release(task_fund)
+
+    ledger = await balance.summarize_balances([membership.id, other_membership.id])
+    for membership_id, summary in ledger.items():
+        snapshot = await MembershipBalanceSnapshot.filter(
+            user_member_id=membership_id
+        ).first()
+        assert balance.snapshot_summary(snapshot) == summary
+
+    assert ledger[membership.id].owed == 1_000_000
+    assert ledger[other_membership.id].owed == 4_000_000
+
+    # Writing straight to the ledger makes the snapshot drift
+    await UserBalance.create(amount=1_000_000, user_member=membership)
+
+    drifts = await balance.rebuild_snapshots()
+    drifted = {membership_id: ledger for membership_id, _, ledger in drifts}
+    assert drifted[membership.id].owed == 2_000_000
+
+    summary = await balance.get_user_balance_summary(membership)
+    assert summary.owed == 2_000_000
+
+    drifts = await balance.rebuild_snapshots()
+    assert len(drifts) == 0
+
+
+@pytest.mark.asyncio
+async def test_compact_balances():
+    membership = await create_membership("test_compact_balances")
+
+    for amount in [1_000_000, 2_000_000, 3_000_000]:
+        await balance.create_balance(amount=amount, user_member=membership)
+
+    await balance.create_balance(
+        amount=4_000_000, is_escrowed=True, user_member=membership
+    )
+
+    before = await balance.summarize_balances([membership.id])
+
+    # Should not compact when there are less fragments than required
+    assert await balance.compact_balances(membership.id, min_fragments=4) is None
+
+    assert await balance.compact_all_balances(min_fragments=3) >= 1
+
+    compacted = await UserBalance.filter(
+        user_member=membership, is_claimed=False, is_escrowed=False
+    ).all()
+    assert len(compacted) == 1
+    assert compacted[0].amount == 6_000_000
+
+    fragments = await UserBalance.filter(compacted_into=compacted[0]).all()
+    assert sorted(fragment.amount for fragment in fragments) == [
+        1_000_000,
+        2_000_000,
+        3_000_000,
+    ]
+
+    # Totals must not change
+    after = await balance.summarize_balances([membership.id])
+    assert after == before
+
+    drifts = await balance.rebuild_snapshots()
+    assert membership.id not in [membership_id for membership_id, _, _ in drifts]
+
+    # Fragments read before the compaction can not be spent anymore
+    with pytest.raises(ValueError):
+        await balance.claim_balances(fragments)
+
+    assert await balance.summarize_balances([membership.id]) == before
+
+
+@pytest.mark.asyncio
+async def test_collect_amount():
+    membership = await create_membership("test_collect_amount")
+
+    for amount in [5_000_000, 1_000_000, 3_000_000, 2_000_000]:
+        await UserBalance.create(amount=amount, user_member=membership)
+
+    await UserBalance.create(amount=1, is_escrowed=True, user_member=membership)
+    await UserBalance.create(amount=1, is_claimed=True, user_member=membership)
+
+    collected, change = await balance.collect_amount(membership, 5_000_000)
+    assert [fragment.amount for fragment in collected] == [
+        1_000_000,
+        2_000_000,
+        3_000_000,
+    ]
+    assert change == 1_000_000
+
+    collected, change = await balance.collect_amount(membership, 3_000_000)
+    assert [fragment.amount for fragment in collected] == [1_000_000, 2_000_000]
+    assert change == 0
+
+    # Should return every balance when there is not enough
+    collected, change = await balance.collect_amount(membership, 12_000_000)
+    assert len(collected) == 4
+    assert change == -1_000_000
+
+
+@pytest.mark.asyncio
+async def test_settle_task_funds():
+    owner = await create_membership("test_settle_task_funds")
+    funders = [
+        await create_membership(f"test_settle_task_funds_{index}") for index in range(3)
+    ]
+
+    for funder in funders:
+        await balance.create_balance(amount=2_000_000, user_member=funder)
+
+    task_fund = await create_task_fund(funders[0], owner, 1_000_000)
+    task = await task_fund.task
+    task_funds = [task_fund] + [
+        await TaskFund.create(amount=1_000_000, user_member=funder, task=task)
+        for funder in funders[1:]
+    ]
+
+    for task_fund in task_funds:
+        await task_fund.fetch_related("user_member")
+        await balance.fund_escrow(task_fund)
+
+    # Giving funds back keeps them with their funders
+    await balance.settle_task_funds(task, release=False)
+
+    for funder in funders:
+        summary = await balance.get_user_balance_summary(funder)
+        assert summary.available == 2_000_000
+        assert summary.escrowed == 0
+
+    assert await TaskFund.filter(task=task, is_completed=False).count() == 0
+    assert await UserBalance.filter(escrow_task_fund__task=task).count() == 0
+
+    # Releasing moves them to the task owner
+    for task_fund in task_funds:
+        await balance.fund_escrow(task_fund)
+
+    await balance.settle_task_funds(task, release=True)
+
+    summary = await balance.get_user_balance_summary(owner)
+    assert summary.owed == 3_000_000
+
+    ledger = await balance.summarize_balances(
+        [owner.id] + [funder.id for funder in funders]
+    )
+    for membership_id, summary in ledger.items():
+        snapshot = await MembershipBalanceSnapshot.filter(
+            user_member_id=membership_id
+        ).first()
+        assert balance.snapshot_summary(snapshot) == summary
+
+
+@pytest.mark.asyncio
+async def test_pay_task_rewards():
+    leader = await create_membership("test_pay_task_rewards")
+    await leader.fetch_related("user")
+    await leader.fetch_related("organization")
+
+    group = await Group.create(
+        identifier="test_pay_task_rewards_group",
+        name="",
+        organization=leader.organization,
+    )
+    task = await Task.create(
+        identifier="test_pay_task_rewards_task",
+        name="",
+        description="",
+        deadline=datetime.datetime(2024, 1, 1),
+        group=group,
+    )
+
+    memberships = [leader]
+    for index in range(3):
+        other = await create_membership(f"test_pay_task_rewards_{index}")
+        await other.fetch_related("user")
+
+        # Users are also members of other organizations
+        memberships.append(
+            await OrganizationMembership.create(
+                user=other.user, organization=leader.organization
+            )
+        )
+
+    for index, membership in enumerate(memberships):
+        group_membership = await GroupMembership.create(
+            group=group, user_id=membership.user_id, accepted=True
+        )
+        await TaskReward.create(
+            reward=(index + 1) * 1_000_000, group_member=group_membership, task=task
+        )
+
+    await balance.pay_task_rewards(task, leader.organization.id)
+
+    for index, membership in enumerate(memberships):
+        summary = await balance.get_user_balance_summary(membership)
+        assert summary.owed == (index + 1) * 1_000_000
+
+    assert await TaskReward.filter(task=task, is_completed=False).count() == 0
+
+    # Paying again should not pay anything
+    await balance.pay_task_rewards(task, leader.organization.id)
+
+    summary = await balance.get_user_balance_summary(leader)
+    assert summary.owed == 1_000_000
+
+
+@pytest.fixture
+def connection_lock():
+    # TestClient serves each request on its own event loop, so give the
+    # connection a lock bound to the loop running this test
+    connections.get("default")._lock = asyncio.Lock()
+
+
+@contextlib.asynccontextmanager
+async def postgres_connection():
+    # Replaces the default connection while inside, so every query of the
+    # models goes to PostgreSQL, each transaction on its own pool connection
+    db_info = expand_db_url(TEST_POSTGRES_DATABASE)
+    client_class = importlib.import_module(db_info["engine"]).client_class
+    connection = client_class(connection_name="default", **db_info["credentials"])
+
+    token = connections.set("default", connection)
+    try:
+        await generate_schema_for_client(connection, safe=True)
+        yield connection
+    finally:
+        connections.reset(token)
+        await connection.close()
+
+
+async def fund_concurrently(test_identifier: str):
+    funder = await create_membership(test_identifier)
+    owner = await create_membership(f"{test_identifier}_owner")
+
+    for _ in range(5):
+        await balance.create_balance(amount=1_000_000, user_member=funder)
+
+    tasks = [
+        await Task.create(
+            identifier=f"{test_identifier}_task_{index}",
+            name="",
+            description="",
+            deadline=datetime.datetime(2024, 1, 1),
+            is_individual=True,
+            is_approved_start=True,
+            owner_membership=owner,
+        )
+        for index in range(10)
+    ]
+
+    results = await asyncio.gather(
+        *[balance.fund_task(funder, task, 1_000_000) for task in tasks],
+        return_exceptions=True,
+    )
+
+    funded = [result for result in results if isinstance(result, TaskFund)]
+    rejected = [
+        result
+        for result in results
+        if isinstance(result, balance.InsufficientBalanceError)
+    ]
+    assert len(funded) == 5
+    assert len(rejected) == 5
+
+    # Nothing was spent twice
+    ledger = (await balance.summarize_balances([funder.id]))[funder.id]
+    assert ledger.available == 0
+    assert ledger.escrowed == 5_000_000
+    assert await TaskFund.filter(user_member=funder).count() == 5
+
+    summary = await balance.get_user_balance_summary(funder)
+    assert summary == ledger
+
+
+@pytest.mark.asyncio
+async def test_fund_task_concurrently(connection_lock):
+    await fund_concurrently("test_fund_task_concurrently")
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(
+    TEST_POSTGRES_DATABASE is None, reason="TEST_POSTGRES_DATABASE is not set"
+)
+async def test_fund_task_concurrently_postgres():
+    pytest.importorskip("asyncpg")
+
+    async with postgres_connection():
+        # The database is kept between runs
+        await fund_concurrently(f"test_fund_task_postgres_{uuid.uuid4().hex[:8]}")
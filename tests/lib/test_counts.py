@@ -0,0 +1,67 @@
+from app.lib import counts, pagination
+from app.model import User, Organization, OrganizationMembership, Task
+
+import datetime
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_get_count():
+    user = await User.create(
+        type="student",
+        email="test_get_count@email.com",
+        stake_address="stake_test_get_count",
+    )
+    organization = await Organization.create(
+        identifier="test_get_count_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization
+    )
+
+    async def create_task(identifier: str) -> Task:
+        return await Task.create(
+            identifier=identifier,
+            name="",
+            description="",
+            deadline=datetime.datetime(2024, 1, 1),
+            is_individual=True,
+            owner_membership=membership,
+        )
+
+    await create_task("test_get_count_task_1")
+
+    tasks = Task.filter(organization=organization)
+    assert await counts.get_count(tasks, "organization_tasks", organization.id) == 1
+
+    # Should use cached count while nothing changes
+    await Task.filter(organization=organization).update(name="Updated")
+    await Task.filter(identifier="test_get_count_task_1").delete()
+    assert await counts.get_count(tasks, "organization_tasks", organization.id) == 1
+
+    # Saving a task invalidates the counts of its organization
+    await create_task("test_get_count_task_2")
+    await create_task("test_get_count_task_3")
+    assert await counts.get_count(tasks, "organization_tasks", organization.id) == 2
+
+    group_tasks = tasks.filter(is_individual=False)
+    assert (
+        await counts.get_count(
+            group_tasks, "organization_tasks", organization.id, "group"
+        )
+        == 0
+    )
+
+
+def test_page_count():
+    assert pagination.page_count(0, 10) == 1
+    assert pagination.page_count(10, 10) == 1
+    assert pagination.page_count(11, 10) == 2
+    assert pagination.page_count(21, 10) == 3
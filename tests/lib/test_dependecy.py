@@ -0,0 +1,125 @@
+from fastapi import HTTPException
+from tortoise.exceptions import IntegrityError
+
+from app import dependecy
+from app.model import User, Organization, OrganizationMembership, Group, Task
+
+import datetime
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_membership():
+    user = await User.create(
+        type="student",
+        email="test_get_current_user_membership@email.com",
+        stake_address="stake_test_get_current_user_membership",
+    )
+    other_user = await User.create(
+        type="student",
+        email="test_get_current_user_membership_other@email.com",
+        stake_address="stake_test_get_current_user_membership_other",
+    )
+
+    organization = await Organization.create(
+        identifier="test_get_current_user_membership_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization
+    )
+
+    current_membership = await dependecy.get_current_user_membership(
+        user, organization.identifier
+    )
+    assert current_membership == membership
+
+    # User and organization should be loaded with the membership
+    assert current_membership.user.email == user.email
+    assert current_membership.organization.identifier == organization.identifier
+
+    with pytest.raises(HTTPException) as error:
+        await dependecy.get_current_user_membership(other_user, organization.identifier)
+    assert error.value.detail == "User is not member of this organization"
+
+    with pytest.raises(HTTPException) as error:
+        await dependecy.get_current_user_membership(user, "unknown_org")
+    assert error.value.detail == "Organization does not exist"
+
+
+@pytest.mark.asyncio
+async def test_get_task():
+    user = await User.create(
+        type="student",
+        email="test_get_task@email.com",
+        stake_address="stake_test_get_task",
+    )
+    organization = await Organization.create(
+        identifier="test_get_task_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization
+    )
+    group = await Group.create(
+        identifier="test_get_task_group", name="", organization=organization
+    )
+
+    # Organization is taken from the owner or group when not given
+    individual_task = await Task.create(
+        identifier="test_get_task_individual",
+        name="",
+        description="",
+        deadline=datetime.datetime(2024, 1, 1),
+        is_individual=True,
+        owner_membership=membership,
+    )
+    group_task = await Task.create(
+        identifier="test_get_task_group",
+        name="",
+        description="",
+        deadline=datetime.datetime(2024, 1, 1),
+        group=group,
+    )
+    assert individual_task.organization_id == organization.id
+    assert group_task.organization_id == organization.id
+
+    task = await dependecy.get_task(organization.identifier, individual_task.identifier)
+    assert task == individual_task
+    assert task.owner_membership == membership
+    assert task.group is None
+
+    task = await dependecy.get_group_task(
+        organization.identifier, group_task.identifier
+    )
+    assert task.group.identifier == group.identifier
+
+    with pytest.raises(HTTPException):
+        await dependecy.get_individual_task(
+            organization.identifier, group_task.identifier
+        )
+
+    with pytest.raises(HTTPException):
+        await dependecy.get_task("unknown_org", individual_task.identifier)
+
+    # Identifiers are unique in the organization
+    with pytest.raises(IntegrityError):
+        await Task.create(
+            identifier="test_get_task_individual",
+            name="",
+            description="",
+            deadline=datetime.datetime(2024, 1, 1),
+            group=group,
+        )
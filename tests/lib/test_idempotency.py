@@ -0,0 +1,259 @@
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.lib import idempotency
+from app.lib.idempotency import IdempotencyMiddleware
+from app.model import IdempotencyRecord
+
+import datetime
+import pytest
+import re
+
+
+calls = {"count": 0}
+
+test_app = FastAPI()
+test_app.add_middleware(
+    IdempotencyMiddleware,
+    paths=(r"/count", r"/reject", r"/crash", r"/fail", r"/stream"),
+)
+
+
+@test_app.post("/count")
+async def count(body: dict):
+    calls["count"] += 1
+
+    return {"count": calls["count"], "body": body}
+
+
+@test_app.post("/other")
+async def other(body: dict):
+    calls["count"] += 1
+
+    return {"count": calls["count"], "body": body}
+
+
+@test_app.post("/reject")
+async def reject():
+    calls["count"] += 1
+
+    raise HTTPException(status_code=400, detail="Rejected")
+
+
+@test_app.post("/fail")
+async def fail():
+    calls["count"] += 1
+
+    raise RuntimeError("Failed")
+
+
+@test_app.post("/stream")
+async def stream(body: dict):
+    calls["count"] += 1
+
+    return StreamingResponse(
+        (f"{index}\n".encode() for index in range(3)),
+        media_type="application/x-ndjson",
+    )
+
+
+@test_app.post("/crash")
+async def crash():
+    calls["count"] += 1
+
+    return JSONResponse({"detail": "Crashed"}, status_code=500)
+
+
+async def test_idempotency_replays_response():
+    client = TestClient(test_app)
+    headers = {
+        "Idempotency-Key": "test_idempotency_replays_response",
+        "Authorization": "Bearer test",
+    }
+
+    first = client.post("/count", json={"a": 1}, headers=headers)
+    assert first.status_code == 200
+
+    count = calls["count"]
+
+    # Should not run the endpoint again
+    retry = client.post("/count", json={"a": 1}, headers=headers)
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert calls["count"] == count
+
+    # Keys are scoped to the credentials that sent them
+    other = client.post(
+        "/count",
+        json={"a": 1},
+        headers={**headers, "Authorization": "Bearer other"},
+    )
+    assert other.status_code == 200
+    assert calls["count"] == count + 1
+
+    # Should not allow reusing key for another request
+    response = client.post("/count", json={"a": 2}, headers=headers)
+    assert response.status_code == 422
+
+    # Requests without key are not affected
+    client.post("/count", json={"a": 1})
+    client.post("/count", json={"a": 1})
+    assert calls["count"] == count + 3
+
+
+async def test_idempotency_client_and_server_errors():
+    client = TestClient(test_app)
+
+    headers = {
+        "Idempotency-Key": "test_idempotency_client_errors",
+        "Authorization": "Bearer test",
+    }
+    client.post("/reject", headers=headers)
+    count = calls["count"]
+
+    # Client errors are replayed
+    response = client.post("/reject", headers=headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Rejected"}
+    assert calls["count"] == count
+
+    # Server errors can be retried
+    headers = {
+        "Idempotency-Key": "test_idempotency_server_errors",
+        "Authorization": "Bearer test",
+    }
+    client.post("/crash", headers=headers)
+    client.post("/crash", headers=headers)
+    assert calls["count"] == count + 2
+
+    assert (
+        await IdempotencyRecord.filter(key="test_idempotency_server_errors").count()
+        == 0
+    )
+
+    # Exceptions free the key as well
+    headers = {
+        "Idempotency-Key": "test_idempotency_exceptions",
+        "Authorization": "Bearer test",
+    }
+    with pytest.raises(RuntimeError):
+        client.post("/fail", headers=headers)
+    assert (
+        await IdempotencyRecord.filter(key="test_idempotency_exceptions").count() == 0
+    )
+
+
+async def test_idempotency_skipped_requests():
+    client = TestClient(test_app)
+    count = calls["count"]
+
+    # Anonymous requests are not stored
+    headers = {"Idempotency-Key": "test_idempotency_anonymous"}
+    client.post("/count", json={"a": 1}, headers=headers)
+    client.post("/count", json={"a": 1}, headers=headers)
+    assert calls["count"] == count + 2
+
+    # Neither are requests to other routes
+    headers = {
+        "Idempotency-Key": "test_idempotency_other_route",
+        "Authorization": "Bearer test",
+    }
+    client.post("/other", json={"a": 1}, headers=headers)
+    client.post("/other", json={"a": 1}, headers=headers)
+    assert calls["count"] == count + 4
+
+    assert (
+        await IdempotencyRecord.filter(
+            key__in=["test_idempotency_anonymous", "test_idempotency_other_route"]
+        ).count()
+        == 0
+    )
+
+
+async def test_idempotency_purge_expired():
+    await IdempotencyRecord.create(
+        key="test_idempotency_purge_expired", owner="expired", fingerprint=""
+    )
+    await IdempotencyRecord.create(
+        key="test_idempotency_purge_expired", owner="recent", fingerprint=""
+    )
+
+    expired = datetime.datetime.utcnow() - datetime.timedelta(
+        hours=idempotency.IDEMPOTENCY_KEY_TTL + 1
+    )
+    await IdempotencyRecord.filter(owner="expired").update(creation_date=expired)
+
+    assert await idempotency.purge_expired() >= 1
+    assert await IdempotencyRecord.filter(
+        key="test_idempotency_purge_expired"
+    ).values_list("owner", flat=True) == ["recent"]
+
+
+async def test_idempotency_streaming_and_large_requests(monkeypatch):
+    client = TestClient(test_app)
+    headers = {
+        "Idempotency-Key": "test_idempotency_streaming",
+        "Authorization": "Bearer test",
+    }
+
+    # Streamed responses finish and are replayed like any other
+    first = client.post("/stream", json={"a": 1}, headers=headers)
+    assert first.content == b"0\n1\n2\n"
+
+    retry = client.post("/stream", json={"a": 1}, headers=headers)
+    assert retry.content == first.content
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    # Bodies are only buffered up to a limit
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_MAX_BODY_SIZE", 8)
+    response = client.post(
+        "/count",
+        json={"a": "long"},
+        headers={**headers, "Idempotency-Key": "test_idempotency_large"},
+    )
+    assert response.status_code == 413
+
+    # Bulk uploads are streamed, so they are never buffered
+    paths = [re.compile(path) for path in idempotency.IDEMPOTENT_PATHS]
+    for path, expected in [
+        ("/organization/org/task/create", True),
+        ("/organization/org/task/task_1/fund", True),
+        ("/organization/org/task/create/bulk", False),
+        ("/organization/org/enroll", False),
+        ("/users/login", False),
+    ]:
+        assert any(pattern.fullmatch(path) for pattern in paths) == expected
+
+
+async def test_idempotency_lease():
+    client = TestClient(test_app)
+    headers = {
+        "Idempotency-Key": "test_idempotency_lease",
+        "Authorization": "Bearer test",
+    }
+
+    client.post("/count", json={"a": 1}, headers=headers)
+    count = calls["count"]
+
+    # A request still holding its key makes retries wait
+    await IdempotencyRecord.filter(key="test_idempotency_lease").update(
+        status_code=None
+    )
+    response = client.post("/count", json={"a": 1}, headers=headers)
+    assert response.status_code == 409
+
+    # Until its lease expires, as its worker may have died
+    lease_expired = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=idempotency.IDEMPOTENCY_LEASE + 1
+    )
+    await IdempotencyRecord.filter(key="test_idempotency_lease").update(
+        creation_date=lease_expired
+    )
+    response = client.post("/count", json={"a": 1}, headers=headers)
+    assert response.status_code == 200
+    assert calls["count"] == count + 1
+
+    record = await IdempotencyRecord.get(key="test_idempotency_lease")
+    assert record.status_code == 200
@@ -0,0 +1,51 @@
+from app.lib import cache, organization
+from app.model import User, Organization
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_get_organization(monkeypatch):
+    monkeypatch.setattr(organization, "organization_cache", cache.MemoryBackend())
+
+    user = await User.create(
+        type="organizer",
+        email="test_get_organization@email.com",
+        stake_address="stake_test_get_organization",
+    )
+    created_organization = await Organization.create(
+        identifier="test_get_organization_org_1",
+        name="Name",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=["math"],
+        admin=user,
+    )
+
+    assert await organization.get_organization("unknown_org") is None
+
+    cached_organization = await organization.get_organization(
+        "test_get_organization_org_1"
+    )
+    assert cached_organization == created_organization
+    assert cached_organization.areas == ["math"]
+    assert cached_organization.admin_id == user.id
+
+    # Should keep serving the cached organization until it is invalidated
+    await Organization.filter(id=created_organization.id).update(name="Edited")
+
+    cached_organization.areas.append("physics")
+    cached_organization = await organization.get_organization(
+        "test_get_organization_org_1"
+    )
+    assert cached_organization.name == "Name"
+    assert cached_organization.areas == ["math"]
+
+    await organization.invalidate_organization("test_get_organization_org_1")
+
+    cached_organization = await organization.get_organization(
+        "test_get_organization_org_1"
+    )
+    assert cached_organization.name == "Edited"
@@ -0,0 +1,74 @@
+from app.lib import pagination
+from app.model import User, Organization, OrganizationMembership, Task
+
+import datetime
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_fetch_page():
+    user = await User.create(
+        type="student",
+        email="test_fetch_page@email.com",
+        stake_address="stake_test_fetch_page",
+    )
+    organization = await Organization.create(
+        identifier="test_fetch_page_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization
+    )
+
+    # Some tasks share the same creation date
+    for index in range(7):
+        await Task.create(
+            identifier=f"test_fetch_page_task_{index}",
+            name="",
+            description="",
+            deadline=datetime.datetime(2024, 1, 1),
+            is_individual=True,
+            owner_membership=membership,
+            creation_date=datetime.datetime(2024, 1, 1 + index // 2),
+        )
+
+    queryset = Task.filter(organization=organization)
+
+    for descending in [True, False]:
+        pages = []
+        for page in range(1, 5):
+            tasks, _ = await pagination.fetch_page(
+                queryset, "creation_date", page, 2, descending=descending
+            )
+            pages.append([task.identifier for task in tasks])
+
+        # Following cursors should return the same pages
+        cursor_pages = []
+        cursor = None
+        while True:
+            tasks, next_cursor = await pagination.fetch_page(
+                queryset, "creation_date", 1, 2, cursor, descending=descending
+            )
+            cursor_pages.append([task.identifier for task in tasks])
+
+            if next_cursor is None:
+                break
+
+            cursor = pagination.decode_cursor(next_cursor)
+
+        assert cursor_pages == pages
+        assert sum(len(page) for page in pages) == 7
+
+        if descending:
+            assert pages[0] == ["test_fetch_page_task_6", "test_fetch_page_task_4"]
+        else:
+            assert pages[0] == ["test_fetch_page_task_0", "test_fetch_page_task_1"]
+
+    with pytest.raises(ValueError):
+        pagination.decode_cursor("invalid")
@@ -0,0 +1,79 @@
+from fastapi.encoders import jsonable_encoder
+
+from app import specs
+from app.lib import response, serialize
+
+import datetime
+import json
+import time
+
+
+def encoding_rate(encode, repeat: int = 200) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        size = len(encode())
+
+    return size * repeat / (time.perf_counter() - start)
+
+
+def validated_encoding(spec):
+    # What FastAPI does with returned specs: dump, validate again and encode
+    validated = type(spec).model_validate(spec.model_dump())
+
+    return json.dumps(jsonable_encoder(validated), separators=(",", ":")).encode()
+
+
+def test_encoding_benchmark(record_property):
+    date = datetime.datetime(2024, 1, 1, 12, 30, tzinfo=datetime.timezone.utc)
+
+    tasks = serialize.build(
+        specs.TaskSpec,
+        [
+            {
+                "identifier": f"task_{index}",
+                "name": f"Task {index}",
+                "description": "Description " * 20,
+                "deadline": date,
+                "is_individual": index % 2 == 0,
+                "is_approved_start": True,
+                "is_rejected_start": False,
+                "is_approved_completed": False,
+                "is_rejected_completed": False,
+                "is_rewards_claimed": False,
+                "status": "active",
+                "creation_date": date,
+            }
+            for index in range(20)
+        ],
+    )
+    actions = serialize.build(
+        specs.TaskActionSpec,
+        [
+            {
+                "name": f"Action {index}",
+                "description": "Description " * 20,
+                "is_submission": True,
+                "is_review": False,
+                "action_date": date,
+            }
+            for index in range(20)
+        ],
+    )
+
+    for name, spec in [
+        ("tasks", specs.TasksResponse(current_page=1, max_page=1, tasks=tasks)),
+        (
+            "actions",
+            specs.TaskActionsResponse(current_page=1, max_page=1, actions=actions),
+        ),
+    ]:
+        spec_response = response.SpecResponse(spec)
+
+        # Same JSON as pydantic would give
+        assert spec_response.body == spec.model_dump_json().encode()
+
+        fast_rate = encoding_rate(lambda: response.SpecResponse(spec).body)
+        validated_rate = encoding_rate(lambda: validated_encoding(spec))
+
+        record_property(f"{name}_bytes_per_second", int(fast_rate))
+        record_property(f"{name}_validated_bytes_per_second", int(validated_rate))
@@ -0,0 +1,59 @@
+from app import specs
+from app.lib import serialize
+from app.model import User, Organization, Group, GroupMembership
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_build():
+    user = await User.create(
+        type="student",
+        email="test_serialize_build@email.com",
+        stake_address="stake_test_serialize_build",
+    )
+    organization = await Organization.create(
+        identifier="test_serialize_build_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=["math"],
+        admin=user,
+    )
+    group = await Group.create(
+        identifier="test_serialize_build_group", name="", organization=organization
+    )
+    membership = await GroupMembership.create(group=group, user=user, accepted=True)
+
+    assert serialize.lookups(specs.UserSpec, "user__") == [
+        "user__type",
+        "user__email",
+        "user__stake_address",
+        "user__payment_address",
+        "user__active",
+        "user__register_date",
+    ]
+
+    # Should build the same specs as from_tortoise_orm
+    rows = await GroupMembership.filter(id=membership.id).values(
+        *serialize.lookups(specs.GroupMembershipExtendedSpec)
+    )
+    built = serialize.build(specs.GroupMembershipExtendedSpec, rows)
+
+    group_membership = await specs.GroupMembershipSpec.from_tortoise_orm(
+        await GroupMembership.get(id=membership.id)
+    )
+    expected = specs.GroupMembershipExtendedSpec(
+        **group_membership.model_dump(),
+        group=await specs.GroupSpec.from_tortoise_orm(await Group.get(id=group.id)),
+    )
+    assert [spec.model_dump() for spec in built] == [expected.model_dump()]
+
+    rows = await GroupMembership.filter(id=membership.id).values(
+        *serialize.lookups(specs.UserSpec, "user__")
+    )
+    built = serialize.build(specs.UserSpec, rows, "user__")
+    expected = await specs.UserSpec.from_tortoise_orm(await User.get(id=user.id))
+    assert built[0].model_dump() == expected.model_dump()
@@ -0,0 +1,79 @@
+from app.lib import task_status
+from app.model import User, Organization, OrganizationMembership, Task
+
+import datetime
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_transition():
+    user = await User.create(
+        type="student",
+        email="test_task_status_transition@email.com",
+        stake_address="stake_test_task_status_transition",
+    )
+    organization = await Organization.create(
+        identifier="test_task_status_transition_org_1",
+        name="",
+        description="",
+        students_password="pass123",
+        teachers_password="pass123",
+        supervisor_password="pass123",
+        areas=[],
+        admin=user,
+    )
+    membership = await OrganizationMembership.create(
+        user=user, organization=organization
+    )
+    task = await Task.create(
+        identifier="test_task_status_transition_task_1",
+        name="",
+        description="",
+        deadline=datetime.datetime(2024, 1, 1),
+        is_individual=True,
+        owner_membership=membership,
+    )
+    assert task.status == task_status.PENDING
+
+    with pytest.raises(task_status.TransitionError) as e:
+        await task_status.transition(task, "submit")
+    assert str(e.value) == "Task has not been approved by a teacher yet"
+
+    # The flags follow the status
+    await task_status.transition(task, "approve_start")
+    stored = await Task.get(id=task.id)
+    assert stored.status == task_status.ACTIVE
+    assert stored.is_approved_start and not stored.is_rejected_start
+
+    # Another request read the task before it was started
+    stale = await Task.get(id=task.id)
+    stale.status = task_status.PENDING
+    with pytest.raises(task_status.TransitionError) as e:
+        await task_status.transition(stale, "reject_start")
+    assert str(e.value) == "Task has already started"
+    assert stale.status == task_status.ACTIVE
+
+    deadline = datetime.datetime(2024, 2, 1, tzinfo=datetime.timezone.utc)
+    await task_status.transition(task, "submit")
+    await task_status.transition(task, "request_changes", deadline=deadline)
+    stored = await Task.get(id=task.id)
+    assert stored.status == task_status.ACTIVE
+    assert stored.deadline == deadline
+
+    await task_status.transition(task, "approve_submission")
+    with pytest.raises(task_status.TransitionError) as e:
+        await task_status.transition(task, "reject_submission")
+    assert str(e.value) == "Task is not active anymore"
+
+    stored = await Task.get(id=task.id)
+    assert stored.status == task_status.COMPLETED
+    assert stored.is_approved_completed and not stored.is_rejected_completed
+
+    # Flags of saved tasks always follow the status
+    stored.is_approved_completed = False
+    await stored.save()
+    stored = await Task.get(id=task.id)
+    assert stored.status == task_status.COMPLETED
+    assert stored.is_approved_completed
+
+    assert await task_status.transition_many([task.id], "approve_start") == 0
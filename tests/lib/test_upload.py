@@ -0,0 +1,73 @@
+from app.lib import upload
+
+import json
+import pytest
+
+
+async def stream(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start : start + size]
+
+
+async def collect(records) -> list:
+    return [record async for record in records]
+
+
+@pytest.mark.asyncio
+async def test_read_records():
+    items = [{"identifier": f"task_{index}", "name": "[a, b]"} for index in range(5)]
+    items.append({"identifier": "task_5", "name": "Comunicação"})
+
+    # Items and characters split across chunks at every position are still decoded
+    for size in [1, 3, 7, 1000]:
+        records = upload.read_records(
+            stream(json.dumps(items, indent=2, ensure_ascii=False).encode(), size),
+            upload.JSON_CONTENT_TYPE,
+            (upload.JSON_CONTENT_TYPE,),
+        )
+        assert await collect(records) == items
+
+        records = upload.read_records(
+            stream(b"email,area\na@email.com,math\n\nb@email.com,", size),
+            upload.CSV_CONTENT_TYPE,
+            (upload.CSV_CONTENT_TYPE,),
+        )
+        assert await collect(records) == [
+            {"email": "a@email.com", "area": "math"},
+            {"email": "b@email.com", "area": ""},
+        ]
+
+    with pytest.raises(upload.UploadFormatError):
+        await collect(
+            upload.read_records(
+                stream(b'{"identifier": "task"}', 4),
+                upload.JSON_CONTENT_TYPE,
+                (upload.JSON_CONTENT_TYPE,),
+            )
+        )
+
+    with pytest.raises(upload.UploadFormatError):
+        await collect(
+            upload.read_records(
+                stream(b'[{"name": "\xff"}]', 4),
+                upload.JSON_CONTENT_TYPE,
+                (upload.JSON_CONTENT_TYPE,),
+            )
+        )
+
+    with pytest.raises(upload.UploadFormatError):
+        upload.read_records(
+            stream(b"", 4), upload.CSV_CONTENT_TYPE, (upload.JSON_CONTENT_TYPE,)
+        )
+
+    chunks = await collect(
+        upload.read_chunks(
+            upload.read_records(
+                stream(b'{"a": 1}\nnot json\n{"a": 2}\n', 5),
+                upload.NDJSON_CONTENT_TYPE,
+                (upload.NDJSON_CONTENT_TYPE,),
+            ),
+            size=2,
+        )
+    )
+    assert chunks == [[(1, {"a": 1}), (2, None)], [(3, {"a": 2})]]